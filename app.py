@@ -1,104 +1,25 @@
-import os
-import openai
 import streamlit as st
-import pymysql
-import psycopg2
 from dotenv import load_dotenv
-from pygments import highlight
-from pygments.lexers import SqlLexer
-from pygments.formatters import HtmlFormatter
-import google.generativeai as genai
-import re
+from chatdb import engine
+from chatdb.highlight import highlight_sql
 
 
 # Load .env configuration
 load_dotenv()
 
-# Set API keys
-openai.api_key = os.getenv("OPENAI_API_KEY")
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Load DB config
-DB_TYPE = os.getenv("DB_TYPE", "mysql").lower()
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = int(os.getenv("DB_PORT", 3306))
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "")
-DB_NAME = os.getenv("DB_NAME", "testdb")
-AI_PROVIDER = os.getenv("AI_PROVIDER", "OPENAI").upper()
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
-
-# Utility: SQL syntax highlighting
-def highlight_sql(code, theme="monokai"):
-    formatter = HtmlFormatter(style=theme, noclasses=True)
-    return highlight(code, SqlLexer(), formatter)
-
-# Connect to DB
-def connect_to_db():
-    if DB_TYPE == "postgresql":
-        return psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            dbname=DB_NAME
-        )
-    elif DB_TYPE == "mysql":
-        return pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-    else:
-        raise ValueError("Unsupported DB_TYPE")
+# DB and AI config; drivers and provider SDKs load on first use
+settings = engine.Settings.from_env()
+AI_PROVIDER = settings.ai_provider
 
 # Generate SQL with AI
 def generate_sql(prompt):
-    system_prompt = f"You are an expert SQL assistant for a {DB_TYPE} database. Generate only the SQL query, nothing else."
-
-    if AI_PROVIDER == "GEMINI":
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(f"{system_prompt}\nQuery: {prompt}")
-        try:
-            return response.text.strip()
-        except AttributeError:
-            return response.candidates[0].content.parts[0].text.strip()
-
-    elif AI_PROVIDER == "OPENAI":
-        response = openai.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
-        )
-        return response.choices[0].message.content.strip()
-    else:
-        raise ValueError("Unsupported AI_PROVIDER. Use 'OPENAI' or 'GEMINI'.")
+    return engine.generate_sql(settings, prompt)
 
 
 # Execute query
 def execute_query(sql):
-    conn = connect_to_db()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(sql)
-        if sql.lower().strip().startswith("select"):
-            columns = [desc[0] for desc in cursor.description]
-            data = cursor.fetchall()
-            return columns, data, None
-        else:
-            conn.commit()
-            return None, "Query executed successfully.", None
-    except Exception as e:
-        return None, None, str(e)
-    finally:
-        cursor.close()
-        conn.close()
+    columns, data, error, _ = engine.run_query(settings, sql)
+    return columns, data, error
 
 # ─────────────────────────────
 # Streamlit UI Starts Here
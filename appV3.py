@@ -1,15 +1,8 @@
 import os
-import openai
 import streamlit as st
-import pymysql
-import psycopg2
 from dotenv import load_dotenv, set_key
-from pygments import highlight
-from pygments.lexers import SqlLexer
-from openai import OpenAI
-from pygments.formatters.html import HtmlFormatter
-import google.generativeai as genai
-import re
+from chatdb import engine
+from chatdb.highlight import highlight_sql
 
 
 st.set_page_config(page_title="DB Chat Assistant", layout="wide")
@@ -115,112 +108,31 @@ if not st.session_state.config_expanded:
 # -- rest of your app code below (SQL generation, execution, etc.) --
 
 
-# Set API keys for use in code
-openai.api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
-genai.configure(api_key=gemini_api_key or os.getenv("GEMINI_API_KEY"))
-
 openai_model = openai_model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 gemini_model = gemini_model or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
 ai_provider = ai_provider or os.getenv("AI_PROVIDER", "OPENAI").upper()
 
-# SQL syntax highlighting function
-def highlight_sql(code, theme="monokai"):
-    formatter = HtmlFormatter(style=theme, noclasses=True)
-    return highlight(code, SqlLexer(), formatter)
-
-# Connect to the database
-def connect_to_db():
-    if db_type == "postgresql":
-        return psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            dbname=db_name
-        )
-    elif db_type == "mysql":
-        return pymysql.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-    else:
-        raise ValueError("Unsupported DB_TYPE")
+# Everything below runs through chatdb.engine; drivers and provider SDKs load on first use
+provider_settings = {
+    "OPENAI": (openai_model, openai_api_key or os.getenv("OPENAI_API_KEY", ""), ""),
+    "GEMINI": (gemini_model, gemini_api_key or os.getenv("GEMINI_API_KEY", ""), os.getenv("GEMINI_BASE_URL", "")),
+    "DEEPSEEK": (deepseek_model, deepseek_api_key, deepseek_base_url),
+}
+settings = engine.Settings(db_type, db_host, db_port, db_user, db_password, db_name,
+                           ai_provider, *provider_settings[ai_provider])
 
 # Generate SQL query using AI
 def generate_sql(prompt):
-    system_prompt = f"You are an expert SQL assistant for a {db_type} database. Generate only the SQL query, nothing else."
-
-    if ai_provider == "GEMINI":
-        model = genai.GenerativeModel(gemini_model)
-        response = model.generate_content(f"{system_prompt}\nQuery: {prompt}")
-        try:
-            return response.text.strip()
-        except AttributeError:
-            return response.candidates[0].content.parts[0].text.strip()
-
-    elif ai_provider == "OPENAI":
-        response = openai.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
-        )
-        return response.choices[0].message.content.strip()
-
-    elif ai_provider == "DEEPSEEK":
-        client = OpenAI(api_key=deepseek_api_key, base_url=deepseek_base_url)
-        response = client.chat.completions.create(
-            model=deepseek_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
-        )
-        return response.choices[0].message.content.strip()
-
-    else:
-        raise ValueError("Unsupported AI_PROVIDER. Use 'OPENAI', 'GEMINI', or 'DEEPSEEK'.")
+    return engine.generate_sql(settings, prompt)
 
 
 # Extract query
-def extract_sql(raw_sql):
-    # Remove Markdown fenced code blocks like ```sql ... ```
-    raw_sql = re.sub(r"```sql\s*([\s\S]*?)\s*```", r"\1", raw_sql, flags=re.IGNORECASE)
-    raw_sql = re.sub(r"```([\s\S]*?)```", r"\1", raw_sql)  # in case it's just ```...```
-
-    # Remove any leftover backticks or labels like 'sql'
-    raw_sql = raw_sql.replace("`", "").strip()
-
-    # Remove any extra 'sql' that was on a line by itself
-    lines = raw_sql.splitlines()
-    lines = [line for line in lines if line.strip().lower() != "sql"]
-    
-    return "\n".join(lines).strip()
+extract_sql = engine.extract_sql
 
 # Execute SQL query and fetch results
 def execute_query(sql):
-    conn = connect_to_db()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(sql)
-        if sql.lower().strip().startswith("select"):
-            columns = [desc[0] for desc in cursor.description]
-            data = cursor.fetchall()
-            return columns, data, None
-        else:
-            conn.commit()
-            return None, "Query executed successfully.", None
-    except Exception as e:
-        return None, None, str(e)
-    finally:
-        cursor.close()
-        conn.close()
+    columns, data, error, _ = engine.run_query(settings, sql)
+    return columns, data, error
 
 # ─────────────────────────────
 # Streamlit UI Starts Here
@@ -1,18 +1,27 @@
+import contextvars
 import os
-import openai
 import streamlit as st
-import pymysql
-import psycopg2
 from dotenv import load_dotenv, set_key
-from pygments import highlight
-from pygments.lexers import SqlLexer
-from openai import OpenAI
-from pygments.formatters.html import HtmlFormatter
-import google.generativeai as genai
-import re
-import requests
-import json
-import os
+import time
+import uuid
+from chatdb import engine
+from chatdb.engine import Settings, execute_query, extract_sql
+from chatdb.pool import pool_stats
+from chatdb.llm_cache import get_sql_cache
+from chatdb.columnar import ColumnarResult
+from chatdb.schema import get_catalog
+from chatdb.llm import get_runner
+from chatdb.sql_extract import SqlExtractor
+from chatdb.hedging import hedge_provider, hedge_stats
+from chatdb.highlight import highlight_sql
+from chatdb.result_store import ResultStore
+from chatdb.result_cache import get_result_cache
+from chatdb.prompt_prefix import get_prefix_cache
+from chatdb.planner import add_limit, describe_plan, plan_query
+from chatdb.query_control import RunningQuery, get_query_executor, query_stats
+from chatdb.repair import RepairPolicy, repair_enabled, repair_query, repair_stats, repairable
+from chatdb.metrics import start_metrics_server, touch_session
+from chatdb.tracing import current_span, span, stage_stats, start_trace
 
 
 
@@ -29,6 +38,12 @@ OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")  # default if not set
 if "config_expanded" not in st.session_state:
     st.session_state.config_expanded = True
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+touch_session(st.session_state.session_id)
+# Once per process; later reruns get the already bound port back
+metrics_port = start_metrics_server()
+
 with st.sidebar.expander("🛠️ Configuration Panel", expanded=st.session_state.config_expanded):
     st.title("Database Configuration")
     config_mode = st.radio("Configuration Mode", ["Manual Entry"])
@@ -141,172 +156,290 @@ if not st.session_state.config_expanded:
 # -- rest of your app code below (SQL generation, execution, etc.) --
 
 
-# Set API keys for use in code
-openai.api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
-genai.configure(api_key=gemini_api_key or os.getenv("GEMINI_API_KEY"))
-
 openai_model = openai_model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 gemini_model = gemini_model or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
 ai_provider = ai_provider or os.getenv("AI_PROVIDER", "OPENAI").upper()
 
-# SQL syntax highlighting function
-def highlight_sql(code, theme="monokai"):
-    formatter = HtmlFormatter(style=theme, noclasses=True)
-    return highlight(code, SqlLexer(), formatter)
-
-# Connect to the database
-def connect_to_db():
-    if db_type == "postgresql":
-        return psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            dbname=db_name
-        )
-    elif db_type == "mysql":
-        return pymysql.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-    else:
-        raise ValueError("Unsupported DB_TYPE")
-
-# Generate SQL query using AI
+# Describe the selected database and provider for the engine (chatdb/engine.py);
+# drivers and provider SDKs are imported there on first use, not at startup
+provider_settings = {
+    "OPENAI": (openai_model, openai_api_key or os.getenv("OPENAI_API_KEY"), ""),
+    "GEMINI": (gemini_model, gemini_api_key or os.getenv("GEMINI_API_KEY"), os.getenv("GEMINI_BASE_URL", "")),
+    "OLLAMA": (OLLAMA_MODEL, "", OLLAMA_BASE_URL),
+    "DEEPSEEK": (deepseek_model, deepseek_api_key, deepseek_base_url),
+}
+settings = Settings(db_type, db_host, db_port, db_user, db_password, db_name,
+                    ai_provider, *provider_settings[ai_provider])
+# Loads the model in the background while the page renders; only the first rerun sends it
+engine.preload_model(settings)
+
+
+# Generate SQL query using AI, streaming the answer into the page
 def generate_sql(prompt):
-    system_prompt = f"You are an expert SQL assistant for a {db_type} database. Generate only the SQL query, nothing else."
-
-    if ai_provider == "GEMINI":
-        model = genai.GenerativeModel(gemini_model)
-        response = model.generate_content(f"{system_prompt}\nQuery: {prompt}")
-        try:
-            return response.text.strip()
-        except AttributeError:
-            return response.candidates[0].content.parts[0].text.strip()
-
-    elif ai_provider == "OPENAI":
-        response = openai.chat.completions.create(
-            model=openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
-        )
-        return response.choices[0].message.content.strip()
-    
-    elif ai_provider == "OLLAMA":
-        url = f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/chat"
-        model = os.getenv("OLLAMA_MODEL", "llama3")
-
-        payload = {
-            "model": OLLAMA_MODEL,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a SQL expert. Convert the user's natural language into SQL."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "stream": True
-        }
-
-        try:
-            response = requests.post(url, json=payload, stream=True)
-            response.raise_for_status()
-
-            sql_output = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        data = json.loads(line.decode("utf-8"))
-                        sql_output += data.get("message", {}).get("content", "")
-                    except Exception as e:
-                        return f"Error decoding line: {e}\nLine: {line.decode('utf-8')}"
-            return sql_output.strip()
-        except requests.exceptions.RequestException as e:
-            return f"Request failed: {e}"
-
-
-    elif ai_provider == "DEEPSEEK":
-        client = OpenAI(api_key=deepseek_api_key, base_url=deepseek_base_url)
-        response = client.chat.completions.create(
-            model=deepseek_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
-        )
-        return response.choices[0].message.content.strip()
+    return engine.generate_sql(settings, prompt, call=call_ai_provider)
 
-    else:
-        raise ValueError("Unsupported AI_PROVIDER. Use 'OPENAI', 'GEMINI', or 'DEEPSEEK'.")
-
-
-# Extract query
-def extract_sql(raw_sql):
-    # Remove Markdown code blocks (e.g., ```sql ... ```)
-    raw_sql = re.sub(r"```sql\s*([\s\S]*?)\s*```", r"\1", raw_sql, flags=re.IGNORECASE)
-    raw_sql = re.sub(r"```([\s\S]*?)```", r"\1", raw_sql)  # generic fallback
-    raw_sql = raw_sql.replace("`", "").strip()
-
-    # Remove lines that are purely explanatory
-    keywords = ['select', 'insert', 'update', 'delete', 'create', 'drop', 'alter']
-    sql_lines = []
-    for line in raw_sql.splitlines():
-        # Keep only lines that start with SQL keywords or are indented parts of queries
-        if any(line.strip().lower().startswith(k) for k in keywords) or line.strip().endswith(';') or line.strip().startswith("("):
-            sql_lines.append(line.strip())
-
-    return " ".join(sql_lines).strip()
-
-# Send to Ollama
-def send_to_ollama(message):
-    url = f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/chat"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "llama3",  # or the name of your Ollama model
-        "messages": [{"role": "user", "content": message}]
-    }
-
-    response = requests.post(url, headers=headers, json=data)
-
-    # Debug: print raw response text
-    print("Raw response from Ollama:")
-    print(response.text)
-
-    # Optional: only use this if you're sure it's a single JSON object
-    # parsed = response.json()
-    # return parsed
-
-
-# Execute SQL query and fetch results
-def execute_query(sql):
-    conn = connect_to_db()
-    cursor = conn.cursor()
+
+# Stop reading the model's output once a complete statement has arrived
+STOP_AFTER_STATEMENT = os.getenv("LLM_STOP_AFTER_STATEMENT", "0") == "1"
+
+
+def call_ai_provider(prompt, system_prompt):
+    # A new prompt supersedes this session's previous one if it is still running
+    previous = st.session_state.get("llm_stream")
+    if previous is not None and not previous.done():
+        previous.cancel()
+    stream = engine.stream_sql(settings, system_prompt, prompt)
+    st.session_state.llm_stream = stream
+
+    # Render tokens as they arrive; every st call also lets Streamlit stop this
+    # run when the user resubmits
+    status = st.empty()
+    output = st.empty()
+    extractor = SqlExtractor()
+    early_sql = None
+    stream_started = False
+    started = last_render = time.monotonic()
     try:
-        cursor.execute(sql)
-        if sql.lower().strip().startswith("select"):
-            columns = [desc[0] for desc in cursor.description]
-            data = cursor.fetchall()
-            return columns, data, None
-        else:
-            conn.commit()
-            return None, "Query executed successfully.", None
+        for piece in stream:
+            if piece and not stream_started:
+                stream_started = True
+                current_span().set(first_token_ms=round((time.monotonic() - started) * 1000, 1))
+            # The extractor scans each piece once, so the SQL is ready without re-reading the output
+            if piece and early_sql is None and extractor.feed(piece):
+                early_sql = extractor.sql
+                output.code(early_sql, language="sql")
+                if STOP_AFTER_STATEMENT:
+                    stream.close()
+                    break
+            now = time.monotonic()
+            if now - last_render >= 0.1:
+                last_render = now
+                if early_sql is None:
+                    output.code("".join(stream.parts), language="sql")
+                hedge = " (and its hedge)" if getattr(stream, "hedged", False) else ""
+                status.caption(f"{'Statement complete, finishing' if early_sql else 'Generating'} "
+                               f"with {ai_provider}{hedge}... {now - started:.1f}s")
+    finally:
+        # A rerun (any widget click) stops this script mid-stream; don't leave the call running
+        if not stream.done():
+            stream.cancel()
+    status.empty()
+    output.empty()
+    return stream.text
+
+
+def show_dataframe(data):
+    with span("render", rows=len(data)):
+        if isinstance(data, ColumnarResult):
+            data = data.to_arrow()
+        st.dataframe(data, use_container_width=True, hide_index=True)
+
+
+# Per-stage timings of the request that produced a chat message (chatdb/tracing.py)
+def show_timings(record):
+    timings = record.get("timings")
+    if not timings:
+        return
+    total = sum(t["ms"] for t in timings if t["depth"] == 0)
+    with st.expander(f"⏱️ Timings ({total:.0f} ms)"):
+        lines = []
+        for t in timings:
+            details = " ".join(f"{k}={v}" for k, v in t["attributes"].items() if v is not None)
+            name = "  " * t["depth"] + t["name"]
+            lines.append(f"{name:<24} {t['ms']:10.1f} ms  {details}".rstrip())
+        st.code("\n".join(lines), language="text")
+
+
+# Result sets live in a per-session on-disk store; history records keep a handle
+def get_result_store():
+    if "result_store" not in st.session_state:
+        st.session_state.result_store = ResultStore()
+    return st.session_state.result_store
+
+
+def record_data(record):
+    if record.get("result_id") is None:
+        return record["data"]
+    return get_result_store().get(record["result_id"])
+
+
+# Fetch the next page of a streamed result into its history record
+def load_more_rows(record):
+    stream = record.get("stream")
+    if stream is None:
+        return
+    try:
+        rows = stream.fetch_page()
+        data = record_data(record)
+        data.extend(rows)
+        get_result_store().update(record["result_id"], data)
+        record["row_count"] = len(data)
+        record["load_error"] = None
     except Exception as e:
-        return None, None, str(e)
+        # The rows already fetched stay on screen; the failure is shown under them
+        record["load_error"] = str(e)
+    if stream.closed:
+        record["stream"] = None
+        record["truncated"] = stream.truncated
+
+
+# Only the latest result keeps its server-side cursor (and pooled connection) open
+def close_open_streams():
+    for record in st.session_state.chat_history:
+        if record.get("stream") is not None:
+            record["stream"].close()
+            record["stream"] = None
+
+
+def render_result_footer(record, index):
+    stream = record.get("stream")
+    if stream is not None and stream.closed:
+        # Closed by the idle reaper, or reclaimed for another query
+        record["stream"] = None
+        record["truncated"] = stream.truncated
+    if record.get("stream") is not None:
+        st.caption(f"Showing the first {record['row_count']} rows.")
+        st.button("⬇️ Load more rows", key=f"load_more_{index}", on_click=load_more_rows, args=(record,))
+    elif record.get("truncated"):
+        st.caption(f"Stopped after {record['row_count']} rows ({record['truncated']} reached).")
+    if record.get("load_error"):
+        st.warning(f"Could not load more rows: {record['load_error']}")
+
+
+PLAN_QUERIES = os.getenv("PLAN_QUERIES", "1") == "1"
+PLAN_AUTO_LIMIT = int(os.getenv("PLAN_AUTO_LIMIT", 1000))
+
+
+def cancel_running_query():
+    control = st.session_state.get("running_query")
+    if control is not None:
+        control.cancel()
+
+
+# Run the query on a worker thread and poll it, so a click on Cancel (or any
+# other widget) can stop this run; an abandoned query is cancelled on the server
+def execute_record(record, timeout=None):
+    close_open_streams()
+    control = RunningQuery(db_type, settings.connect, timeout=timeout)
+    st.session_state.running_query = control
+    # The worker thread's spans join this request's trace
+    future = get_query_executor().submit(contextvars.copy_context().run, execute_query, settings, record["sql"], control)
+    status = st.empty()
+    cancel_slot = st.empty()
+    cancel_slot.button("⏹️ Cancel query", on_click=cancel_running_query)
+    started = time.monotonic()
+    try:
+        while not future.done():
+            status.caption(f"Executing SQL... {time.monotonic() - started:.1f}s")
+            time.sleep(0.1)
     finally:
-        cursor.close()
-        conn.close()
+        if not future.done():
+            control.cancel()
+            record["error"] = "Query cancelled."
+            st.session_state.chat_history.append(record)
+        st.session_state.running_query = None
+    status.empty()
+    cancel_slot.empty()
+
+    columns, data, error, stream = future.result()
+    record.update(columns=columns, error=error, stream=stream)
+    if isinstance(data, str) or not data:
+        record["data"] = data
+    else:
+        record["result_id"] = get_result_store().put(data)
+        record["row_count"] = len(data)
+    return data
+
+
+def repair_record(record):
+    # Feed the database error back to the model; each candidate runs like any other query
+    policy = RepairPolicy()
+    status = st.empty()
+
+    def execute_candidate(sql):
+        candidate = dict(record, sql=sql, error=None, plan=None)
+        if PLAN_QUERIES:
+            candidate["plan"] = plan_query(settings.pool(), db_type, sql)
+            if candidate["plan"]["action"] == "confirm":
+                return f"Not executed: {candidate['plan']['reason']}.", None
+            candidate["sql"] = candidate["plan"]["sql"]
+        data = execute_record(candidate, timeout=policy.query_timeout())
+        return candidate["error"], (candidate, data)
+
+    def show_attempt(attempt):
+        status.caption(f"Repair attempt {attempt['attempt']}/{policy.max_attempts}: {attempt['outcome']} "
+                       f"(+{attempt['total_ms']:.0f} ms)")
+
+    with st.spinner("Query failed, asking the model to repair it..."):
+        result = repair_query(settings, record["prompt"], record["sql"], record["error"],
+                              execute=execute_candidate, policy=policy, on_attempt=show_attempt)
+    status.empty()
+    record["repairs"] = result.attempts
+    if not result.repaired:
+        return None
+    candidate, data = result.result
+    record.update({k: v for k, v in candidate.items() if k not in ("prompt", "repairs")})
+    return data
+
+
+def describe_repairs(record):
+    attempts = record.get("repairs")
+    if not attempts:
+        return None
+    added = sum(a["total_ms"] for a in attempts) / 1000
+    if record["error"]:
+        return f"🔧 {len(attempts)} repair attempt(s) failed (+{added:.1f}s)."
+    return f"🔧 Repaired after {len(attempts)} attempt(s) (+{added:.1f}s)."
+
+
+def run_and_show(record):
+    data = execute_record(record)
+    if record["error"] and repair_enabled() and repairable(record["error"]):
+        repaired = repair_record(record)
+        if repaired is not None:
+            data = repaired
+            st.markdown(highlight_sql(record["sql"], theme), unsafe_allow_html=True)
+    repair_text = describe_repairs(record)
+    if repair_text:
+        st.caption(repair_text)
+    if record["error"]:
+        st.error(f"Error: {record['error']}")
+    elif isinstance(data, str):
+        st.success(data)
+    else:
+        if data:
+            st.success("Query executed successfully.")
+            show_dataframe(data)
+            render_result_footer(record, len(st.session_state.chat_history))
+        else:
+            st.info("Query executed, but returned no results.")
+    st.session_state.chat_history.append(record)
+
+
+# Callbacks for a query held back by the cost guardrails; the confirmed query
+# runs in the script body below so it can be cancelled like any other
+def confirm_pending(limit=None):
+    record = st.session_state.pop("pending_record", None)
+    if record is None:
+        return
+    if limit:
+        record["sql"] = add_limit(record["sql"], limit, settings.db_type)
+        record["plan"]["action"] = "limit"
+    else:
+        record["plan"]["action"] = "confirmed"
+    st.session_state.confirmed_record = record
+
+
+def cancel_pending():
+    record = st.session_state.pop("pending_record", None)
+    if record is None:
+        return
+    record["plan"]["action"] = "declined"
+    record["error"] = "Not executed: the estimated cost was above the confirmation threshold."
+    st.session_state.chat_history.append(record)
+
+
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 10))
 
 # ─────────────────────────────
 # Streamlit UI Starts Here
@@ -322,43 +455,138 @@ theme = st.selectbox("🎨 Choose SQL Highlight Theme", [
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
+# Only one page of history is rendered per rerun; page 1 holds the newest messages
+st.subheader("🗨️ Chat with Database")
+history_size = len(st.session_state.chat_history)
+page_count = max(1, -(-history_size // CHAT_PAGE_SIZE))
+page = 1
+if page_count > 1:
+    page = st.selectbox("History page", range(1, page_count + 1),
+                        format_func=lambda p: "Latest" if p == 1 else f"Page {p} of {page_count}")
+page_end = history_size - (page - 1) * CHAT_PAGE_SIZE
+page_start = max(0, page_end - CHAT_PAGE_SIZE)
+visible_history = list(enumerate(st.session_state.chat_history))[page_start:page_end]
+
 # Sidebar - Chat History
 with st.sidebar:
     st.header("📝 Chat History")
-    if st.session_state.chat_history:
-        for i, record in enumerate(reversed(st.session_state.chat_history)):
-            with st.expander(f"Query #{len(st.session_state.chat_history) - i}"):
+    if visible_history:
+        for index, record in reversed(visible_history):
+            with st.expander(f"Query #{index + 1}"):
                 st.markdown(f"**Prompt:** {record['prompt']}")
                 st.markdown(highlight_sql(record["sql"], theme), unsafe_allow_html=True)
                 if record['error']:
                     st.error(f"Error: {record['error']}")
                 elif isinstance(record['data'], str):
                     st.success(record['data'])
-                elif record['data']:
-                    st.write(f"Result: {len(record['data'])} rows")
+                elif record['row_count']:
+                    st.write(f"Result: {record['row_count']} rows")
                 else:
                     st.info("No results or non-select query.")
     else:
         st.info("No chat history yet.")
 
+    with st.expander("🗂️ Schema Catalog"):
+        catalog = get_catalog(db_type, db_host, db_port, db_user, db_name)
+        st.json(catalog.stats())
+        if st.button("Refresh schema now"):
+            try:
+                catalog.refresh(settings.pool(), force=True)
+            except Exception as e:
+                st.error(f"Schema refresh failed: {e}")
+
+    with st.expander("⏱️ LLM Latency"):
+        llm_stats = get_runner().stats()
+        if llm_stats:
+            st.json(llm_stats)
+            st.caption("Provider clients")
+            st.json(get_runner().client_stats())
+        else:
+            st.caption("No LLM calls yet.")
+        if ai_provider == "OLLAMA":
+            st.caption("Ollama keep-alive")
+            st.json(get_runner().ollama_stats())
+
+    if hedge_provider(ai_provider):
+        with st.expander("🏁 Hedged Requests"):
+            st.json(hedge_stats())
+            st.caption(f"{hedge_provider(ai_provider)} is asked too when {ai_provider} is slow to start "
+                       f"(HEDGE_AFTER={os.getenv('HEDGE_AFTER', 'p95')})")
+
+    with st.expander("🧠 SQL Cache"):
+        st.json(get_sql_cache().stats())
+        if st.button("Clear SQL cache"):
+            get_sql_cache().clear()
+
+    with st.expander("📌 Prompt Prefix"):
+        st.json(get_prefix_cache().stats())
+        st.caption("Share of prompt tokens served from the provider's cache: cached_ratio under ⏱️ LLM Latency")
+
+    with st.expander("🗃️ Result Cache"):
+        st.json(get_result_cache().stats())
+        if st.button("Clear result cache"):
+            get_result_cache().invalidate(settings.pool_key())
+
+    with st.expander("💸 Expensive Queries"):
+        planned = [r for r in st.session_state.chat_history if r.get("plan") and r["plan"]["estimated_cost"] is not None]
+        planned.sort(key=lambda r: r["plan"]["estimated_cost"], reverse=True)
+        if planned:
+            for r in planned[:5]:
+                st.markdown(f"**{r['prompt'][:60]}** — {r['plan']['action']}")
+                st.caption(describe_plan(r["plan"]))
+        else:
+            st.caption("No planned queries yet.")
+
+    with st.expander("⏹️ Query Execution"):
+        st.json(query_stats())
+        st.caption(f"Execution budget: {os.getenv('QUERY_TIMEOUT', '30')}s per query")
+
+    with st.expander("⏱️ Stage Timings"):
+        timings = stage_stats()
+        if timings:
+            st.json(timings)
+        else:
+            st.caption("No traced requests yet." if os.getenv("TRACING", "1") == "1" else "Off (set TRACING=1)")
+
+    if metrics_port:
+        st.caption(f"📈 Prometheus metrics on port {metrics_port} at /metrics")
+
+    with st.expander("🔧 Self-repair"):
+        st.json(repair_stats())
+        st.caption("On" if repair_enabled() else "Off (set REPAIR_MODE=1)")
+
+    with st.expander("🔌 Connection Pool"):
+        stats = pool_stats()
+        if stats:
+            st.json(stats)
+        else:
+            st.caption("No connections opened yet.")
+
 
 # Chat Display
-st.subheader("🗨️ Chat with Database")
-if st.session_state.chat_history:
-    for record in st.session_state.chat_history:
+if visible_history:
+    for index, record in visible_history:
         with st.chat_message("user"):
             st.markdown(record["prompt"])
         with st.chat_message("assistant"):
             st.markdown("**Generated SQL:**")
             st.markdown(highlight_sql(record["sql"], theme), unsafe_allow_html=True)
+            plan_text = describe_plan(record.get("plan"))
+            if plan_text:
+                st.caption(plan_text)
+            repair_text = describe_repairs(record)
+            if repair_text:
+                st.caption(repair_text)
             if record["error"]:
                 st.error(f"Error: {record['error']}")
             elif isinstance(record["data"], str):
                 st.success(record["data"])
-            elif record["data"]:
-                st.dataframe(record["data"], use_container_width=True, hide_index=True)
+            elif record["row_count"]:
+                show_dataframe(record_data(record))
+                render_result_footer(record, index)
             else:
                 st.info("No results returned.")
+            show_timings(record)
 
 # Input area
 user_prompt = st.text_area("Ask something about your database:", placeholder="E.g. Show me all users who signed up in the last 7 days.")
@@ -368,41 +596,71 @@ if st.button("Generate & Execute SQL"):
     if not user_prompt.strip():
         st.warning("Please enter a prompt.")
     else:
-        with st.spinner(f"Generating SQL with {ai_provider}..."):
-            # sql_query = generate_sql(user_prompt)
-            raw_sql = generate_sql(user_prompt)
-            sql_query = extract_sql(raw_sql)
-            st.code(raw_sql, language="markdown")
-            st.code(sql_query, language="sql")
-
-        st.markdown(highlight_sql(sql_query, theme), unsafe_allow_html=True)
-
-        execute = st.checkbox("Execute query?", value=True)
-
-        if execute:
-            with st.spinner("Executing SQL..."):
-                columns, data, error = execute_query(sql_query)
-
-            if error:
-                st.error(f"Error: {error}")
-            elif isinstance(data, str):
-                st.success(data)
+        with start_trace("chat", provider=ai_provider, model=settings.model, db_type=db_type) as trace:
+            with st.spinner(f"Generating SQL with {ai_provider}..."):
+                # sql_query = generate_sql(user_prompt)
+                try:
+                    raw_sql = generate_sql(user_prompt)
+                except Exception as e:
+                    st.error(f"SQL generation failed: {e}")
+                    st.stop()
+                sql_query = extract_sql(raw_sql)
+                st.code(raw_sql, language="markdown")
+                st.code(sql_query, language="sql")
+
+            st.markdown(highlight_sql(sql_query, theme), unsafe_allow_html=True)
+
+            execute = st.checkbox("Execute query?", value=True)
+
+            record = {
+                "prompt": user_prompt,
+                "sql": sql_query,
+                "columns": None,
+                "data": None,
+                "result_id": None,
+                "row_count": 0,
+                "error": None,
+                "stream": None,
+                "truncated": None,
+                "plan": None,
+                "repairs": None,
+                "timings": None,
+            }
+
+            if execute and PLAN_QUERIES:
+                record["plan"] = plan_query(settings.pool(), db_type, sql_query)
+                record["sql"] = record["plan"]["sql"]
+                plan_text = describe_plan(record["plan"])
+                if plan_text:
+                    st.caption(plan_text)
+
+            if execute and record["plan"] and record["plan"]["action"] == "confirm":
+                st.session_state.pending_record = record
+            elif execute:
+                run_and_show(record)
             else:
-                if data:
-                    st.success("Query executed successfully.")
-                    st.dataframe(data, use_container_width=True, hide_index=True)
-                else:
-                    st.info("Query executed, but returned no results.")
-        else:
-            columns, data, error = None, None, None
-
-        st.session_state.chat_history.append({
-            "prompt": user_prompt,
-            "sql": sql_query,
-            "columns": columns,
-            "data": data,
-            "error": error,
-        })
+                st.session_state.chat_history.append(record)
+        record["timings"] = trace.timings()
+        show_timings(record)
+
+confirmed = st.session_state.pop("confirmed_record", None)
+if confirmed:
+    with start_trace("chat.confirmed", provider=ai_provider, db_type=db_type) as trace:
+        st.markdown(highlight_sql(confirmed["sql"], theme), unsafe_allow_html=True)
+        run_and_show(confirmed)
+    # Generation was traced in the run that asked for confirmation
+    confirmed["timings"] = (confirmed.get("timings") or []) + trace.timings()
+    show_timings(confirmed)
+
+# A query held back by the guardrails waits here until the user decides
+pending = st.session_state.get("pending_record")
+if pending:
+    st.warning(f"This query looks expensive: {pending['plan']['reason']}.")
+    st.markdown(highlight_sql(pending["sql"], theme), unsafe_allow_html=True)
+    col1, col2, col3 = st.columns(3)
+    col1.button("Run anyway", on_click=confirm_pending)
+    col2.button(f"Run with LIMIT {PLAN_AUTO_LIMIT}", on_click=confirm_pending, args=(PLAN_AUTO_LIMIT,))
+    col3.button("Cancel", on_click=cancel_pending)
 
 # Footer
 st.markdown("---")
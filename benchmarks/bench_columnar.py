@@ -0,0 +1,99 @@
+"""Compare tuple rows with ColumnarResult for memory use and dataframe handoff.
+
+"Render" time is the work done before bytes go to the browser: a list of tuples
+goes through pandas and then Arrow (what st.dataframe does for lists), while a
+ColumnarResult becomes an Arrow table directly. Both are serialised to Arrow IPC.
+
+    python benchmarks/bench_columnar.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatdb.columnar import ColumnarResult  # noqa: E402
+
+
+# (name, psycopg2 type OID) for int4, float8, text, int8
+DESCRIPTION = [("id", 23), ("amount", 701), ("name", 25), ("customer_id", 20)]
+
+
+def make_rows(n, seed=42):
+    rng = random.Random(seed)
+    return [
+        (i, rng.random() * 1000, f"customer {i % 5000}", None if i % 10 == 0 else rng.randrange(10**6))
+        for i in range(n)
+    ]
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, elapsed, current, peak
+
+
+def render_tuples(rows):
+    import pandas as pd
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(pd.DataFrame(rows, columns=[d[0] for d in DESCRIPTION]))
+    return _to_ipc(table)
+
+
+def render_columnar(result):
+    return _to_ipc(result.to_arrow())
+
+
+def _to_ipc(table):
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    can_render = all(importlib.util.find_spec(name) for name in ("pandas", "pyarrow"))
+    if not can_render:
+        print("pandas/pyarrow not installed: skipping render timings\n")
+
+    print(f"{'rows':>9} {'path':>9} {'build s':>9} {'held MB':>9} {'peak MB':>9} {'render s':>9}")
+    for n in args.sizes:
+        # Both paths start from freshly built driver-style rows; the columnar
+        # path drops them once the column buffers are filled.
+        rows, t_rows, held_rows, peak_rows = measure(lambda: make_rows(n))
+        columnar, t_col, held_col, peak_col = measure(
+            lambda: ColumnarResult.from_rows("postgresql", DESCRIPTION, make_rows(n))
+        )
+
+        render_rows = f"{timed(render_tuples, rows):9.3f}" if can_render else f"{'-':>9}"
+        render_col = f"{timed(render_columnar, columnar):9.3f}" if can_render else f"{'-':>9}"
+        mb = 1024 * 1024
+        print(f"{n:>9} {'tuples':>9} {t_rows:9.3f} {held_rows / mb:9.1f} {peak_rows / mb:9.1f} {render_rows}")
+        print(f"{n:>9} {'columnar':>9} {t_col:9.3f} {held_col / mb:9.1f} {peak_col / mb:9.1f} {render_col}")
+        del rows, columnar
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Tail latency of generation with and without hedged requests (chatdb/hedging.py).
+
+The primary provider (Ollama wire format) is a mock server that usually sends
+its first token after --first-token-ms but, for --tail-rate of the requests,
+only after --tail-ms. The secondary (Gemini REST) is a steady mock that is
+slower than the primary's usual case. Each gold question is answered with the
+gold SQL by both, and validated against the seeded SQLite fixture when a race
+happens. Reports end-to-end p50/p95/p99 with hedging off and on, the win rate
+per provider and the extra tokens hedging spent.
+
+    python benchmarks/bench_hedging.py --repeat 5 --tail-rate 0.1 --hedge-after 0.5
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_db import build_fixture  # noqa: E402
+from mock_llm_server import MockLLMServer  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_gold():
+    with open(os.path.join(HERE, "gold_sql.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(settings, gold, repeat):
+    from chatdb import engine
+
+    times = []
+    for _ in range(repeat):
+        for item in gold:
+            prefix, _ = engine.load_prompt_prefix(settings, item["question"])
+            started = time.perf_counter()
+            engine.generate_text(settings, prefix.text, item["question"])
+            times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--first-token-ms", type=float, default=100, help="primary's usual first-token time")
+    parser.add_argument("--tail-ms", type=float, default=3000, help="primary's first-token time in the tail")
+    parser.add_argument("--tail-rate", type=float, default=0.1)
+    parser.add_argument("--secondary-ms", type=float, default=300, help="secondary's first-token time")
+    parser.add_argument("--hedge-after", default="0.5", help='seconds, or "p95" of the observed first-token time')
+    args = parser.parse_args()
+
+    gold = load_gold()
+    answers = {item["question"]: item["sql"] for item in gold}
+    work = tempfile.mkdtemp(prefix="chatdb_bench_hedging_")
+    with MockLLMServer(first_token_ms=args.first_token_ms, tail_ms=args.tail_ms, tail_rate=args.tail_rate,
+                       answers=answers) as primary, \
+            MockLLMServer(first_token_ms=args.secondary_ms, answers=answers) as secondary:
+        os.environ.update(
+            DB_TYPE="sqlite",
+            DB_NAME=build_fixture(os.path.join(work, "shop.sqlite")),
+            SCHEMA_CACHE_DIR=work,
+            OLLAMA_BASE_URL=primary.url,
+            OLLAMA_MODEL="mock",
+            GEMINI_BASE_URL=secondary.url,
+            GEMINI_MODEL="mock",
+            GEMINI_API_KEY="mock",
+            HEDGE_AFTER=args.hedge_after,
+            OLLAMA_HEARTBEAT_INTERVAL="0",
+        )
+        from chatdb import engine
+        from chatdb.hedging import hedge_stats
+
+        settings = engine.Settings.from_env("OLLAMA")
+        print(f"primary {args.first_token_ms:g} ms, {args.tail_rate:.0%} at {args.tail_ms:g} ms; "
+              f"secondary {args.secondary_ms:g} ms; hedge after {args.hedge_after}")
+        print(f"{'hedging':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for label, provider in (("off", ""), ("on", "GEMINI")):
+            os.environ["HEDGE_PROVIDER"] = provider
+            times = run(settings, gold, args.repeat)
+            print(f"{label:<8} {percentile(times, 0.5):8.0f} {percentile(times, 0.95):8.0f} "
+                  f"{percentile(times, 0.99):8.0f} {max(times):8.0f}")
+        print()
+        print(json.dumps(hedge_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
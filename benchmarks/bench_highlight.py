@@ -0,0 +1,62 @@
+"""Rerun cost of highlighting chat history, uncached vs cached.
+
+A rerun of appV4 highlights every history record twice (sidebar and chat).
+This times one simulated rerun at several history lengths with the old
+per-call HtmlFormatter/SqlLexer code and with chatdb.highlight.
+
+    python benchmarks/bench_highlight.py --lengths 10 50 100 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pygments import highlight  # noqa: E402
+from pygments.formatters.html import HtmlFormatter  # noqa: E402
+from pygments.lexers import SqlLexer  # noqa: E402
+
+from chatdb.highlight import highlight_sql  # noqa: E402
+
+
+def highlight_uncached(code, theme="monokai"):
+    formatter = HtmlFormatter(style=theme, noclasses=True)
+    return highlight(code, SqlLexer(), formatter)
+
+
+def make_sql(i):
+    return (
+        f"SELECT c.id, c.name, SUM(o.total) AS revenue_{i}\n"
+        f"FROM customers c JOIN orders o ON o.customer_id = c.id\n"
+        f"WHERE o.created_at >= NOW() - INTERVAL '{i % 30 + 1} days' AND c.country = 'NG'\n"
+        f"GROUP BY c.id, c.name HAVING SUM(o.total) > {i * 10}\n"
+        f"ORDER BY revenue_{i} DESC LIMIT {i % 50 + 10};"
+    )
+
+
+def rerun(history, fn):
+    start = time.perf_counter()
+    for sql in history:
+        fn(sql, "monokai")  # sidebar expander
+        fn(sql, "monokai")  # chat message
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 100, 200])
+    args = parser.parse_args()
+
+    print(f"{'history':>8} {'uncached ms':>12} {'cached ms':>10}")
+    for n in args.lengths:
+        history = [make_sql(i) for i in range(n)]
+        uncached = rerun(history, highlight_uncached)
+        rerun(history, highlight_sql)  # first rerun fills the cache
+        cached = min(rerun(history, highlight_sql) for _ in range(5))
+        print(f"{n:>8} {uncached:12.1f} {cached:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Import cost of the engine and the apps' non-Streamlit imports.
+
+Each target is imported in a fresh interpreter (so nothing is already cached in
+sys.modules) and timed over several runs. Afterwards the benchmark checks that
+importing chatdb.engine did not pull in a database driver, a provider SDK,
+Pygments or Streamlit: those must load only when a connection, client or
+highlight of that kind is first needed. With --max-ms the run also fails when
+the engine's median import time exceeds the threshold, so it can guard CI.
+
+    python benchmarks/bench_import_time.py --runs 10
+    python benchmarks/bench_import_time.py --max-ms 150
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = ["chatdb.engine", "chatdb.batch", "chatdb.highlight"]
+
+# Modules that must stay out of sys.modules after `import chatdb.engine`
+HEAVY = ["openai", "google.generativeai", "httpx", "psycopg2", "pymysql", "pygments", "streamlit", "pyarrow"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+heavy = {heavy!r}
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in heavy if m in sys.modules]}}))
+"""
+
+
+def probe(target):
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(target=target, heavy=HEAVY)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        # Optional dependency missing in this environment (e.g. dotenv for the batch runner)
+        return None, out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"
+    return json.loads(out.stdout.strip().splitlines()[-1]), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--targets", nargs="+", default=TARGETS)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if chatdb.engine's median exceeds this")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20} {'median ms':>10} {'min ms':>8}   heavy modules loaded")
+    for target in args.targets:
+        timings, loaded = [], set()
+        for _ in range(args.runs):
+            result, error = probe(target)
+            if result is None:
+                break
+            timings.append(result["ms"])
+            loaded.update(result["loaded"])
+        if not timings:
+            print(f"{target:<20} {'skipped':>10}            ({error})")
+            continue
+        median = statistics.median(timings)
+        print(f"{target:<20} {median:10.1f} {min(timings):8.1f}   {', '.join(sorted(loaded)) or '-'}")
+        if target == "chatdb.engine":
+            if loaded:
+                print(f"FAIL: importing chatdb.engine loaded {', '.join(sorted(loaded))}", file=sys.stderr)
+                failed = True
+            if args.max_ms is not None and median > args.max_ms:
+                print(f"FAIL: chatdb.engine imports in {median:.1f} ms (limit {args.max_ms:.1f} ms)", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
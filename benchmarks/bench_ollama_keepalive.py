@@ -0,0 +1,86 @@
+"""Cold versus warm first-token latency for a local Ollama model.
+
+Runs requests against the mock server playing an Ollama model that takes
+--load-ms to load and is unloaded after its keep_alive, with --idle-s seconds
+between requests (a user reading the last result). Each setup gets a fresh
+runner:
+
+    unload     keep_alive 0: the model is unloaded after every request
+    keep-alive OLLAMA_KEEP_ALIVE shorter than the idle time, no heartbeat
+    heartbeat  the same keep-alive, with the heartbeat re-sending it
+    preload    the heartbeat setup, with the model preloaded before the first request
+
+    python benchmarks/bench_ollama_keepalive.py --load-ms 3000 --requests 5 --idle-s 2
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_llm_server import MockLLMServer  # noqa: E402
+from chatdb.llm import LLMRunner, ProviderConfig  # noqa: E402
+
+
+def run(server, args, keep_alive, heartbeat, preload):
+    os.environ["OLLAMA_KEEP_ALIVE"] = keep_alive
+    os.environ["OLLAMA_HEARTBEAT_INTERVAL"] = str(args.idle_s / 4) if heartbeat else "0"
+    config = ProviderConfig("OLLAMA", f"mock-{keep_alive}-{heartbeat}-{preload}", base_url=server.url)
+    runner = LLMRunner()
+    loads_before = server.loads
+    starts_before = starts(runner)
+    if preload:
+        runner.preload(config).result()
+        time.sleep(args.idle_s)
+    first_token_ms = []
+    for i in range(args.requests):
+        if i:
+            time.sleep(args.idle_s)
+        start = time.perf_counter()
+        stream = runner.stream(config, "system", f"question {i}")
+        for piece in stream:
+            if piece:
+                first_token_ms.append((time.perf_counter() - start) * 1000)
+                break
+        stream.future.result()
+    cold, warm = (after - before for after, before in zip(starts(runner), starts_before))
+    # So it does not keep this setup's model loaded during the next one
+    runner.stop_heartbeat()
+    return first_token_ms, server.loads - loads_before, cold, warm
+
+
+def starts(runner):
+    # The counts are process-wide; each setup reports the difference
+    stats = runner.ollama_stats()
+    return stats["cold_first_token"]["count"], stats["warm_first_token"]["count"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--load-ms", type=float, default=3000, help="model load time of the mock Ollama")
+    parser.add_argument("--first-token-ms", type=float, default=50, help="first-token time once loaded")
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--idle-s", type=float, default=2, help="pause between requests")
+    args = parser.parse_args()
+
+    keep_alive = f"{args.idle_s / 2:g}s"
+    setups = [
+        ("unload", "0", False, False),
+        ("keep-alive", keep_alive, False, False),
+        ("heartbeat", keep_alive, True, False),
+        ("preload", keep_alive, True, True),
+    ]
+    with MockLLMServer(first_token_ms=args.first_token_ms, load_ms=args.load_ms) as server:
+        print(f"load {args.load_ms:g} ms, keep_alive {keep_alive}, {args.idle_s:g}s idle between "
+              f"{args.requests} requests")
+        print(f"{'setup':<11} {'first ms':>9} {'median ms':>10} {'loads':>6} {'cold':>5} {'warm':>5}")
+        for label, alive, heartbeat, preload in setups:
+            times, loads, cold, warm = run(server, args, alive, heartbeat, preload)
+            print(f"{label:<11} {times[0]:9.0f} {statistics.median(times):10.0f} {loads:6d} {cold:5d} {warm:5d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Per-request overhead of building provider clients per call vs reusing them.
+
+Runs sequential requests against the local mock server (zero model latency) for
+the OpenAI-compatible and Ollama paths, once with a fresh client per request
+(what appV3/appV4 used to do) and once through the shared ProviderRegistry.
+
+    python benchmarks/bench_provider_clients.py --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_llm_server import MockLLMServer  # noqa: E402
+from chatdb.llm import LLMRunner, ProviderConfig  # noqa: E402
+from chatdb.providers import ProviderRegistry  # noqa: E402
+
+
+def run(runner, config, n, fresh_client):
+    latencies = []
+    for i in range(n):
+        if fresh_client:
+            asyncio.run_coroutine_threadsafe(runner.registry.close_all(), runner.loop).result()
+            runner.registry = ProviderRegistry()
+        start = time.perf_counter()
+        runner.generate(config, "system", f"question {i}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with MockLLMServer() as server:
+        configs = [
+            ProviderConfig("OPENAI", "mock", api_key="test", base_url=f"{server.url}/v1"),
+            ProviderConfig("OLLAMA", "mock", base_url=server.url),
+        ]
+        runner = LLMRunner()
+        print(f"{'provider':>9} {'clients':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for config in configs:
+            runner.generate(config, "system", "warm-up")
+            for label, fresh in (("per-call", True), ("reused", False)):
+                mean, p50, p95 = run(runner, config, args.requests, fresh)
+                print(f"{config.provider:>9} {label:>9} {mean:9.2f} {p50:9.2f} {p95:9.2f}")
+        print()
+        print("registry:", runner.client_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Selection latency and prompt-token reduction of SchemaSelector.
+
+Builds a synthetic catalog (default 1,000 tables across business domains, with
+foreign keys), then selects tables for a set of questions and reports index
+build time, per-question latency and prompt tokens versus sending the whole
+schema.
+
+    python benchmarks/bench_schema_selector.py --tables 1000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatdb.schema import SchemaCatalog  # noqa: E402
+from chatdb.schema_selector import SchemaSelector, estimate_tokens  # noqa: E402
+
+
+DOMAINS = ["sales", "billing", "inventory", "hr", "marketing", "support", "shipping", "finance", "crm", "analytics"]
+ENTITIES = ["customer", "order", "invoice", "product", "employee", "campaign", "ticket", "shipment",
+            "payment", "account", "supplier", "warehouse", "contract", "lead", "refund", "subscription"]
+SUFFIXES = ["", "_item", "_history", "_archive", "_status", "_note", "_audit", "_detail"]
+COLUMNS = ["name", "status", "created_at", "updated_at", "amount", "quantity", "email", "country",
+           "price", "description", "due_date", "total", "currency", "phone", "region", "score"]
+
+QUESTIONS = [
+    "total invoice amount per customer last month",
+    "which employees handled the most support tickets",
+    "list products that are out of stock in each warehouse",
+    "monthly refund totals by payment currency",
+    "campaigns with the highest lead conversion",
+    "shipments delayed past their due date by supplier",
+    "active subscriptions per account region",
+    "orders with more than 10 items and their customer email",
+]
+
+
+def make_catalog(n_tables, seed=7):
+    rng = random.Random(seed)
+    names = []
+    while len(names) < n_tables:
+        name = f"{rng.choice(DOMAINS)}_{rng.choice(ENTITIES)}{rng.choice(SUFFIXES)}"
+        if name in names:
+            name = f"{name}_{len(names)}"
+        names.append(name)
+
+    tables = {}
+    for i, name in enumerate(names):
+        columns = [{"name": "id", "type": "bigint", "nullable": False, "comment": ""}]
+        for column in rng.sample(COLUMNS, rng.randint(4, 10)):
+            columns.append({"name": column, "type": rng.choice(["varchar(255)", "int", "decimal(12,2)", "timestamp"]),
+                            "nullable": True, "comment": ""})
+        foreign_keys = []
+        for ref in rng.sample(names[:max(1, i)], min(i, rng.randint(0, 2))):
+            column = f"{ref.split('_', 1)[1]}_id"
+            columns.append({"name": column, "type": "bigint", "nullable": False, "comment": ""})
+            foreign_keys.append({"columns": [column], "ref_table": ref, "ref_columns": ["id"]})
+        tables[name] = {
+            "signature": str(i),
+            "row_estimate": rng.randint(0, 10**7),
+            "comment": f"{name.split('_')[0]} records",
+            "columns": columns,
+            "primary_key": ["id"],
+            "foreign_keys": foreign_keys,
+        }
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    catalog = SchemaCatalog("postgresql")
+    catalog.tables = make_catalog(args.tables)
+    full_tokens = estimate_tokens(catalog.to_prompt())
+
+    start = time.perf_counter()
+    selector = SchemaSelector(catalog.tables)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    latencies, selected_tokens = [], []
+    for _ in range(args.repeat):
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            tables = selector.select(question, catalog.describe_table, args.top_k, args.budget)
+            latencies.append((time.perf_counter() - start) * 1000)
+            selected_tokens.append(estimate_tokens(catalog.to_prompt(tables)))
+
+    latencies.sort()
+    mean_tokens = statistics.mean(selected_tokens)
+    print(f"tables:              {args.tables}")
+    print(f"index build:         {build_ms:.1f} ms")
+    print(f"selection p50/p95:   {latencies[len(latencies) // 2]:.2f} / {latencies[int(len(latencies) * 0.95)]:.2f} ms")
+    print(f"full schema tokens:  {full_tokens}")
+    print(f"selected tokens:     {mean_tokens:.0f} (mean)")
+    print(f"prompt reduction:    {100 * (1 - mean_tokens / full_tokens):.1f}%")
+    print()
+    for question in QUESTIONS[:3]:
+        print(f"{question!r}: {selector.select(question, catalog.describe_table, args.top_k, args.budget)[:5]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Correctness and throughput of SQL extraction on a fuzzed answer corpus.
+
+Builds a seeded corpus of model answers around known statements (the gold
+queries plus CTEs, comments, string literals holding `;`, `--` and quotes,
+quoted identifiers and several statements per answer), wrapped the ways models
+write them: fenced with or without a language tag, with prose before and after,
+bare, spread over lines, with CRLF line ends. Each answer is extracted by
+chatdb.sql_extract whole and fed in random token-sized chunks (both must give
+the expected statements), and by the regex/line-filter extractor it replaced,
+for comparison. Throughput is reported in MB/s, and the corpus is repeated at
+growing sizes to show the time per character stays flat.
+
+    python benchmarks/bench_sql_extract.py --answers 2000 --seed 7
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatdb.sql_extract import SqlExtractor, split_statements  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HARD_STATEMENTS = [
+    "WITH recent AS (\n    SELECT customer_id, SUM(total) AS spend\n    FROM orders\n"
+    "    WHERE order_date >= '2024-01-01'\n    GROUP BY customer_id\n)\n"
+    "SELECT c.name, r.spend\nFROM recent r\nJOIN customers c ON c.id = r.customer_id\nORDER BY r.spend DESC;",
+    "SELECT name FROM customers WHERE name = 'O''Brien; -- not a comment';",
+    "SELECT id, note FROM orders -- trailing comment with a ; in it\nWHERE status = 'pending';",
+    "/* top customers; by spend */\nSELECT customer_id FROM orders GROUP BY customer_id HAVING SUM(total) > 1000;",
+    "SELECT `order`, `select;` FROM `weird table` WHERE `from` = \"x;y\";",
+    "UPDATE products SET price = price * 1.1 WHERE category = 'Books';",
+    "INSERT INTO customers (name, country, signup_date)\nVALUES ('Ada', 'Ghana', '2024-05-01');",
+    "SELECT 'line one\n\nline three' AS text;",
+    "CREATE FUNCTION one() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql;",
+]
+
+PROSE_BEFORE = [
+    "Here is the query you asked for:",
+    "Sure! Here's the SQL that answers the question:",
+    "Selecting from the schema you gave, this works:",
+    "You'd use something like this (it doesn't need a subquery):",
+]
+PROSE_AFTER = [
+    "This returns one row per customer.",
+    "Let me know if you'd like it sorted differently.",
+    "Note: it's assuming `orders.total` is stored in dollars.",
+]
+
+
+def load_statements():
+    with open(os.path.join(HERE, "gold_sql.jsonl"), encoding="utf-8") as f:
+        gold = [json.loads(line)["sql"] for line in f if line.strip()]
+    return gold + HARD_STATEMENTS
+
+
+def spread(sql):
+    # Put clauses on their own lines, as models often do (gold SQL has no keywords in strings)
+    return re.sub(r" (FROM|JOIN|WHERE|GROUP BY|HAVING|ORDER BY|LIMIT) ", r"\n\1 ", sql)
+
+
+def make_answer(rng, statements):
+    count = 1 if rng.random() < 0.8 else rng.randint(2, 3)
+    picked = [rng.choice(statements) for _ in range(count)]
+    if rng.random() < 0.4:
+        picked = [spread(sql) if "'" not in sql and "`" not in sql else sql for sql in picked]
+    body = "\n".join(picked)
+    style = rng.choice(["fenced", "tagged", "label_line", "prose_fenced", "bare", "prose_bare", "inline"])
+    if style == "fenced":
+        text = f"```\n{body}\n```"
+    elif style == "tagged":
+        text = f"```{rng.choice(['sql', 'SQL', 'postgresql', 'mysql'])}\n{body}\n```"
+    elif style == "label_line":
+        text = f"```\nsql\n{body}\n```"
+    elif style == "prose_fenced":
+        text = f"{rng.choice(PROSE_BEFORE)}\n\n```sql\n{body}\n```\n\n{rng.choice(PROSE_AFTER)}"
+    elif style == "bare":
+        text = body
+    elif style == "prose_bare":
+        text = f"{rng.choice(PROSE_BEFORE)}\n\n{body}\n\n{rng.choice(PROSE_AFTER)}"
+    else:
+        text = f"{rng.choice(PROSE_BEFORE)} ```sql {body} ```"
+    if rng.random() < 0.1:
+        text = text.replace("\n", "\r\n")
+    return text, picked
+
+
+def legacy_extract(raw_sql):
+    # The extractor this replaced: regex fence removal, then a keyword line filter
+    raw_sql = re.sub(r"```sql\s*([\s\S]*?)\s*```", r"\1", raw_sql, flags=re.IGNORECASE)
+    raw_sql = re.sub(r"```([\s\S]*?)```", r"\1", raw_sql)
+    raw_sql = raw_sql.replace("`", "").strip()
+    keywords = ['select', 'insert', 'update', 'delete', 'create', 'drop', 'alter']
+    sql_lines = []
+    for line in raw_sql.splitlines():
+        if any(line.strip().lower().startswith(k) for k in keywords) or line.strip().endswith(';') \
+                or line.strip().startswith("("):
+            sql_lines.append(line.strip())
+    return " ".join(sql_lines).strip()
+
+
+def norm(text):
+    # Leading comments don't change what runs, and are dropped outside a fence
+    text = re.sub(r"^\s*(?:--[^\n]*\n|/\*[\s\S]*?\*/)\s*", "", text)
+    return " ".join(text.split())
+
+
+def chunked(rng, text):
+    extractor = SqlExtractor()
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 8)
+        extractor.feed(text[i:i + step])
+        i += step
+    extractor.finish()
+    fenced = [s.text for s in extractor.statements if s.fenced]
+    return fenced or [s.text for s in extractor.statements]
+
+
+def timed(fn, corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--show-failures", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    statements = load_statements()
+    corpus = [make_answer(rng, statements) for _ in range(args.answers)]
+    texts = [text for text, _ in corpus]
+    size_mb = sum(len(text) for text in texts) / 1e6
+
+    exact = incremental = legacy = 0
+    failures = []
+    for text, expected in corpus:
+        expected_norm = [norm(sql) for sql in expected]
+        got = [norm(sql) for sql in split_statements(text)]
+        exact += got == expected_norm
+        if got != expected_norm and len(failures) < args.show_failures:
+            failures.append((text, expected_norm, got))
+        incremental += [norm(sql) for sql in chunked(rng, text)] == got
+        legacy += norm(legacy_extract(text)) == " ".join(expected_norm)
+
+    n = len(corpus)
+    print(f"{n} answers, {size_mb:.2f} MB")
+    print(f"  tokenizer exact statements   {exact / n:7.1%}")
+    print(f"  chunked feed == whole text   {incremental / n:7.1%}")
+    print(f"  legacy line filter           {legacy / n:7.1%}")
+    for text, expected, got in failures:
+        print(f"\n  MISS {text!r}\n    expected {expected}\n    got      {got}")
+
+    print(f"\n{'extractor':<12} {'MB/s':>8}")
+    print(f"{'tokenizer':<12} {size_mb / timed(split_statements, texts):8.2f}")
+    print(f"{'legacy':<12} {size_mb / timed(legacy_extract, texts):8.2f}")
+
+    print(f"\n{'answer size':>12} {'ns/char':>8}")
+    base = texts[0]
+    for factor in (1, 10, 100, 1000):
+        # One long answer: prose, then many statements; linear time keeps ns/char flat
+        text = base + "\n" + "\n".join(rng.choice(statements) for _ in range(factor))
+        elapsed = min(timed(split_statements, [text]) for _ in range(3))
+        print(f"{len(text):12d} {elapsed / len(text) * 1e9:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Offline text-to-SQL benchmark: latency per stage and execution-match accuracy.
+
+Every provider config talks to its own local mock server (OpenAI, Ollama or
+Gemini wire format, with that config's first-token and per-token latency) and
+queries a seeded SQLite fixture database, so the run needs no network or API
+keys. For each gold question the pipeline runs the same steps as the apps:
+schema context, generate, extract, execute and render (highlighting plus the
+Arrow handoff when pyarrow is installed). A prediction counts as correct when
+its result matches the gold query's result (row order only matters when the
+gold SQL has ORDER BY).
+
+By default the mocks answer with the gold SQL in the shapes models actually
+produce (fenced, with prose around it, bare, spread over several lines), and
+--noise replaces a fraction of answers with wrong SQL. --answers replays
+recorded model outputs instead ({"question": ..., "answer": ...} per line).
+
+    python benchmarks/bench_text_to_sql.py --repeat 3
+    python benchmarks/bench_text_to_sql.py --configs openai ollama --noise 0.1
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (provider, model, first-token ms, per-token ms)
+CONFIGS = {
+    "openai": ("OPENAI", "gpt-4o-mini", 250, 4),
+    "deepseek": ("DEEPSEEK", "deepseek-chat", 600, 10),
+    "gemini": ("GEMINI", "gemini-1.5-flash", 300, 3),
+    "ollama": ("OLLAMA", "llama3", 80, 20),
+}
+
+STAGES = ("schema", "generate", "extract", "execute", "render")
+
+
+def answer_styles(sql):
+    multiline = re.sub(r" (FROM|JOIN|WHERE|GROUP BY|HAVING|ORDER BY|LIMIT) ", r"\n\1 ", sql)
+    return [
+        f"```sql\n{sql}\n```",
+        f"Here is the query you asked for:\n\n```sql\n{sql}\n```\n\nIt reads from the tables listed in the schema.",
+        sql,
+        f"```sql\n{multiline}\n```",
+    ]
+
+
+def build_answers(gold, noise, seed, recorded=None):
+    if recorded is not None:
+        return recorded
+    rng = random.Random(seed)
+    answers = {}
+    for i, item in enumerate(gold):
+        sql = item["sql"]
+        if rng.random() < noise:
+            sql = "SELECT name FROM customers LIMIT 1;"
+        answers[item["question"]] = answer_styles(sql)[i % 4]
+    return answers
+
+
+def normalize(rows, ordered):
+    rows = [tuple(round(v, 4) if isinstance(v, float) else v for v in row) for row in rows]
+    return rows if ordered else sorted(rows, key=repr)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_config(name, spec, gold, gold_results, answers, db_path, repeat):
+    from mock_llm_server import MockLLMServer
+
+    from chatdb import engine
+    from chatdb.columnar import ColumnarResult
+    from chatdb.highlight import highlight_sql
+    from chatdb.llm import get_runner
+
+    provider, model, first_token_ms, token_ms = spec
+    stages = {stage: [] for stage in STAGES}
+    totals, correct, empty, errors = [], 0, 0, 0
+    with MockLLMServer(first_token_ms=first_token_ms, token_ms=token_ms, answers=answers) as server:
+        base_url = server.url + "/v1" if provider in ("OPENAI", "DEEPSEEK") else server.url
+        settings = engine.Settings("sqlite", "local", 0, "", "", db_path, provider, model, "mock", base_url)
+        for _ in range(repeat):
+            for item in gold:
+                timings = {}
+                started = stage = time.perf_counter()
+                prefix, _ = engine.load_prompt_prefix(settings, item["question"])
+                system_prompt = prefix.text
+                timings["schema"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                try:
+                    raw = get_runner().generate(settings.provider_config(), system_prompt, item["question"])
+                except Exception as e:
+                    print(f"  {name}: generation failed: {e}", file=sys.stderr)
+                    errors += 1
+                    continue
+                timings["generate"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                sql = engine.extract_sql(raw)
+                timings["extract"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                rows, error, data = [], None, None
+                if sql:
+                    columns, data, error, stream = engine.execute_query(settings, sql)
+                    if data and not isinstance(data, str):
+                        rows = list(data)
+                    if stream is not None:
+                        for page in stream:
+                            rows.extend(page)
+                else:
+                    empty += 1
+                timings["execute"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                highlight_sql(sql or raw)
+                if isinstance(data, ColumnarResult):
+                    try:
+                        data.to_arrow()
+                    except ImportError:
+                        pass
+                timings["render"] = time.perf_counter() - stage
+                totals.append(time.perf_counter() - started)
+
+                if error:
+                    errors += 1
+                ordered = "order by" in item["sql"].lower()
+                if sql and not error and normalize(rows, ordered) == gold_results[item["question"]][ordered]:
+                    correct += 1
+                for key, seconds in timings.items():
+                    stages[key].append(seconds)
+
+    runs = repeat * len(gold)
+    return {
+        "config": name,
+        "provider": provider,
+        "model": model,
+        "runs": runs,
+        "accuracy": round(correct / runs, 3) if runs else 0.0,
+        "no_sql": empty,
+        "errors": errors,
+        "e2e_ms": {f"p{int(q * 100)}": round(percentile(totals, q) * 1000, 1) for q in (0.5, 0.95, 0.99)},
+        "stage_p50_ms": {stage: round(percentile(values, 0.5) * 1000, 2) for stage, values in stages.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", nargs="+", choices=sorted(CONFIGS), default=sorted(CONFIGS))
+    parser.add_argument("--gold", default=os.path.join(HERE, "gold_sql.jsonl"))
+    parser.add_argument("--answers", help="JSONL of recorded model answers to replay")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=0.0, help="fraction of answers replaced with wrong SQL")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="chatdb_bench_")
+    # Keep caches out of the measurement and out of the working tree
+    os.environ["SCHEMA_CACHE_DIR"] = workdir
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    os.environ.setdefault("QUERY_TIMEOUT", "30")
+
+    from fixture_db import build_fixture
+
+    db_path = build_fixture(os.path.join(workdir, "shop.sqlite"), seed=args.seed)
+    with open(args.gold, encoding="utf-8") as f:
+        gold = [json.loads(line) for line in f if line.strip()]
+    conn = sqlite3.connect(db_path)
+    gold_results = {}
+    for item in gold:
+        rows = conn.execute(item["sql"]).fetchall()
+        gold_results[item["question"]] = {False: normalize(rows, False), True: normalize(rows, True)}
+    conn.close()
+
+    recorded = None
+    if args.answers:
+        with open(args.answers, encoding="utf-8") as f:
+            recorded = {item["question"]: item["answer"] for item in map(json.loads, filter(str.strip, f))}
+    answers = build_answers(gold, args.noise, args.seed, recorded)
+
+    results = [run_config(name, CONFIGS[name], gold, gold_results, answers, db_path, args.repeat)
+               for name in args.configs]
+
+    print(f"{'config':<10} {'acc':>6} {'no sql':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}   "
+          + " ".join(f"{stage:>9}" for stage in STAGES))
+    for r in results:
+        print(f"{r['config']:<10} {r['accuracy']:6.1%} {r['no_sql']:7d} {r['errors']:7d} "
+              f"{r['e2e_ms']['p50']:8.1f} {r['e2e_ms']['p95']:8.1f} {r['e2e_ms']['p99']:8.1f}   "
+              + " ".join(f"{r['stage_p50_ms'][stage]:9.2f}" for stage in STAGES))
+    print("(stage columns are p50 ms)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
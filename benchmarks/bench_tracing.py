@@ -0,0 +1,130 @@
+"""Overhead of request tracing (chatdb/tracing.py) on the engine pipeline.
+
+Runs the gold questions through schema context, generation (a stub model call
+that sleeps --llm-ms and answers with the gold SQL), extraction and execution
+against the seeded SQLite fixture, with tracing off, on, and on with OTLP file
+export. The modes are interleaved over several rounds and the median time per
+request is compared; --llm-ms 0 is the worst case, where the spans are measured
+against local work only. The cost of a single span is reported as well.
+
+    python benchmarks/bench_tracing.py --rounds 5 --llm-ms 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_db import build_fixture  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = {"off": {"TRACING": "0"}, "on": {"TRACING": "1"}, "export": {"TRACING": "1"}}
+
+
+def load_gold():
+    import json
+
+    with open(os.path.join(HERE, "gold_sql.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def span_cost(n):
+    from chatdb.tracing import span, start_trace
+
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        with span("noop"):
+            pass
+    outside = (time.perf_counter_ns() - start) / n
+    with start_trace("bench") as trace:
+        start = time.perf_counter_ns()
+        for _ in range(n):
+            with span("stage"):
+                pass
+        inside = (time.perf_counter_ns() - start) / n
+        trace.spans.clear()
+    return outside, inside
+
+
+def run_round(settings, gold, llm_ms, tag):
+    from chatdb import engine
+    from chatdb.tracing import start_trace
+
+    def call(answer):
+        def model(prompt, system_prompt):
+            if llm_ms:
+                time.sleep(llm_ms / 1000)
+            return f"```sql\n{answer}\n```"
+        return model
+
+    times = []
+    for item in gold:
+        started = time.perf_counter()
+        with start_trace("bench"):
+            # A new prompt per round, so the SQL cache does not answer it
+            raw = engine.generate_sql(settings, f"{item['question']} ({tag})", call(item["sql"]))
+            sql = engine.extract_sql(raw)
+            engine.run_query(settings, sql)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-ms", type=float, default=0)
+    parser.add_argument("--spans", type=int, default=200000, help="iterations for the per-span cost")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="chatdb_bench_tracing_")
+    export_path = os.path.join(work, "traces.jsonl")
+    os.environ.update(
+        DB_TYPE="sqlite",
+        DB_NAME=build_fixture(os.path.join(work, "shop.sqlite")),
+        SCHEMA_CACHE_DIR=work,
+        SQL_CACHE_PATH="",
+        RESULT_CACHE_MAX_ENTRIES="0",
+        PLAN_QUERIES="0",
+        TRACE_SLOW_MS="0",
+        PROFILE_SAMPLE_RATE="0",
+    )
+    from chatdb import engine
+
+    settings = engine.Settings.from_env("OLLAMA")
+    gold = load_gold()
+    run_round(settings, gold, 0, "warm-up")
+
+    samples = {mode: [] for mode in MODES}
+    for round_number in range(args.rounds):
+        for mode, env in MODES.items():
+            os.environ.update(env)
+            if mode == "export":
+                os.environ["TRACE_EXPORT_PATH"] = export_path
+            else:
+                os.environ.pop("TRACE_EXPORT_PATH", None)
+            samples[mode] += run_round(settings, gold, args.llm_ms, f"{mode} {round_number}")
+
+    base = statistics.median(samples["off"])
+    print(f"{len(gold)} questions x {args.rounds} rounds, model latency {args.llm_ms:g} ms")
+    print(f"{'tracing':<8} {'median ms':>10} {'overhead':>9}")
+    for mode, times in samples.items():
+        median = statistics.median(times)
+        print(f"{mode:<8} {median * 1000:10.3f} {(median - base) / base:9.2%}")
+
+    from chatdb.tracing import flush_exports
+
+    flush_exports()
+    outside, inside = span_cost(args.spans)
+    print(f"\nspan() outside a trace {outside:7.0f} ns")
+    print(f"span() inside a trace  {inside:7.0f} ns")
+    with open(export_path, encoding="utf-8") as f:
+        print(f"\n{sum(1 for _ in f)} traces exported to {export_path}")
+
+
+if __name__ == "__main__":
+    main()
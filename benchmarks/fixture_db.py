@@ -0,0 +1,104 @@
+"""Seeded SQLite shop database used by the text-to-SQL benchmark.
+
+The same seed always produces the same rows, so gold query results are stable
+between runs and machines.
+
+    python benchmarks/fixture_db.py /tmp/shop.sqlite --customers 500 --orders 5000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+
+SCHEMA = """
+CREATE TABLE customers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    country TEXT NOT NULL,
+    signup_date TEXT NOT NULL
+);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    price REAL NOT NULL
+);
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    order_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total REAL NOT NULL
+);
+CREATE TABLE order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    quantity INTEGER NOT NULL,
+    unit_price REAL NOT NULL
+);
+"""
+
+COUNTRIES = ["Nigeria", "Ghana", "Kenya", "South Africa", "Egypt", "United Kingdom", "United States", "Germany"]
+CATEGORIES = ["Electronics", "Books", "Clothing", "Home", "Sports", "Toys"]
+STATUSES = ["completed", "completed", "completed", "shipped", "pending", "cancelled"]
+FIRST_NAMES = ["Ada", "Chidi", "Ngozi", "Kwame", "Amina", "Tunde", "Zara", "Femi", "Lola", "Musa", "Efe", "Ife"]
+LAST_NAMES = ["Okafor", "Mensah", "Balogun", "Otieno", "Adeyemi", "Nwosu", "Bello", "Eze", "Mohammed", "Smith"]
+
+
+def build_fixture(path, seed=7, customers=500, products=60, orders=5000):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    start = date(2022, 1, 1)
+    conn.executemany("INSERT INTO customers VALUES (?, ?, ?, ?)", [
+        (i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}", rng.choice(COUNTRIES),
+         (start + timedelta(days=rng.randrange(3 * 365))).isoformat())
+        for i in range(1, customers + 1)
+    ])
+    product_rows = [
+        (i, f"{category} item {i}", category, round(rng.uniform(2, 500), 2))
+        for i, category in ((i, rng.choice(CATEGORIES)) for i in range(1, products + 1))
+    ]
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", product_rows)
+
+    # The last few products are never ordered, so "never ordered" has an answer
+    orderable = product_rows[:-5]
+    order_rows, item_rows = [], []
+    for order_id in range(1, orders + 1):
+        items = []
+        for _ in range(rng.randint(1, 4)):
+            product = rng.choice(orderable)
+            quantity = rng.randint(1, 5)
+            items.append((len(item_rows) + len(items) + 1, order_id, product[0], quantity, product[3]))
+        item_rows.extend(items)
+        total = round(sum(quantity * price for _, _, _, quantity, price in items), 2)
+        order_rows.append((order_id, rng.randint(1, customers),
+                           (start + timedelta(days=rng.randrange(3 * 365))).isoformat(),
+                           rng.choice(STATUSES), total))
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)", order_rows)
+    conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)", item_rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5000)
+    args = parser.parse_args()
+    build_fixture(args.path, args.seed, args.customers, orders=args.orders)
+    print(f"Wrote {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Local stand-in for LLM provider APIs, for offline benchmarks.
+
+Speaks enough of the OpenAI chat completions API (plain and SSE streaming),
+Ollama's /api/chat NDJSON stream and Gemini's REST generateContent /
+streamGenerateContent (SSE) for the apps' clients. Answers are looked up by the
+last user message in `answers` (for Gemini, the text after "Query: "), falling
+back to `default_answer`, and are streamed word by word after a configurable
+first-token delay; with `tail_rate`, that fraction of requests waits `tail_ms`
+instead (a provider with a slow tail).
+
+For Ollama it also plays the model's residency: a request for a model that is
+not loaded first waits `load_ms`, and the model stays loaded for the request's
+`keep_alive` (Ollama's duration strings or seconds; 5m by default). /api/generate
+without a prompt only loads the model, like Ollama's preload.
+
+    python benchmarks/mock_llm_server.py --port 8765 --first-token-ms 200 --load-ms 3000
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection reuse is visible
+    # Without it, Nagle's algorithm holds each small chunk for the client's ~40 ms delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.mock.requests += 1
+        path = self.path.split("?")[0]
+        self.server.mock.received.append((time.monotonic(), path, body))
+        try:
+            self._dispatch(path, body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client cancelled the request
+
+    def _dispatch(self, path, body):
+        if path.endswith("/chat/completions"):
+            self._openai(body)
+        elif path == "/api/chat":
+            self._ollama(body)
+        elif path == "/api/generate" and not body.get("prompt"):
+            self._send_json(200, {"model": body.get("model", "mock"), "response": "", "done": True,
+                                  "done_reason": "load", "load_duration": self.server.mock.load(body)})
+        elif path.endswith(":streamGenerateContent") or path.endswith(":generateContent"):
+            self._gemini(body, stream=path.endswith(":streamGenerateContent"))
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def _answer_chunks(self, body):
+        mock = self.server.mock
+        messages = body.get("messages") or []
+        question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        if "contents" in body:
+            # Gemini gets the system prompt and question in one text part
+            parts = body["contents"][-1].get("parts", [])
+            question = "".join(part.get("text", "") for part in parts).rsplit("Query: ", 1)[-1]
+        answer = mock.answers.get(question.strip(), mock.default_answer)
+        slow = mock.tail_rate and random.random() < mock.tail_rate
+        time.sleep((mock.tail_ms if slow else mock.first_token_ms) / 1000)
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(mock.token_ms / 1000)
+            yield word + (" " if i < len(words) - 1 else "")
+
+    def _openai(self, body):
+        model = body.get("model", "mock")
+        if not body.get("stream"):
+            text = "".join(self._answer_chunks(body))
+            self._send_json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+        self._start_chunked("text/event-stream")
+        for piece in self._answer_chunks(body):
+            self._write_chunk("data: " + json.dumps({
+                "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }) + "\n\n")
+        self._write_chunk("data: " + json.dumps({
+            "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }) + "\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_chunked()
+
+    def _ollama(self, body):
+        model = body.get("model", "mock")
+        load_duration = self.server.mock.load(body)
+        self._start_chunked("application/x-ndjson")
+        for piece in self._answer_chunks(body):
+            self._write_chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": piece},
+                                          "done": False}) + "\n")
+        self._write_chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": ""},
+                                      "done": True, "load_duration": load_duration}) + "\n")
+        self._end_chunked()
+
+    def _gemini(self, body, stream):
+        def response(text):
+            return {"candidates": [{"index": 0, "content": {"role": "model", "parts": [{"text": text}]}}]}
+
+        if not stream:
+            self._send_json(200, response("".join(self._answer_chunks(body))))
+            return
+        self._start_chunked("text/event-stream")
+        for piece in self._answer_chunks(body):
+            self._write_chunk("data: " + json.dumps(response(piece)) + "\r\n\r\n")
+        self._end_chunked()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _duration(value):
+    """Seconds in an Ollama keep_alive value ("5m", "1h30m", 300, "-1" = forever)."""
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)) or re.fullmatch(r"-?\d+(\.\d+)?", str(value)):
+        seconds = float(value)
+    else:
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        seconds = sum(float(n) * units[unit] for n, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value))
+    return float("inf") if seconds < 0 else seconds
+
+
+class MockLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, first_token_ms=0, token_ms=0, answers=None,
+                 default_answer="SELECT 1;", load_ms=0, tail_ms=0, tail_rate=0):
+        self.first_token_ms = first_token_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.token_ms = token_ms
+        self.answers = answers or {}
+        self.default_answer = default_answer
+        self.load_ms = load_ms
+        self.requests = 0
+        self.loads = 0
+        self.received = []  # (time.monotonic(), path, body) of each request, for tests
+        self._loaded_until = {}  # Ollama model -> time.monotonic() it is unloaded at
+        self._load_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    def load(self, body):
+        """Load the request's Ollama model if needed; returns load_duration in nanoseconds."""
+        model = body.get("model", "mock")
+        started = time.monotonic()
+        with self._load_lock:
+            # Like Ollama, one load at a time; requests that arrive meanwhile wait for it
+            if self._loaded_until.get(model, 0) <= time.monotonic():
+                time.sleep(self.load_ms / 1000)
+                self.loads += 1
+            self._loaded_until[model] = time.monotonic() + _duration(body.get("keep_alive"))
+        return int((time.monotonic() - started) * 1e9)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-ms", type=float, default=0)
+    parser.add_argument("--token-ms", type=float, default=0)
+    parser.add_argument("--load-ms", type=float, default=0, help="Ollama model load time after keep_alive expires")
+    args = parser.parse_args()
+    server = MockLLMServer(args.host, args.port, args.first_token_ms, args.token_ms, load_ms=args.load_ms)
+    print(f"Mock LLM server on {server.url} (OpenAI: {server.url}/v1, Ollama and Gemini: {server.url})")
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
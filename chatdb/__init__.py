@@ -0,0 +1 @@
+"""Shared building blocks for the DB Chat Assistant Streamlit apps."""
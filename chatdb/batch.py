@@ -0,0 +1,201 @@
+"""Headless batch runner: prompts in, SQL (and optionally results) out.
+
+Reads one JSON object per line, generates SQL for each prompt with the same
+engine the apps use, optionally executes it, and writes one result per prompt
+with per-stage timings. Output is JSONL, or Parquet when the output path ends
+in .parquet (needs pyarrow).
+
+    python -m chatdb.batch prompts.jsonl -o results.jsonl --concurrency 8 --execute
+
+Database and provider settings come from `.env`, as in the apps. Queries the
+cost guardrails would hold for confirmation are skipped unless --force is given.
+With --repair (or REPAIR_MODE=1) a query that fails is sent back to the model
+with its error, and the attempts are recorded with the result.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chatdb import engine
+from chatdb.planner import plan_query
+from chatdb.query_control import RunningQuery
+from chatdb.repair import RepairPolicy, repair_enabled, repair_query, repairable
+from chatdb.tracing import start_trace
+
+
+def read_prompts(path, field, id_field):
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {field: item}
+            yield {"id": item.get(id_field, line_number), "prompt": item[field]}
+
+
+def _ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def run_one(settings, item, execute=False, force=False, max_rows=None, repair=False):
+    # Traced like an app request, so TRACE_EXPORT_PATH gets one trace per prompt
+    with start_trace("batch", prompt_id=str(item["id"]), provider=settings.ai_provider):
+        return _run_one(settings, item, execute, force, max_rows, repair)
+
+
+def _run_one(settings, item, execute, force, max_rows, repair):
+    result = {
+        "id": item["id"],
+        "prompt": item["prompt"],
+        "raw": None,
+        "sql": None,
+        "error": None,
+        "plan": None,
+        "columns": None,
+        "rows": None,
+        "row_count": 0,
+        "truncated": None,
+        "repairs": None,
+        "timings": {},
+    }
+    timings = result["timings"]
+    started = time.perf_counter()
+    try:
+        stage = time.perf_counter()
+        result["raw"] = engine.generate_sql(settings, item["prompt"])
+        timings["generate_ms"] = _ms(stage)
+
+        stage = time.perf_counter()
+        result["sql"] = engine.extract_sql(result["raw"])
+        timings["extract_ms"] = _ms(stage)
+
+        if execute and result["sql"]:
+            if os.getenv("PLAN_QUERIES", "1") == "1":
+                stage = time.perf_counter()
+                result["plan"] = plan_query(settings.pool(), settings.db_type, result["sql"])
+                result["sql"] = result["plan"]["sql"]
+                timings["plan_ms"] = _ms(stage)
+                if result["plan"]["action"] == "confirm" and not force:
+                    result["error"] = f"Not executed: {result['plan']['reason']} (use --force to run it)."
+                    return result
+
+            stage = time.perf_counter()
+            columns, data, error, truncated = engine.run_query(settings, result["sql"], max_rows)
+            timings["execute_ms"] = _ms(stage)
+            if error and repair and repairable(error):
+                stage = time.perf_counter()
+                policy = RepairPolicy()
+
+                def execute_candidate(sql):
+                    # Repaired candidates go through the same guardrails as the first query
+                    if os.getenv("PLAN_QUERIES", "1") == "1":
+                        plan = plan_query(settings.pool(), settings.db_type, sql)
+                        if plan["action"] == "confirm" and not force:
+                            return f"Not executed: {plan['reason']}.", None
+                        sql = plan["sql"]
+                    control = RunningQuery(settings.db_type, settings.connect, timeout=policy.query_timeout())
+                    outcome = engine.run_query(settings, sql, max_rows, control)
+                    return outcome[2], outcome
+
+                fix = repair_query(settings, item["prompt"], result["sql"], error, execute_candidate, policy)
+                result["repairs"] = fix.attempts
+                timings["repair_ms"] = _ms(stage)
+                if fix.repaired:
+                    result["raw"], result["sql"] = fix.raw, fix.sql
+                    columns, data, error, truncated = fix.result
+            result.update(columns=columns, error=error, truncated=truncated)
+            if isinstance(data, list):
+                result["rows"] = [list(row) for row in data]
+                result["row_count"] = len(data)
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        timings["total_ms"] = _ms(started)
+    return result
+
+
+def write_jsonl(results, path):
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        for result in results:
+            out.write(json.dumps(result, default=str) + "\n")
+            out.flush()
+            yield result
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def write_parquet(results, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    records = []
+    for result in results:
+        record = {k: v for k, v in result.items() if k not in ("timings", "plan", "columns", "rows", "repairs")}
+        record.update(result["timings"])
+        # Nested values are kept as JSON text so every row has the same schema
+        for key in ("plan", "columns", "rows", "repairs"):
+            record[key] = None if result[key] is None else json.dumps(result[key], default=str)
+        record["id"] = str(record["id"])
+        records.append(record)
+        yield result
+    pq.write_table(pa.Table.from_pylist(records), path)
+
+
+def summarize(results):
+    stages = {}
+    failed = 0
+    for result in results:
+        failed += bool(result["error"])
+        for stage, ms in result["timings"].items():
+            stages.setdefault(stage, []).append(ms)
+    lines = [f"{len(results)} prompts, {failed} with errors"]
+    for stage, values in stages.items():
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        lines.append(f"  {stage:<12} p50 {p50:9.1f} ms   p95 {p95:9.1f} ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file with one prompt per line")
+    parser.add_argument("-o", "--output", default="-", help="JSONL or .parquet path (default: stdout)")
+    parser.add_argument("--field", default="prompt", help="key holding the prompt (default: prompt)")
+    parser.add_argument("--id-field", default="id", help="key holding the prompt id (default: line number)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", 4)))
+    parser.add_argument("--provider", help="override AI_PROVIDER")
+    parser.add_argument("--execute", action="store_true", help="also run the generated SQL")
+    parser.add_argument("--force", action="store_true", help="run queries held by the cost guardrails")
+    parser.add_argument("--max-rows", type=int, default=None, help="rows kept per result")
+    parser.add_argument("--repair", action="store_true", default=None,
+                        help="feed failing queries' errors back to the model (default: REPAIR_MODE)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    repair = repair_enabled() if args.repair is None else args.repair
+    settings = engine.Settings.from_env(args.provider)
+    items = list(read_prompts(args.input, args.field, args.id_field))
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        # map() yields in input order, so output lines match input lines
+        results = executor.map(lambda item: run_one(settings, item, args.execute, args.force, args.max_rows, repair), items)
+        writer = write_parquet if args.output.endswith(".parquet") else write_jsonl
+        done = list(writer(results, args.output))
+
+    print(summarize(done), file=sys.stderr)
+    return 0 if all(not r["error"] for r in done) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
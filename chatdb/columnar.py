@@ -0,0 +1,165 @@
+"""Compact column-oriented query results.
+
+Rows from the driver are transposed into one buffer per column. Integer and
+float columns use typed array.array buffers (8 bytes per value instead of a
+Python object per cell); everything else stays a plain list. to_arrow() wraps
+the typed buffers without copying them, and Streamlit serialises a pyarrow Table
+straight to the frontend without going through pandas. Loading more rows into a
+column that a table still shares moves the column to a copy, so the table keeps
+the rows it was built from.
+"""
+
+from array import array
+
+
+INT, FLOAT, OBJECT = "int", "float", "object"
+
+# cursor.description type codes: psycopg2 reports type OIDs, pymysql FIELD_TYPE values
+_TYPE_KINDS = {
+    "postgresql": {20: INT, 21: INT, 23: INT, 26: INT, 700: FLOAT, 701: FLOAT},
+    "mysql": {1: INT, 2: INT, 3: INT, 8: INT, 9: INT, 13: INT, 4: FLOAT, 5: FLOAT},
+}
+_TYPECODES = {INT: "q", FLOAT: "d"}
+
+
+def column_kinds(db_type, description):
+    kinds = _TYPE_KINDS.get(db_type, {})
+    return [kinds.get(desc[1], OBJECT) for desc in description]
+
+
+class ColumnarResult:
+    def __init__(self, columns, kinds, buffers=None, nulls=None, length=0):
+        self.columns = list(columns)
+        self.kinds = list(kinds)
+        self.buffers = buffers if buffers is not None else [
+            array(_TYPECODES[k]) if k in _TYPECODES else [] for k in self.kinds
+        ]
+        # Per-column null masks (bytearray, 1 = NULL); only typed columns need one
+        self.nulls = nulls if nulls is not None else [
+            bytearray() if k in _TYPECODES else None for k in self.kinds
+        ]
+        self._length = length
+
+    @classmethod
+    def from_rows(cls, db_type, description, rows):
+        result = cls([desc[0] for desc in description], column_kinds(db_type, description))
+        result.extend(rows)
+        return result
+
+    def extend(self, rows):
+        if not rows:
+            return
+        for i, values in enumerate(zip(*rows)):
+            if self.kinds[i] in _TYPECODES:
+                try:
+                    self._extend_typed(i, values)
+                    continue
+                except (TypeError, OverflowError):
+                    # e.g. an unsigned BIGINT beyond int64 or an unexpected type
+                    self._demote(i)
+            self.buffers[i].extend(values)
+        self._length += len(rows)
+
+    def _extend_typed(self, i, values):
+        buffer, mask = self.buffers[i], self.nulls[i]
+        if None in values:
+            fill = 0 if self.kinds[i] == INT else 0.0
+            chunk = array(buffer.typecode, [fill if v is None else v for v in values])
+            chunk_mask = bytes(v is None for v in values)
+        else:
+            chunk = array(buffer.typecode, values)
+            chunk_mask = bytes(len(values))
+        self.buffers[i] = _append(buffer, chunk)
+        self.nulls[i] = _append(mask, chunk_mask)
+
+    def _demote(self, i):
+        buffer, mask = self.buffers[i], self.nulls[i]
+        self.buffers[i] = [None if null else value for value, null in zip(buffer, mask)]
+        self.nulls[i] = None
+        self.kinds[i] = OBJECT
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            buffers = [b[start:stop:step] for b in self.buffers]
+            nulls = [m[start:stop:step] if m is not None else None for m in self.nulls]
+            return ColumnarResult(self.columns, self.kinds, buffers, nulls, len(range(start, stop, step)))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("row index out of range")
+        return tuple(
+            None if (m is not None and m[index]) else b[index]
+            for b, m in zip(self.buffers, self.nulls)
+        )
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
+
+    def column(self, name):
+        i = self.columns.index(name)
+        buffer, mask = self.buffers[i], self.nulls[i]
+        if mask is None:
+            return list(buffer)
+        return [None if null else value for value, null in zip(buffer, mask)]
+
+    @property
+    def nbytes(self):
+        total = 0
+        for buffer, mask in zip(self.buffers, self.nulls):
+            if isinstance(buffer, array):
+                total += buffer.itemsize * len(buffer) + len(mask)
+            else:
+                total += 8 * len(buffer)  # pointer per cell; the objects themselves are not counted
+        return total
+
+    def to_arrow(self):
+        import numpy as np
+        import pyarrow as pa
+
+        arrays = []
+        for buffer, mask in zip(self.buffers, self.nulls):
+            if isinstance(buffer, array):
+                # np.frombuffer shares memory with the array.array buffer
+                values = np.frombuffer(buffer, dtype=np.int64 if buffer.typecode == "q" else np.float64)
+                if any(mask):
+                    arrays.append(pa.array(values, mask=np.frombuffer(mask, dtype=np.bool_)))
+                else:
+                    arrays.append(pa.array(values))
+            else:
+                try:
+                    arrays.append(pa.array(buffer))
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    # Mixed Python types in one column; show them as text
+                    arrays.append(pa.array([None if v is None else str(v) for v in buffer]))
+        return pa.Table.from_arrays(arrays, names=_unique_names(self.columns))
+
+
+def _append(buffer, chunk):
+    try:
+        buffer.extend(chunk)
+        return buffer
+    except BufferError:
+        # A table from to_arrow() still shares this buffer, which cannot grow while
+        # exported: leave it to the table and carry on in a copy
+        copy = array(buffer.typecode, buffer) if isinstance(buffer, array) else bytearray(buffer)
+        copy.extend(chunk)
+        return copy
+
+
+def _unique_names(columns):
+    # Arrow tables allow duplicate names but Streamlit's dataframe does not
+    seen = {}
+    names = []
+    for name in columns:
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
@@ -0,0 +1,318 @@
+"""The NL-to-SQL pipeline without Streamlit.
+
+`Settings` holds the database and provider configuration that the apps read
+from their sidebar (or `Settings.from_env()` reads from `.env`), and the module
+functions are the steps the apps run: `generate_sql`, `extract_sql` and
+`execute_query` (or `run_query` to read the whole result). Nothing here imports
+Streamlit, and database drivers and provider SDKs are imported only when a
+connection or client of that kind is first needed, so the same code drives the
+apps, the batch runner (`python -m chatdb.batch`) and the benchmarks. Each step
+is timed as a span of the caller's trace (chatdb/tracing.py), if there is one.
+"""
+
+import logging
+import os
+import time
+
+from chatdb.columnar import ColumnarResult
+from chatdb.hedging import HedgedStream, hedge_delay, hedge_provider
+from chatdb.llm import PROVIDERS, ProviderConfig, get_runner
+from chatdb.llm_cache import get_sql_cache
+from chatdb.metrics import get_registry
+from chatdb.planner import plan_query
+from chatdb.pool import get_pool, pool_key
+from chatdb.prompt_prefix import PromptPrefix, get_prefix_cache
+from chatdb.query_control import RunningQuery, error_class
+from chatdb.result_cache import ROW_STATEMENTS, get_result_cache, referenced_tables, statement_kind
+from chatdb.schema import get_catalog
+from chatdb.schema_selector import estimate_tokens, get_selector
+from chatdb.sql_extract import extract_sql as _extract_sql
+from chatdb.streaming import ResultStream
+from chatdb.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+
+_QUERY_SECONDS = get_registry().histogram(
+    "chatdb_query_seconds", "execute_query time, to the first page of a SELECT", ("db_type",))
+_QUERY_ERRORS = get_registry().counter(
+    "chatdb_query_errors_total", "Failed queries by error class", ("db_type", "error_class"))
+_ROWS = get_registry().counter(
+    "chatdb_query_rows_total", "Rows returned, from the database or the result cache", ("db_type", "source"))
+
+_DEFAULT_MODELS = {
+    "OPENAI": "gpt-3.5-turbo",
+    "GEMINI": "gemini-1.5-pro",
+    "OLLAMA": "llama3",
+    "DEEPSEEK": "deepseek-default-model",
+}
+
+
+class Settings:
+    def __init__(self, db_type, db_host, db_port, db_user, db_password, db_name,
+                 ai_provider, model, api_key="", base_url=""):
+        self.db_type = db_type
+        self.db_host = db_host
+        self.db_port = int(db_port)
+        self.db_user = db_user
+        self.db_password = db_password
+        self.db_name = db_name
+        self.ai_provider = ai_provider.upper()
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+
+    @classmethod
+    def from_env(cls, ai_provider=None):
+        db_type = os.getenv("DB_TYPE", "mysql").lower()
+        ai_provider = (ai_provider or os.getenv("AI_PROVIDER", "OPENAI")).upper()
+        if ai_provider not in PROVIDERS:
+            raise ValueError("Unsupported AI_PROVIDER. Use 'OPENAI', 'GEMINI', 'OLLAMA' or 'DEEPSEEK'.")
+        model = os.getenv(f"{ai_provider}_MODEL") or _DEFAULT_MODELS[ai_provider]
+        api_key = os.getenv(f"{ai_provider}_API_KEY", "")
+        base_url = ""
+        if ai_provider == "OLLAMA":
+            base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        elif ai_provider == "GEMINI":
+            base_url = os.getenv("GEMINI_BASE_URL", "")
+        elif ai_provider == "DEEPSEEK":
+            base_url = os.getenv("DEEPSEEK_API_BASE_URL", "https://api.deepseek.com")
+        return cls(
+            db_type,
+            os.getenv("DB_HOST", "localhost"),
+            int(os.getenv("DB_PORT", 3306 if db_type == "mysql" else 5432)),
+            os.getenv("DB_USER", "root"),
+            os.getenv("DB_PASSWORD", ""),
+            os.getenv("DB_NAME", "testdb"),
+            ai_provider, model, api_key, base_url,
+        )
+
+    def provider_config(self):
+        return ProviderConfig(self.ai_provider, self.model, self.api_key, self.base_url)
+
+    def connect(self):
+        if self.db_type == "postgresql":
+            import psycopg2
+            return psycopg2.connect(host=self.db_host, port=self.db_port, user=self.db_user,
+                                    password=self.db_password, dbname=self.db_name)
+        elif self.db_type == "mysql":
+            import pymysql
+            return pymysql.connect(host=self.db_host, port=self.db_port, user=self.db_user,
+                                   password=self.db_password, database=self.db_name)
+        elif self.db_type == "sqlite":
+            import sqlite3
+            # DB_NAME is the database file; pooled connections move between threads
+            return sqlite3.connect(self.db_name, check_same_thread=False)
+        else:
+            raise ValueError("Unsupported DB_TYPE")
+
+    def pool(self):
+        # Borrow pooled connections instead of paying the connect/auth handshake per query
+        return get_pool(self.db_type, self.db_host, self.db_port, self.db_user, self.db_password,
+                        self.db_name, self.connect)
+
+    def stream_pool(self):
+        # Open result streams hold a connection between pages, so they get their own budget
+        # and cannot starve EXPLAIN, writes and schema reads of pooled connections
+        return get_pool(self.db_type, self.db_host, self.db_port, self.db_user, self.db_password,
+                        self.db_name, self.connect, role="stream", min_size=0,
+                        max_size=int(os.getenv("DB_STREAM_POOL_MAX_SIZE", 5)))
+
+    def pool_key(self):
+        return pool_key(self.db_type, self.db_host, self.db_port, self.db_user, self.db_name)
+
+
+# The system prompt: instructions, then the (cached) schema catalog used to ground
+# the SQL. It is the same string for every question while the schema is unchanged,
+# so providers can serve it from their prompt cache (chatdb/prompt_prefix.py).
+def load_prompt_prefix(settings, prompt):
+    with span("schema") as stage:
+        prefix, fingerprint, cached = _load_prompt_prefix(settings, prompt)
+        stage.set(tokens=prefix.schema_tokens, prefix=prefix.key, cached=cached)
+    return prefix, fingerprint
+
+
+def _load_prompt_prefix(settings, prompt):
+    catalog = get_catalog(settings.db_type, settings.db_host, settings.db_port, settings.db_user, settings.db_name)
+    try:
+        catalog.refresh(settings.pool())
+    except Exception as e:
+        # Generation still works without schema context, just less accurately
+        logger.warning("Schema refresh failed: %s", e)
+    prefixes = get_prefix_cache()
+    scope = (id(catalog), catalog.revision, settings.db_type)
+
+    def build(tables=None):
+        schema_text = catalog.to_prompt(tables)
+        return PromptPrefix(build_system_prompt(settings.db_type, schema_text), estimate_tokens(schema_text))
+
+    prefix, cached = prefixes.get(scope + (None,), build)
+    budget = int(os.getenv("SCHEMA_TOKEN_BUDGET", 2000))
+    if prefix.schema_tokens > budget:
+        # Too big to send whole: keep only the tables relevant to this question. They
+        # are listed in name order, so questions that pick the same tables share a prefix.
+        tables = tuple(sorted(get_selector(catalog).select(prompt, catalog.describe_table,
+                                                           int(os.getenv("SCHEMA_TOP_K", 8)), budget)))
+        prefix, cached = prefixes.get(scope + (tables,), lambda: build(tables))
+    return prefix, catalog.fingerprint(), cached
+
+
+def build_system_prompt(db_type, schema_text):
+    system_prompt = f"You are an expert SQL assistant for a {db_type} database. Generate only the SQL query, nothing else."
+    if schema_text:
+        system_prompt += f"\nUse only these tables and columns:\n{schema_text}"
+    return system_prompt
+
+
+# Generate SQL using AI, answering repeated questions from the cache.
+# `call(prompt, system_prompt)` does the provider call; the apps pass one that
+# renders tokens as they stream in.
+def generate_sql(settings, prompt, call=None):
+    prefix, schema_fingerprint = load_prompt_prefix(settings, prompt)
+    sql_cache = get_sql_cache()
+    with span("sql_cache") as stage:
+        cached = sql_cache.get(settings.ai_provider, settings.model, settings.db_type, schema_fingerprint, prompt)
+        stage.set(hit=cached is not None)
+    if cached is not None:
+        return cached
+
+    system_prompt = prefix.text
+    with span("llm", provider=settings.ai_provider, model=settings.model):
+        if call is None:
+            raw_sql = generate_text(settings, system_prompt, prompt)
+        else:
+            raw_sql = call(prompt, system_prompt)
+    # Only cache answers that contain SQL, not provider errors
+    if _extract_sql(raw_sql):
+        sql_cache.put(settings.ai_provider, settings.model, settings.db_type, schema_fingerprint, prompt, raw_sql)
+    return raw_sql
+
+
+def stream_sql(settings, system_prompt, prompt, timeouts=None):
+    """Start a provider call: a TokenStream, or with HEDGE_PROVIDER set a HedgedStream (chatdb/hedging.py)."""
+    hedge = hedge_provider(settings.ai_provider)
+    if hedge is None:
+        return get_runner().stream(settings.provider_config(), system_prompt, prompt, timeouts)
+    return HedgedStream(get_runner(), settings.provider_config(), Settings.from_env(hedge).provider_config(),
+                        system_prompt, prompt, lambda text: _valid_sql(settings, text),
+                        hedge_delay(settings.ai_provider), timeouts)
+
+
+def generate_text(settings, system_prompt, prompt, timeouts=None):
+    if hedge_provider(settings.ai_provider) is None:
+        return get_runner().generate(settings.provider_config(), system_prompt, prompt, timeouts)
+    stream = stream_sql(settings, system_prompt, prompt, timeouts)
+    for _ in stream:
+        pass
+    return stream.text
+
+
+def _valid_sql(settings, text):
+    # What a hedged answer must pass to win: SQL that extracts and that the database can EXPLAIN
+    sql = _extract_sql(text)
+    return bool(sql) and plan_query(settings.pool(), settings.db_type, sql)["error"] is None
+
+
+def extract_sql(text):
+    with span("extract"):
+        return _extract_sql(text)
+
+
+def remember_sql(settings, prompt, raw_sql):
+    """Cache `raw_sql` as the answer to `prompt`, e.g. once a repaired query has run."""
+    catalog = get_catalog(settings.db_type, settings.db_host, settings.db_port, settings.db_user, settings.db_name)
+    get_sql_cache().put(settings.ai_provider, settings.model, settings.db_type, catalog.fingerprint(), prompt, raw_sql)
+
+
+def preload_model(settings):
+    """With OLLAMA_PRELOAD=1, load a local Ollama model before the first question; a Future or None."""
+    if os.getenv("OLLAMA_PRELOAD", "0") != "1":
+        return None
+    return get_runner().preload(settings.provider_config())
+
+
+# Execute SQL query; SELECT results are streamed and only the first page is fetched here.
+# Returns (columns, data, error, stream); `stream` is the still-open ResultStream
+# when there are more rows to fetch.
+def execute_query(settings, sql, control=None):
+    started = time.perf_counter()
+    with span("execute", db_type=settings.db_type) as stage:
+        columns, data, error, stream = _execute_query(settings, sql, control)
+        stage.set(error=error, rows=None if data is None or isinstance(data, str) else len(data))
+    _QUERY_SECONDS.observe(time.perf_counter() - started, db_type=settings.db_type)
+    if error:
+        _QUERY_ERRORS.inc(db_type=settings.db_type, error_class=error_class(error))
+    return columns, data, error, stream
+
+
+def _execute_query(settings, sql, control):
+    pool = settings.pool()
+    # Server-side execution budget and a handle the UI can cancel through
+    control = control or RunningQuery(settings.db_type, settings.connect)
+    result_cache = get_result_cache()
+    conn_key = settings.pool_key()
+    # Classified past leading comments, with WITH queries as the statement they wrap
+    kind = statement_kind(sql, settings.db_type)
+    if kind in ROW_STATEMENTS:
+        # SHOW, EXPLAIN and the like are not cached: no table write would invalidate them
+        cacheable = kind in ("select", "values")
+        if cacheable:
+            with span("result_cache") as stage:
+                cached = result_cache.get(conn_key, sql, settings.db_type)
+                stage.set(hit=cached is not None)
+            if cached is not None:
+                _ROWS.inc(len(cached[1] or ()), db_type=settings.db_type, source="cache")
+                return cached[0], cached[1], None, None
+        try:
+            stream = ResultStream(settings.stream_pool(), settings.db_type, sql, control=control,
+                                  server_side=cacheable)
+            data = stream.fetch_page()
+            if os.getenv("RESULT_COLUMNAR", "1") == "1" and stream.description:
+                with span("columnar"):
+                    data = ColumnarResult.from_rows(settings.db_type, stream.description, data)
+        except Exception as e:
+            return None, None, control.outcome(e), None
+        control.outcome()
+        # Only complete results are cached; a paged or capped result would replay partially
+        if cacheable and stream.closed and not stream.truncated:
+            result_cache.put(conn_key, sql, stream.columns, data, settings.db_type)
+        return stream.columns, data, None, (None if stream.closed else stream)
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            control.start(conn)
+            with span("db.query"):
+                cursor.execute(sql)
+            conn.commit()
+            control.outcome()
+            # Drop cached SELECTs that read the tables this statement wrote (all of them if unknown)
+            result_cache.invalidate(conn_key, referenced_tables(sql, settings.db_type))
+            return None, "Query executed successfully.", None, None
+        except Exception as e:
+            return None, None, control.outcome(e), None
+        finally:
+            cursor.close()
+
+
+def run_query(settings, sql, max_rows=None, control=None):
+    """Execute `sql` and read its whole result: (columns, rows or message, error, truncated)."""
+    columns, data, error, stream = execute_query(settings, sql, control)
+    if error or isinstance(data, str):
+        return columns, data, error, None
+    rows = list(data or ())
+    truncated = None
+    if stream is not None:
+        try:
+            for page in stream:
+                rows.extend(page)
+                if max_rows and len(rows) >= max_rows:
+                    break
+        finally:
+            stream.close()
+        truncated = stream.truncated
+    if max_rows and len(rows) > max_rows:
+        rows = rows[:max_rows]
+        truncated = "max rows"
+    return columns, rows, None, truncated
@@ -0,0 +1,219 @@
+"""Hedged generation: race a second provider when the first one is slow to start.
+
+With HEDGE_PROVIDER set, a request still goes to the selected provider first
+and its tokens are streamed as usual. If no token has arrived after the
+primary's usual first-token time (HEDGE_AFTER: "p95" of its last HEDGE_WINDOW
+first-token times by default, or a number of seconds), the same prompt is
+also sent to HEDGE_PROVIDER. The first answer whose SQL extracts and passes
+EXPLAIN wins and the other request is cancelled. Requests that are never
+hedged are not validated, so hedging costs nothing while the primary is fast.
+
+Wins per provider and the tokens spent on losing requests (estimated, relative
+to the tokens of the answers used) are counted, so the tail-latency gain can
+be weighed against the extra provider cost. A stream the caller closes early
+(LLM_STOP_AFTER_STATEMENT) is settled as a primary answer; one it cancels
+(abandons) is counted as cancelled and not as a race.
+"""
+
+import math
+import os
+import time
+
+from chatdb.llm import recent_first_tokens
+from chatdb.metrics import get_registry
+from chatdb.schema_selector import estimate_tokens
+from chatdb.tracing import current_span
+
+
+_REQUESTS = get_registry().counter(
+    "chatdb_hedge_requests_total", "Generations with hedging on, by whether a second provider was started",
+    ("provider", "hedged"))
+_WINS = get_registry().counter(
+    "chatdb_hedge_wins_total", "Hedged races won, by provider and role (primary or secondary)", ("provider", "role"))
+_CANCELLED = get_registry().counter(
+    "chatdb_hedge_cancelled_total", "Generations with hedging on that were abandoned before an answer",
+    ("provider", "hedged"))
+_TOKENS = get_registry().counter(
+    "chatdb_hedge_tokens_total", "Estimated tokens of answers used (used) and of cancelled or losing requests (extra)",
+    ("kind",))
+
+
+def hedge_provider(primary):
+    provider = os.getenv("HEDGE_PROVIDER", "").strip().upper()
+    return provider if provider and provider != primary else None
+
+
+def hedge_delay(provider):
+    """Seconds to wait for the primary's first token before hedging."""
+    setting = os.getenv("HEDGE_AFTER", "p95").strip().lower()
+    if setting in ("p50", "p95", "p99"):
+        samples = sorted(recent_first_tokens(provider))
+        # A percentile of a handful of samples is mostly noise
+        if len(samples) >= int(os.getenv("HEDGE_MIN_SAMPLES", 20)):
+            # Nearest rank: the smallest sample with at least q of the samples at or below it
+            return samples[math.ceil(int(setting[1:]) / 100 * len(samples)) - 1]
+        return float(os.getenv("HEDGE_AFTER_DEFAULT", 3))
+    return float(setting)
+
+
+class HedgedStream:
+    """A TokenStream look-alike over the primary's stream, with the race decided at the end.
+
+    Iterating yields the primary's text (and "" while waiting); `text` is the
+    winning answer and `winner` its provider once iteration is over, or once
+    the stream is cancelled or closed before that.
+    """
+
+    def __init__(self, runner, primary, secondary, system_prompt, prompt, validate, delay, timeouts=None):
+        self._runner = runner
+        self._configs = (primary, secondary)
+        self._system_prompt = system_prompt
+        self._prompt = prompt
+        self._validate = validate
+        self._timeouts = timeouts
+        self.delay = delay
+        # Polled often, so the hedge starts and a finished secondary is noticed on time
+        self._stream = runner.stream(primary, system_prompt, prompt, timeouts, poll_interval=0.05)
+        self._secondary = None
+        self._secondary_parts = []
+        self._secondary_valid = None
+        self.hedged = False
+        self.winner = None
+        self._text = None
+        self._failed = False
+        self._cancelled = False
+
+    @property
+    def parts(self):
+        return self._stream.parts
+
+    @property
+    def text(self):
+        return self._text if self._text is not None else self._stream.text
+
+    def cancel(self):
+        """Abandon the generation, e.g. when a rerun supersedes it; no answer is used."""
+        if self._unsettled():
+            self._cancelled = True
+            _CANCELLED.inc(provider=self._configs[0].provider, hedged=str(self.hedged).lower())
+        self._stop()
+
+    def close(self):
+        """Stop reading early: what the primary sent so far is the answer."""
+        if self._unsettled():
+            self._decide(self._configs[0].provider, self._stream.text, "primary")
+        self._stop()
+
+    def done(self):
+        return self._stream.future.done() and (self._secondary is None or self._secondary.done())
+
+    def _unsettled(self):
+        return self.winner is None and not self._failed and not self._cancelled
+
+    def _stop(self):
+        self._stream.cancel()
+        if self._secondary is not None:
+            self._secondary.cancel()
+
+    def __iter__(self):
+        primary, secondary = self._configs
+        started = time.monotonic()
+        first_token = False
+        primary_error = None
+        try:
+            for piece in self._stream:
+                if piece:
+                    first_token = True
+                yield piece
+                if self._secondary is None and not first_token and time.monotonic() - started >= self.delay:
+                    self._hedge(secondary)
+                if self._secondary is not None and self._secondary.done() and self._secondary_wins():
+                    return
+        except Exception as e:
+            primary_error = e
+        primary_text = None if primary_error else self._stream.text
+        if not self.hedged or (primary_text and self._validate(primary_text)):
+            if primary_error:
+                self._failed = True
+                raise primary_error
+            self._decide(primary.provider, primary_text, "primary")
+            return
+        # The primary answered without usable SQL (or failed); the secondary may still
+        while not self._secondary.done():
+            time.sleep(0.05)
+            yield ""
+        if self._secondary_wins():
+            return
+        # Neither is valid: keep an answer anyway so the usual error reporting applies
+        text = self._secondary_result()
+        if primary_error is None or not text:
+            if primary_error:
+                self._failed = True
+                raise primary_error
+            self._decide(primary.provider, primary_text, "primary")
+            return
+        self._decide(secondary.provider, text, "secondary")
+
+    def _hedge(self, secondary):
+        self.hedged = True
+        current_span().set(hedged_after_s=round(self.delay, 3), hedge_provider=secondary.provider)
+        self._secondary = self._runner.submit(secondary, self._system_prompt, self._prompt, self._timeouts,
+                                              on_chunk=self._secondary_parts.append)
+
+    def _secondary_result(self):
+        try:
+            return self._secondary.result()
+        except Exception:
+            return None
+
+    def _secondary_wins(self):
+        if self._secondary_valid is None:
+            # Validated once; EXPLAIN is not repeated on every poll
+            text = self._secondary_result()
+            self._secondary_valid = bool(text) and self._validate(text)
+            if self._secondary_valid:
+                self._decide(self._configs[1].provider, text, "secondary")
+        return self._secondary_valid
+
+    def _decide(self, provider, text, role):
+        self.winner = provider
+        self._text = text
+        prompt_tokens = estimate_tokens(self._system_prompt + self._prompt)
+        _REQUESTS.inc(provider=self._configs[0].provider, hedged=str(self.hedged).lower())
+        _TOKENS.inc(prompt_tokens + estimate_tokens(text), kind="used")
+        if not self.hedged:
+            return
+        _WINS.inc(provider=provider, role=role)
+        current_span().set(winner=provider)
+        # The loser was billed for its prompt and whatever it wrote before it lost
+        loser_text = "".join(self._secondary_parts) if role == "primary" else "".join(self._stream.parts)
+        _TOKENS.inc(prompt_tokens + estimate_tokens(loser_text), kind="extra")
+        if role == "primary":
+            self._secondary.cancel()
+        else:
+            self._stream.cancel()
+
+
+def hedge_stats():
+    requests = _REQUESTS.values()
+    cancelled = sum(_CANCELLED.values().values())
+    wins = _WINS.values()
+    tokens = _TOKENS.values()
+    total = sum(requests.values())
+    hedged = sum(count for (_, was_hedged), count in requests.items() if was_hedged == "true")
+    races = sum(wins.values())
+    by_provider = {}
+    for (provider, role), count in sorted(wins.items()):
+        by_provider.setdefault(provider, {"primary": 0, "secondary": 0})[role] = count
+    used = tokens.get(("used",), 0)
+    extra = tokens.get(("extra",), 0)
+    return {
+        "requests": total,
+        "hedged": hedged,
+        "hedge_rate": round(hedged / total, 3) if total else 0.0,
+        "cancelled": cancelled,
+        "wins": by_provider,
+        "win_rate": {provider: round(sum(roles.values()) / races, 3) for provider, roles in by_provider.items()},
+        "extra_tokens": extra,
+        "cost_overhead": round(extra / used, 3) if used else 0.0,
+    }
@@ -0,0 +1,81 @@
+"""Cached SQL syntax highlighting.
+
+Every Streamlit rerun renders each history record's SQL twice (sidebar and
+chat). Building a new HtmlFormatter and SqlLexer and re-highlighting each time
+makes reruns slower as the history grows. Here the lexer is built once, a
+formatter once per theme, and the rendered HTML is kept in a bounded LRU keyed
+by (SQL hash, theme). Pygments itself is imported on first use.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from chatdb.metrics import get_registry
+from chatdb.tracing import span
+
+
+_lexer = None
+_formatters = {}
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _formatter(theme):
+    # Pygments is imported on first use, not when the app starts
+    global _lexer
+    formatter = _formatters.get(theme)
+    if formatter is None:
+        from pygments.formatters.html import HtmlFormatter
+        from pygments.lexers import SqlLexer
+
+        if _lexer is None:
+            _lexer = SqlLexer()
+        formatter = _formatters[theme] = HtmlFormatter(style=theme, noclasses=True)
+    return formatter
+
+
+def highlight_sql(code, theme="monokai"):
+    with span("highlight") as stage:
+        html, cached = _highlight(code, theme)
+        stage.set(cached=cached)
+    return html
+
+
+def _highlight(code, theme):
+    key = (hashlib.sha1(code.encode("utf-8")).digest(), theme)
+    with _lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return html, True
+        _stats["misses"] += 1
+        formatter = _formatter(theme)
+
+    from pygments import highlight
+
+    html = highlight(code, _lexer, formatter)
+
+    max_entries = int(os.getenv("HIGHLIGHT_CACHE_SIZE", 512))
+    with _lock:
+        _cache[key] = html
+        while len(_cache) > max_entries:
+            _cache.popitem(last=False)
+    return html, False
+
+
+def highlight_cache_stats():
+    with _lock:
+        return {"entries": len(_cache), **_stats}
+
+
+def _collect_highlight_cache():
+    stats = highlight_cache_stats()
+    return [("chatdb_highlight_cache_lookups_total", "counter", "Highlight cache lookups by result",
+             [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])])]
+
+
+get_registry().register_collector(_collect_highlight_cache)
@@ -0,0 +1,543 @@
+"""Non-blocking LLM calls on a shared asyncio event loop.
+
+Provider requests run on one background event loop per process instead of on
+the Streamlit script thread. Every request gets a connect timeout, a
+first-token timeout and a total timeout; callers get a concurrent.futures
+Future they can wait on or cancel (e.g. when the user submits a new prompt).
+A semaphore bounds how many provider calls run at once across all sessions,
+and calls, latency and tokens are counted per provider in the metrics registry
+(chatdb/metrics.py). Token counts are the provider's own where it reports them
+in the stream, otherwise estimated from the text.
+
+System prompts arrive byte-identical across calls (chatdb/prompt_prefix.py), so
+providers can serve them from their prompt cache: OpenAI and DeepSeek do it
+automatically (OpenAI also gets the prefix hash as prompt_cache_key), long
+Gemini prefixes are uploaded once as cached content on the REST path
+(GEMINI_BASE_URL; GEMINI_CACHE_MIN_TOKENS, GEMINI_CACHE_TTL), and Ollama
+reuses the evaluated prefix while the model is loaded. The cached share of
+prompt tokens is counted per provider.
+
+A local Ollama model is unloaded after it idles for its keep-alive (5 minutes
+by default), and the next request waits seconds for it to load again. Requests
+send OLLAMA_KEEP_ALIVE, `preload()` loads the model ahead of the first question
+(OLLAMA_PRELOAD=1 in the apps and the API server), and a heartbeat on the event
+loop re-sends the keep-alive every OLLAMA_HEARTBEAT_INTERVAL seconds while UI
+sessions are active or the model was used within OLLAMA_HEARTBEAT_IDLE seconds.
+First-token latency is recorded separately for cold (model loaded by the
+request) and warm starts.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+from chatdb.metrics import LLM_BUCKETS, active_sessions, get_registry
+from chatdb.prompt_prefix import prefix_key
+from chatdb.providers import ProviderRegistry
+from chatdb.schema_selector import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+PROVIDERS = ("OPENAI", "GEMINI", "OLLAMA", "DEEPSEEK")
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+class ProviderConfig:
+    def __init__(self, provider, model, api_key="", base_url=""):
+        self.provider = provider
+        self.model = model
+        self.api_key = api_key or ""
+        self.base_url = base_url or ""
+
+    def key(self):
+        return (self.provider, self.api_key, self.base_url, self.model)
+
+
+def ollama_keep_alive():
+    """OLLAMA_KEEP_ALIVE as Ollama takes it ("30m", "-1" = forever, 600 seconds), or None for its default."""
+    value = os.getenv("OLLAMA_KEEP_ALIVE", "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _keep_alive_seconds(value):
+    if value is None:
+        return 300.0
+    if isinstance(value, int):
+        seconds = float(value)
+    else:
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        seconds = sum(float(n) * units[unit] for n, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value))
+    return math.inf if seconds < 0 else seconds
+
+
+class Timeouts:
+    def __init__(self, connect=None, first_token=None, total=None):
+        self.connect = float(os.getenv("LLM_CONNECT_TIMEOUT", 10)) if connect is None else connect
+        self.first_token = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", 30)) if first_token is None else first_token
+        self.total = float(os.getenv("LLM_TOTAL_TIMEOUT", 120)) if total is None else total
+
+
+_REQUESTS = get_registry().counter(
+    "chatdb_llm_requests_total", "Provider calls by outcome (ok, timeout, cancelled, error)", ("provider", "outcome"))
+_LATENCY = get_registry().histogram(
+    "chatdb_llm_generation_seconds", "Time from request to the complete answer", ("provider",), LLM_BUCKETS)
+_FIRST_TOKEN = get_registry().histogram(
+    "chatdb_llm_first_token_seconds", "Time from request to the first piece of text", ("provider",), LLM_BUCKETS)
+_TOKENS = get_registry().counter(
+    "chatdb_llm_tokens_total", "Prompt (in) and completion (out) tokens", ("provider", "direction"))
+_CACHED_TOKENS = get_registry().counter(
+    "chatdb_llm_cached_prompt_tokens_total", "Prompt tokens the provider served from its prompt cache", ("provider",))
+_FIRST_TOKEN_BY_START = get_registry().histogram(
+    "chatdb_llm_first_token_by_start_seconds", "Time to first token, by whether the model had to be loaded (Ollama)",
+    ("provider", "start"), LLM_BUCKETS)
+_KEEPALIVE = get_registry().counter(
+    "chatdb_ollama_keepalive_requests_total", "Ollama preload and heartbeat requests", ("kind", "outcome"))
+_OUTCOMES = ("ok", "timeout", "cancelled", "error")
+# The most recent first-token times per provider; the histogram's percentiles are only bucket bounds
+_RECENT_FIRST_TOKENS = {}
+_recent_lock = threading.Lock()
+# A warm Ollama request still reports a few milliseconds of load_duration
+_COLD_LOAD_S = 0.25
+
+
+_DONE = object()
+
+
+class TokenStream:
+    """Iterate over generated text on the calling thread.
+
+    Yields "" every `poll_interval` seconds while waiting, so a Streamlit script
+    can keep making st calls (and stay interruptible) during long pauses.
+    Pieces are kept in a list and joined once, so accumulating is linear.
+    """
+
+    def __init__(self, future, chunks, poll_interval=0.25):
+        self.future = future
+        self.parts = []
+        self._chunks = chunks
+        self._poll_interval = poll_interval
+
+    def __iter__(self):
+        while True:
+            try:
+                chunk = self._chunks.get(timeout=self._poll_interval)
+            except queue.Empty:
+                yield ""
+                continue
+            if chunk is _DONE:
+                break
+            self.parts.append(chunk)
+            yield chunk
+        if not self.future.cancelled():
+            self.future.result()  # surface timeouts and provider errors
+
+    def cancel(self):
+        self.future.cancel()
+
+    def close(self):
+        """Stop generating once the caller has read all it needs (a HedgedStream also keeps the answer)."""
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def text(self):
+        return "".join(self.parts).strip()
+
+
+class LLMRunner:
+    def __init__(self, max_concurrency=None):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="chatdb-llm", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(), self.loop).result()
+
+        self.registry = ProviderRegistry()
+        # (config key, prefix key) -> (future of the cached content, or None if it could not be made; expiry)
+        self._gemini_caches = {}
+        # The Ollama model the heartbeat keeps loaded: (config, timeouts, last used), set by requests and preloads
+        self._ollama_last = None
+        self._heartbeat = None
+        self.preloaded = set()
+        self.last_preload_s = None
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def submit(self, config, system_prompt, prompt, timeouts=None, on_chunk=None):
+        """Start a generation and return a concurrent.futures.Future with the text.
+
+        `on_chunk` is called from the event loop thread with each piece of text.
+        """
+        coro = self._generate(config, system_prompt, prompt, timeouts or Timeouts(), on_chunk)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stream(self, config, system_prompt, prompt, timeouts=None, poll_interval=0.25):
+        """Start a generation and return a TokenStream yielding text as it arrives."""
+        chunks = queue.Queue()
+        future = self.submit(config, system_prompt, prompt, timeouts, on_chunk=chunks.put)
+        future.add_done_callback(lambda _: chunks.put(_DONE))
+        return TokenStream(future, chunks, poll_interval)
+
+    def preload(self, config, timeouts=None):
+        """Load an Ollama model before the first question; returns a Future with the seconds taken.
+
+        Only the first call per configuration does anything (None after that),
+        so the apps can call it on every rerun.
+        """
+        if config.provider != "OLLAMA" or config.key() in self.preloaded:
+            return None
+        self.preloaded.add(config.key())
+        return asyncio.run_coroutine_threadsafe(self._preload(config, timeouts or Timeouts()), self.loop)
+
+    async def _preload(self, config, timeouts):
+        self._use_ollama(config, timeouts)
+        started = time.monotonic()
+        try:
+            await self._keep_ollama_loaded(config, timeouts)
+        except Exception:
+            _KEEPALIVE.inc(kind="preload", outcome="error")
+            self.preloaded.discard(config.key())
+            raise
+        _KEEPALIVE.inc(kind="preload", outcome="ok")
+        self.last_preload_s = round(time.monotonic() - started, 3)
+        return self.last_preload_s
+
+    async def _keep_ollama_loaded(self, config, timeouts):
+        # /api/generate without a prompt only loads the model (or extends its keep-alive)
+        client = await self.registry.get(config, timeouts)
+        payload = {"model": config.model}
+        if ollama_keep_alive() is not None:
+            payload["keep_alive"] = ollama_keep_alive()
+        response = await client.post("/api/generate", json=payload)
+        response.raise_for_status()
+
+    def _use_ollama(self, config, timeouts):
+        # Runs on the event loop
+        self._ollama_last = (config, timeouts, time.monotonic())
+        if self._heartbeat is None and float(os.getenv("OLLAMA_HEARTBEAT_INTERVAL", 240)) > 0:
+            self._heartbeat = asyncio.ensure_future(self._run_heartbeat())
+
+    async def _run_heartbeat(self):
+        keep_alive = _keep_alive_seconds(ollama_keep_alive())
+        if not keep_alive:
+            # keep_alive 0 unloads after every request; a heartbeat would only reload it
+            return
+        # A heartbeat slower than the keep-alive would let the model unload in between
+        interval = min(float(os.getenv("OLLAMA_HEARTBEAT_INTERVAL", 240)), 0.8 * keep_alive)
+        idle = float(os.getenv("OLLAMA_HEARTBEAT_IDLE", 900))
+        while True:
+            await asyncio.sleep(interval)
+            config, timeouts, last_used = self._ollama_last
+            if not active_sessions() and time.monotonic() - last_used > idle:
+                continue
+            try:
+                await self._keep_ollama_loaded(config, timeouts)
+                _KEEPALIVE.inc(kind="heartbeat", outcome="ok")
+            except Exception as e:
+                _KEEPALIVE.inc(kind="heartbeat", outcome="error")
+                logger.warning("Ollama heartbeat failed: %s", e)
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self.loop.call_soon_threadsafe(self._heartbeat.cancel)
+
+    def ollama_stats(self):
+        keepalive = _KEEPALIVE.values()
+        return {
+            "keep_alive": ollama_keep_alive(),
+            "heartbeat": self._heartbeat is not None,
+            "preloads": keepalive.get(("preload", "ok"), 0),
+            "last_preload_s": self.last_preload_s,
+            "heartbeats": keepalive.get(("heartbeat", "ok"), 0),
+            "heartbeat_errors": keepalive.get(("heartbeat", "error"), 0),
+            "cold_first_token": _FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="cold"),
+            "warm_first_token": _FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="warm"),
+        }
+
+    def client_stats(self):
+        return asyncio.run_coroutine_threadsafe(self._client_stats(), self.loop).result()
+
+    async def _client_stats(self):
+        return self.registry.stats()
+
+    def generate(self, config, system_prompt, prompt, timeouts=None):
+        return self.submit(config, system_prompt, prompt, timeouts).result()
+
+    def stats(self):
+        requests = _REQUESTS.values()
+        tokens = _TOKENS.values()
+        cached = _CACHED_TOKENS.values()
+        stats = {}
+        for p in PROVIDERS:
+            outcomes = {outcome: requests.get((p, outcome), 0) for outcome in _OUTCOMES}
+            if any(outcomes.values()):
+                stats[p] = {
+                    "total": _LATENCY.summary(provider=p),
+                    "first_token": _FIRST_TOKEN.summary(provider=p),
+                    **outcomes,
+                    "tokens_in": tokens.get((p, "in"), 0),
+                    "tokens_out": tokens.get((p, "out"), 0),
+                    "tokens_cached": cached.get((p,), 0),
+                    "cached_ratio": round(cached.get((p,), 0) / tokens[(p, "in")], 3) if tokens.get((p, "in")) else 0.0,
+                }
+        return stats
+
+    async def _generate(self, config, system_prompt, prompt, timeouts, on_chunk=None):
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            async with self._semaphore:
+                text = await self._collect(config, system_prompt, prompt, timeouts, start, on_chunk)
+            outcome = "ok"
+            return text
+        except LLMTimeout:
+            outcome = "timeout"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            _REQUESTS.inc(provider=config.provider, outcome=outcome)
+            if outcome == "ok":
+                _LATENCY.observe(time.monotonic() - start, provider=config.provider)
+
+    async def _collect(self, config, system_prompt, prompt, timeouts, start, on_chunk):
+        chunks = []
+        usage = {}
+        stream = self._stream(config, system_prompt, prompt, timeouts, usage)
+        try:
+            try:
+                remaining = timeouts.total - (time.monotonic() - start)
+                first = await asyncio.wait_for(stream.__anext__(), min(timeouts.first_token, remaining))
+            except StopAsyncIteration:
+                return ""
+            except asyncio.TimeoutError:
+                raise LLMTimeout(f"{config.provider} sent no output within {timeouts.first_token:g}s") from None
+            first_token_s = time.monotonic() - start
+            _FIRST_TOKEN.observe(first_token_s, provider=config.provider)
+            _remember_first_token(config.provider, first_token_s)
+            chunks.append(first)
+            if on_chunk is not None:
+                on_chunk(first)
+
+            async def rest():
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+
+            try:
+                await asyncio.wait_for(rest(), timeouts.total - (time.monotonic() - start))
+            except asyncio.TimeoutError:
+                raise LLMTimeout(f"{config.provider} did not finish within {timeouts.total:g}s") from None
+        finally:
+            await stream.aclose()
+        text = "".join(chunks).strip()
+        _TOKENS.inc(usage.get("in") or estimate_tokens(system_prompt + prompt), provider=config.provider, direction="in")
+        _TOKENS.inc(usage.get("out") or estimate_tokens(text), provider=config.provider, direction="out")
+        if usage.get("cached"):
+            _CACHED_TOKENS.inc(usage["cached"], provider=config.provider)
+        if usage.get("load_s") is not None:
+            _FIRST_TOKEN_BY_START.observe(first_token_s, provider=config.provider,
+                                          start="cold" if usage["load_s"] >= _COLD_LOAD_S else "warm")
+        return text
+
+    # Each provider stream yields text and fills `usage` with {"in", "out", "cached"} token counts if it reports them
+    def _stream(self, config, system_prompt, prompt, timeouts, usage):
+        if config.provider in ("OPENAI", "DEEPSEEK"):
+            return self._stream_openai(config, system_prompt, prompt, timeouts, usage)
+        if config.provider == "GEMINI":
+            return self._stream_gemini(config, system_prompt, prompt, timeouts, usage)
+        if config.provider == "OLLAMA":
+            return self._stream_ollama(config, system_prompt, prompt, timeouts, usage)
+        raise ValueError("Unsupported AI_PROVIDER. Use 'OPENAI', 'GEMINI', 'OLLAMA' or 'DEEPSEEK'.")
+
+    async def _stream_openai(self, config, system_prompt, prompt, timeouts, usage):
+        client = await self.registry.get(config, timeouts)
+        # OpenAI sends token usage in a last, choice-less chunk when asked; not every compatible API accepts it
+        options = {}
+        if config.provider == "OPENAI":
+            # prompt_cache_key routes calls with the same prefix to the same cache
+            options = {"stream_options": {"include_usage": True},
+                       "extra_body": {"prompt_cache_key": prefix_key(system_prompt)}}
+        response = await client.chat.completions.create(
+            model=config.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0,
+            stream=True,
+            **options,
+        )
+        async for chunk in response:
+            if getattr(chunk, "usage", None):
+                details = getattr(chunk.usage, "prompt_tokens_details", None)
+                # OpenAI reports prompt_tokens_details.cached_tokens, DeepSeek prompt_cache_hit_tokens
+                cached = getattr(details, "cached_tokens", None) or getattr(chunk.usage, "prompt_cache_hit_tokens", None)
+                usage.update({"in": chunk.usage.prompt_tokens, "out": chunk.usage.completion_tokens,
+                              "cached": cached})
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _stream_gemini(self, config, system_prompt, prompt, timeouts, usage):
+        if config.base_url:
+            async for text in self._stream_gemini_rest(config, system_prompt, prompt, timeouts, usage):
+                yield text
+            return
+        # The pinned SDK (google-generativeai 0.4) has no cached content API, so the
+        # prefix is sent inline; set GEMINI_BASE_URL to use the REST path and its cache
+        model = await self.registry.get(config, timeouts)
+        response = await model.generate_content_async(f"{system_prompt}\nQuery: {prompt}", stream=True)
+        async for chunk in response:
+            metadata = getattr(chunk, "usage_metadata", None)
+            if metadata is not None and getattr(metadata, "prompt_token_count", 0):
+                usage.update({"in": metadata.prompt_token_count, "out": metadata.candidates_token_count,
+                              "cached": getattr(metadata, "cached_content_token_count", None)})
+            try:
+                text = chunk.text
+            except (AttributeError, ValueError):
+                text = "".join(part.text for part in chunk.candidates[0].content.parts)
+            if text:
+                yield text
+
+    async def _stream_gemini_rest(self, config, system_prompt, prompt, timeouts, usage):
+        client = await self.registry.get(config, timeouts)
+        cached_content = await self._gemini_cached_content(config, system_prompt, timeouts)
+        if cached_content is not None:
+            payload = {"cachedContent": cached_content,
+                       "contents": [{"role": "user", "parts": [{"text": f"Query: {prompt}"}]}]}
+        else:
+            payload = {"contents": [{"role": "user", "parts": [{"text": f"{system_prompt}\nQuery: {prompt}"}]}]}
+        path = f"/v1beta/models/{config.model}:streamGenerateContent"
+        headers = {"x-goog-api-key": config.api_key or ""}
+        async with client.stream("POST", path, params={"alt": "sse"}, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[5:])
+                metadata = data.get("usageMetadata") or {}
+                if metadata.get("promptTokenCount"):
+                    usage.update({"in": metadata["promptTokenCount"], "out": metadata.get("candidatesTokenCount"),
+                                  "cached": metadata.get("cachedContentTokenCount")})
+                for candidate in data.get("candidates", [])[:1]:
+                    text = "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+                    if text:
+                        yield text
+
+    async def _gemini_cached_content(self, config, system_prompt, timeouts):
+        """The name of the cached content holding `system_prompt` (REST path only), or None.
+
+        Only prefixes of at least GEMINI_CACHE_MIN_TOKENS are cached; Gemini
+        rejects small ones, and storage is billed per hour of GEMINI_CACHE_TTL.
+        """
+        min_tokens = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", 4096))
+        if not min_tokens or estimate_tokens(system_prompt) < min_tokens:
+            return None
+        ttl = int(os.getenv("GEMINI_CACHE_TTL", 3600))
+        key = (config.key(), prefix_key(system_prompt))
+        entry = self._gemini_caches.get(key)
+        # Renewed a minute before Gemini would drop it
+        if entry is None or entry[1] <= time.monotonic():
+            future = asyncio.ensure_future(self._create_gemini_cache(config, system_prompt, ttl, timeouts))
+            entry = self._gemini_caches[key] = (future, time.monotonic() + max(ttl - 60, 0))
+        return await asyncio.shield(entry[0])
+
+    async def _create_gemini_cache(self, config, system_prompt, ttl, timeouts):
+        try:
+            client = await self.registry.get(config, timeouts)
+            response = await client.post("/v1beta/cachedContents", headers={"x-goog-api-key": config.api_key or ""},
+                                         json={"model": f"models/{config.model}", "ttl": f"{ttl}s",
+                                               "systemInstruction": {"parts": [{"text": system_prompt}]}})
+            response.raise_for_status()
+            return response.json()["name"]
+        except Exception as e:
+            # e.g. a model without caching support; send the prefix inline until the entry expires
+            logger.warning("Gemini prompt cache not created: %s", e)
+            return None
+
+    async def _stream_ollama(self, config, system_prompt, prompt, timeouts, usage):
+        client = await self.registry.get(config, timeouts)
+        payload = {
+            "model": config.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            "stream": True,
+        }
+        if ollama_keep_alive() is not None:
+            payload["keep_alive"] = ollama_keep_alive()
+        self._use_ollama(config, timeouts)
+        async with client.stream("POST", "/api/chat", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                if data.get("done"):
+                    usage.update(_ollama_usage(data, system_prompt, prompt))
+                content = data.get("message", {}).get("content", "")
+                if content:
+                    yield content
+
+
+def _ollama_usage(data, system_prompt, prompt):
+    # Ollama counts only the prompt tokens it evaluated; a prefix still in the KV
+    # cache from the previous call is skipped, so a count well below the system
+    # prompt's size means the rest came from the cache.
+    evaluated = data.get("prompt_eval_count")
+    usage = {"in": evaluated, "out": data.get("eval_count"), "cached": None,
+             "load_s": data["load_duration"] / 1e9 if "load_duration" in data else None}
+    if evaluated is not None and evaluated < estimate_tokens(system_prompt) // 2:
+        usage["in"] = max(evaluated, estimate_tokens(system_prompt + prompt))
+        usage["cached"] = usage["in"] - evaluated
+    return usage
+
+
+def _remember_first_token(provider, seconds):
+    with _recent_lock:
+        if provider not in _RECENT_FIRST_TOKENS:
+            _RECENT_FIRST_TOKENS[provider] = collections.deque(maxlen=int(os.getenv("HEDGE_WINDOW", 200)))
+        _RECENT_FIRST_TOKENS[provider].append(seconds)
+
+
+def recent_first_tokens(provider):
+    """The provider's last HEDGE_WINDOW first-token times in seconds, oldest first."""
+    with _recent_lock:
+        return list(_RECENT_FIRST_TOKENS.get(provider, ()))
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = LLMRunner()
+        return _runner
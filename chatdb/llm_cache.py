@@ -0,0 +1,250 @@
+"""Two-tier cache in front of generate_sql.
+
+Tier one is an exact-match LRU keyed by (provider, model, db_type, schema
+fingerprint, normalized prompt). Tier two, when a similarity threshold is set,
+compares hashed character n-gram vectors of the prompt against cached prompts in
+the same scope so near-duplicate questions reuse the cached SQL. Entries are
+persisted to SQLite so the cache survives app restarts.
+"""
+
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from chatdb.metrics import get_registry
+
+
+NGRAM_SIZE = 3
+VECTOR_BUCKETS = 4096
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_prompt(prompt):
+    prompt = " ".join(prompt.lower().split())
+    return prompt.rstrip(" ?.!;")
+
+
+def ngram_vector(text):
+    # Sparse bag of hashed character n-grams, L2-normalised
+    padded = f" {text} "
+    counts = {}
+    for i in range(max(1, len(padded) - NGRAM_SIZE + 1)):
+        bucket = zlib.crc32(padded[i:i + NGRAM_SIZE].encode("utf-8")) % VECTOR_BUCKETS
+        counts[bucket] = counts.get(bucket, 0) + 1
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class SQLCache:
+    def __init__(self, path=None, max_entries=1000, ttl=86400, similarity_threshold=0.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.similarity_threshold = float(similarity_threshold)
+
+        self._lock = threading.Lock()
+        # key -> (scope, prompt, sql, created_at); ordered least recently used first
+        self._entries = OrderedDict()
+        self._vectors = {}  # key -> n-gram vector, only kept when similarity is on
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                "key TEXT PRIMARY KEY, scope TEXT, prompt TEXT, sql TEXT, created_at REAL, last_used REAL)"
+            )
+            self._db.commit()
+            self._load()
+
+    @staticmethod
+    def make_scope(provider, model, db_type, schema_fingerprint):
+        return "\x1f".join(str(p or "") for p in (provider, model, db_type, schema_fingerprint))
+
+    @staticmethod
+    def make_key(scope, prompt):
+        return hashlib.sha256(f"{scope}\x1e{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, provider, model, db_type, schema_fingerprint, prompt):
+        scope = self.make_scope(provider, model, db_type, schema_fingerprint)
+        prompt = normalize_prompt(prompt)
+        key = self.make_key(scope, prompt)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    self._touch(key, now)
+                    return entry[2]
+
+            if self.similarity_threshold > 0:
+                match = self._find_similar(scope, prompt, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.similar_hits += 1
+                    self._touch(match, now)
+                    return self._entries[match][2]
+
+            self.misses += 1
+            return None
+
+    def put(self, provider, model, db_type, schema_fingerprint, prompt, sql):
+        scope = self.make_scope(provider, model, db_type, schema_fingerprint)
+        prompt = normalize_prompt(prompt)
+        key = self.make_key(scope, prompt)
+        now = time.time()
+
+        with self._lock:
+            self._entries[key] = (scope, prompt, sql, now)
+            self._entries.move_to_end(key)
+            if self.similarity_threshold > 0:
+                self._vectors[key] = ngram_vector(prompt)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, scope, prompt, sql, now, now),
+                )
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            if self._db is not None:
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM sql_cache")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "persistent": self._db is not None,
+            }
+
+    def _expired(self, entry, now):
+        return self.ttl > 0 and now - entry[3] > self.ttl
+
+    def _find_similar(self, scope, prompt, now):
+        vector = ngram_vector(prompt)
+        # Questions that differ only in a number ("last 7 days" vs "last 30
+        # days") look alike as n-grams but need different SQL.
+        numbers = _NUMBER_RE.findall(prompt)
+        best_key, best_score = None, self.similarity_threshold
+        expired = []
+        for key, entry in self._entries.items():
+            if entry[0] != scope:
+                continue
+            if self._expired(entry, now):
+                expired.append(key)
+                continue
+            if _NUMBER_RE.findall(entry[1]) != numbers:
+                continue
+            score = cosine(vector, self._vectors[key])
+            if score >= best_score:
+                best_key, best_score = key, score
+        for key in expired:
+            self._remove(key)
+            self.expirations += 1
+        return best_key
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._vectors.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM sql_cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _touch(self, key, now):
+        if self._db is not None:
+            self._db.execute("UPDATE sql_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+    def _load(self):
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM sql_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        rows = self._db.execute(
+            "SELECT key, scope, prompt, sql, created_at FROM sql_cache ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        self._db.execute(
+            "DELETE FROM sql_cache WHERE key NOT IN (SELECT key FROM sql_cache ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self._db.commit()
+        for key, scope, prompt, sql, created_at in reversed(rows):
+            self._entries[key] = (scope, prompt, sql, created_at)
+            if self.similarity_threshold > 0:
+                self._vectors[key] = ngram_vector(prompt)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _collect_sql_cache():
+    # Read only once the app has built the cache; a scrape should not create it
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    lookups = [({"result": result}, stats[key]) for result, key in
+               (("exact_hit", "exact_hits"), ("similar_hit", "similar_hits"), ("miss", "misses"))]
+    return [
+        ("chatdb_sql_cache_lookups_total", "counter", "SQL cache lookups by result", lookups),
+        ("chatdb_sql_cache_entries", "gauge", "SQL cache entries", [({}, stats["entries"])]),
+        ("chatdb_sql_cache_evictions_total", "counter", "SQL cache evictions", [({}, stats["evictions"])]),
+    ]
+
+
+get_registry().register_collector(_collect_sql_cache)
+
+
+def get_sql_cache():
+    # Built on first use so the settings loaded by load_dotenv() are picked up
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLCache(
+                path=os.getenv("SQL_CACHE_PATH", ".chatdb_cache/llm_cache.sqlite") or None,
+                max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", 1000)),
+                ttl=float(os.getenv("SQL_CACHE_TTL", 86400)),
+                similarity_threshold=float(os.getenv("SQL_CACHE_SIMILARITY", 0)),
+            )
+        return _cache
@@ -0,0 +1,353 @@
+"""In-process metrics in the Prometheus text format.
+
+Modules declare their counters and histograms on the process registry once,
+at import time, and record into them on the hot path:
+
+    _QUERIES = get_registry().counter("chatdb_queries_total", "Queries run", ("db_type",))
+    _QUERIES.inc(db_type="mysql")
+
+Recording takes no lock: every thread writes its own shard of each metric (a
+plain dict only that thread mutates), and a scrape sums the shards. A scrape
+can therefore see a histogram observation half applied, which is fine for
+monitoring. When a thread exits (Streamlit starts one per rerun) its shard is
+folded into a base shard, so the number of shards follows the live threads.
+Numbers kept elsewhere (pool sizes, cache hit counts, active sessions) are read
+at scrape time by collectors registered with `register_collector`.
+
+`start_metrics_server()` serves /metrics on METRICS_HOST:METRICS_PORT from a
+background thread, next to the Streamlit server; the API server also answers
+GET /metrics itself.
+"""
+
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds; model calls take far longer than queries or pipeline stages
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, math.inf)
+QUERY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class _ShardOwner:
+    """Lives in a thread's local storage; collected when the thread exits."""
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self):
+        self.shard = {}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # id(shard) -> shard of each live thread that recorded into this metric
+        self._shards = {}
+        # What exited threads recorded
+        self._base = {}
+        # Taken once per thread, when it first records into this metric and when it exits
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(owner.shard)] = owner.shard
+            weakref.finalize(owner, self._retire, owner.shard)
+            return owner.shard
+
+    def _retire(self, shard):
+        # The thread is gone, so nothing writes to its shard any more
+        with self._shards_lock:
+            del self._shards[id(shard)]
+            for key, value in shard.items():
+                self._base[key] = self._combine(self._base.get(key), value)
+
+    def _combine(self, total, value):
+        raise NotImplementedError
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            base = {key: self._combine(None, value) for key, value in self._base.items()}
+        # dict() copies in one step under the GIL, so a writer adding a key cannot break the read
+        return [base] + [dict(shard) for shard in shards]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _combine(self, total, value):
+        return (total or 0) + value
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def value(self, **labels):
+        return self.values().get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values().items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=QUERY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        series = shard.get(key)
+        if series is None:
+            # One count per bucket, then the sum and the number of observations
+            series = shard[key] = [0] * len(self.buckets) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def _combine(self, total, values):
+        if total is None:
+            return list(values)
+        for i, value in enumerate(values):
+            total[i] += value
+        return total
+
+    def series(self):
+        merged = {}
+        for shard in self._snapshots():
+            for key, values in shard.items():
+                merged[key] = self._combine(merged.get(key), values)
+        return merged
+
+    def summary(self, **labels):
+        """count, mean and p50/p95/p99 (the upper bound of the bucket they fall in)."""
+        values = self.series().get(self._key(labels))
+        count = values[-1] if values else 0
+        return {
+            "count": count,
+            "mean_s": round(values[-2] / count, 3) if count else None,
+            "p50_s": _percentile(self.buckets, values, 0.5),
+            "p95_s": _percentile(self.buckets, values, 0.95),
+            "p99_s": _percentile(self.buckets, values, 0.99),
+        }
+
+    def samples(self):
+        for key, values in sorted(self.series().items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, values[-2]
+            yield f"{self.name}_count", labels, values[-1]
+
+
+def _percentile(buckets, values, q):
+    if not values or not values[-1]:
+        return None
+    rank = q * values[-1]
+    seen = 0
+    for bound, count in zip(buckets, values):
+        seen += count
+        if seen >= rank:
+            return bound
+    return buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name, help, labelnames, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **options)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=QUERY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def register_collector(self, collect):
+        """`collect()` returns [(name, kind, help, [(labels, value), ...]), ...] at scrape time."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def exposition(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            _header(lines, metric.name, metric.kind, metric.help)
+            for name, labels, value in metric.samples():
+                lines.append(_sample(name, labels, value))
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                # One broken source should not take the whole scrape down
+                logger.warning("Metrics collector %s failed: %s", getattr(collect, "__name__", collect), e)
+                continue
+            for name, kind, help, samples in families:
+                _header(lines, name, kind, help)
+                for labels, value in samples:
+                    lines.append(_sample(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def _header(lines, name, kind, help):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{rendered}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+# ── Active sessions ──────────────────────────────────────────────────────
+
+_sessions = {}
+
+
+def touch_session(session_id):
+    """Mark a UI session as active; sessions not seen for METRICS_SESSION_WINDOW seconds drop out."""
+    _sessions[session_id] = time.monotonic()
+
+
+def active_sessions():
+    cutoff = time.monotonic() - float(os.getenv("METRICS_SESSION_WINDOW", 300))
+    for session_id, seen in list(_sessions.items()):
+        if seen < cutoff:
+            _sessions.pop(session_id, None)
+    return len(_sessions)
+
+
+def _collect_sessions():
+    return [("chatdb_active_sessions", "gauge", "UI sessions active within METRICS_SESSION_WINDOW seconds",
+             [({}, active_sessions())])]
+
+
+_registry.register_collector(_collect_sessions)
+
+
+# ── Scrape endpoint ──────────────────────────────────────────────────────
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _handler_class():
+    # http.server pulls in http.client, email and ssl; only the endpoint needs it
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = _registry.exposition().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+_server = None
+_server_started = False
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host=None, port=None):
+    """Serve /metrics from a daemon thread, once per process; returns the bound port or None.
+
+    Safe to call on every Streamlit rerun: only the first call does anything.
+    """
+    global _server, _server_started
+    with _server_lock:
+        if _server_started:
+            return _server.server_address[1] if _server is not None else None
+        _server_started = True
+        port = os.getenv("METRICS_PORT", "9108") if port is None else port
+        if port in ("", None):
+            return None
+        host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+        from http.server import ThreadingHTTPServer
+
+        try:
+            _server = ThreadingHTTPServer((host, int(port)), _handler_class())
+        except OSError as e:
+            # e.g. a second app process on the same machine
+            logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="chatdb-metrics", daemon=True).start()
+        return _server.server_address[1]
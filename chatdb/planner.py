@@ -0,0 +1,176 @@
+"""Pre-execution cost checks for generated SQL.
+
+Before a generated statement runs, it is EXPLAINed (EXPLAIN (FORMAT JSON) on
+PostgreSQL, tabular EXPLAIN on MySQL) and the plan is reduced to a small summary:
+estimated result rows, estimated cost and tables read with full scans. The
+summary decides whether the statement runs as is, runs with an added LIMIT, or
+waits for the user to confirm it. EXPLAIN without ANALYZE never executes the
+statement itself.
+"""
+
+import json
+import os
+import re
+import time
+
+from chatdb.result_cache import canonicalize_sql, statement_kind
+from chatdb.tracing import span
+
+
+# statement_kind() reads past leading comments and reports a WITH query as the statement it wraps
+_EXPLAINABLE = {"select", "insert", "update", "delete", "replace"}
+_LIMIT_RE = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*$", re.IGNORECASE)
+
+
+def _setting(name, default):
+    return float(os.getenv(name, default))
+
+
+def has_limit(sql, dialect=None):
+    return bool(_LIMIT_RE.search(canonicalize_sql(sql, dialect)))
+
+
+def add_limit(sql, limit, dialect=None):
+    """Append LIMIT `limit` to a SELECT that does not already end with one."""
+    if has_limit(sql, dialect):
+        return sql
+    stripped = sql.rstrip().rstrip(";").rstrip()
+    # On its own line, so a trailing line comment cannot swallow it
+    return f"{stripped}\nLIMIT {int(limit)};"
+
+
+def _walk_pg(node, full_scans):
+    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+        full_scans.append(node["Relation Name"])
+    for child in node.get("Plans", ()):
+        _walk_pg(child, full_scans)
+
+
+def _explain_postgresql(cursor, sql):
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+    document = cursor.fetchone()[0]
+    if isinstance(document, str):
+        document = json.loads(document)
+    plan = document[0]["Plan"]
+    full_scans = []
+    _walk_pg(plan, full_scans)
+    return {
+        "estimated_rows": int(plan.get("Plan Rows", 0)),
+        "estimated_cost": float(plan.get("Total Cost", 0)),
+        "full_scans": full_scans,
+    }
+
+
+def _explain_mysql(cursor, sql):
+    cursor.execute("EXPLAIN " + sql)
+    names = [desc[0].lower() for desc in cursor.description]
+    rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    if not rows:
+        return {"estimated_rows": 0, "estimated_cost": 0.0, "full_scans": []}
+
+    # Rows sharing the first id are one nested-loop join: each table is read once
+    # per row coming out of the tables before it.
+    join_id = rows[0].get("id")
+    fanout, examined = 1.0, 0.0
+    full_scans = []
+    for row in rows:
+        estimate = float(row.get("rows") or 0)
+        filtered = float(row.get("filtered") or 100) / 100
+        if row.get("type") == "ALL" and row.get("table"):
+            full_scans.append(row["table"])
+        if row.get("id") == join_id:
+            examined += fanout * max(estimate, 1)
+            fanout *= max(estimate, 1) * filtered
+        else:
+            examined += estimate
+    return {
+        "estimated_rows": int(fanout),
+        "estimated_cost": float(examined),  # rows examined; MySQL has no cost in tabular EXPLAIN
+        "full_scans": full_scans,
+    }
+
+
+def explain(conn, db_type, sql):
+    cursor = conn.cursor()
+    try:
+        if db_type == "postgresql":
+            return _explain_postgresql(cursor, sql)
+        if db_type == "mysql":
+            return _explain_mysql(cursor, sql)
+        # SQLite has no row estimates, but compiling the plan still catches unknown tables and columns
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        cursor.fetchall()
+        return None
+    finally:
+        cursor.close()
+
+
+class Guardrails:
+    def __init__(self, limit_rows=None, auto_limit=None, confirm_rows=None, confirm_cost=None):
+        self.limit_rows = _setting("PLAN_LIMIT_ROWS", 10000) if limit_rows is None else limit_rows
+        self.auto_limit = int(_setting("PLAN_AUTO_LIMIT", 1000) if auto_limit is None else auto_limit)
+        self.confirm_rows = _setting("PLAN_CONFIRM_ROWS", 1000000) if confirm_rows is None else confirm_rows
+        self.confirm_cost = _setting("PLAN_CONFIRM_COST", 10000000) if confirm_cost is None else confirm_cost
+
+    def decide(self, sql, summary, dialect=None):
+        """Return (action, reason) with action one of "run", "limit" or "confirm"."""
+        rows, cost = summary["estimated_rows"], summary["estimated_cost"]
+        if rows > self.confirm_rows:
+            return "confirm", f"~{rows:,} estimated rows (confirmation above {self.confirm_rows:,.0f})"
+        if cost > self.confirm_cost:
+            return "confirm", f"estimated cost {cost:,.0f} (confirmation above {self.confirm_cost:,.0f})"
+        if rows > self.limit_rows and statement_kind(sql, dialect) == "select" and not has_limit(sql, dialect):
+            return "limit", f"~{rows:,} estimated rows, limited to {self.auto_limit:,}"
+        return "run", None
+
+
+def plan_query(pool, db_type, sql, guardrails=None):
+    """EXPLAIN `sql` and decide how to run it.
+
+    Returns a summary dict that is stored with the history record: estimated
+    rows and cost, full scans, the action taken, the reason, the SQL to run and
+    how long planning took. If EXPLAIN itself fails the statement is run as is,
+    so the user sees the database's own error.
+    """
+    guardrails = guardrails or Guardrails()
+    summary = {
+        "estimated_rows": None,
+        "estimated_cost": None,
+        "full_scans": [],
+        "action": "run",
+        "reason": None,
+        "sql": sql,
+        "error": None,
+        "planning_ms": 0.0,
+    }
+    if statement_kind(sql, db_type) not in _EXPLAINABLE:
+        return summary
+
+    start = time.perf_counter()
+    try:
+        with span("plan"), pool.connection() as conn:
+            estimate = explain(conn, db_type, sql)
+            conn.rollback()
+    except Exception as e:
+        estimate = None
+        summary["error"] = str(e)
+    summary["planning_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    if estimate is None:
+        return summary
+
+    summary.update(estimate)
+    summary["action"], summary["reason"] = guardrails.decide(sql, summary, db_type)
+    if summary["action"] == "limit":
+        summary["sql"] = add_limit(sql, guardrails.auto_limit, db_type)
+    return summary
+
+
+def describe_plan(summary):
+    if not summary or summary.get("estimated_rows") is None:
+        return None
+    text = f"Plan: ~{summary['estimated_rows']:,} rows, cost {summary['estimated_cost']:,.0f}"
+    if summary["full_scans"]:
+        text += f", full scans: {', '.join(summary['full_scans'])}"
+    if summary.get("reason"):
+        text += f" — {summary['reason']}"
+    return text
@@ -0,0 +1,305 @@
+"""Process-wide database connection pooling.
+
+Streamlit re-executes the app script on every interaction, but imported modules
+stay loaded, so the pools kept here survive reruns and are shared by every
+session served by the same process.
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from chatdb.metrics import get_registry
+from chatdb.tracing import current_span, span
+
+
+logger = logging.getLogger(__name__)
+
+
+# Settings are read when a pool is created rather than at import time, because
+# the apps import this module before calling load_dotenv().
+def _setting(name, default):
+    return float(os.getenv(name, default))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _is_closed(conn):
+    # psycopg2 exposes `closed` (non-zero once closed), pymysql exposes `open`
+    closed = getattr(conn, "closed", None)
+    if closed is not None and not callable(closed):
+        return bool(closed)
+    is_open = getattr(conn, "open", None)
+    if is_open is not None and not callable(is_open):
+        return not is_open
+    return False
+
+
+def _ping(conn):
+    if hasattr(conn, "ping"):
+        conn.ping(reconnect=False)
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+    conn.rollback()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=None, max_size=None, idle_timeout=None,
+                 checkout_timeout=None, health_check_interval=None):
+        if min_size is None:
+            min_size = int(_setting("DB_POOL_MIN_SIZE", 1))
+        if max_size is None:
+            max_size = int(_setting("DB_POOL_MAX_SIZE", 5))
+        self.connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_timeout = _setting("DB_POOL_IDLE_TIMEOUT", 300) if idle_timeout is None else idle_timeout
+        self.checkout_timeout = _setting("DB_POOL_CHECKOUT_TIMEOUT", 30) if checkout_timeout is None else checkout_timeout
+        # Idle connections younger than this are handed out without a round-trip ping
+        self.health_check_interval = (_setting("DB_POOL_HEALTH_CHECK_INTERVAL", 5)
+                                      if health_check_interval is None else health_check_interval)
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._size = 0  # idle + checked out
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.evictions = 0
+        self.failed_health_checks = 0
+        self._fill()
+
+    def acquire(self):
+        with span("db.connect"):
+            return self._acquire()
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                expired = self._pop_expired()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    action = "reuse"
+                elif self._size < self.max_size:
+                    self._size += 1
+                    self.misses += 1
+                    action = "open"
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No free connection within {self.checkout_timeout}s (max_size={self.max_size})")
+                    self.waits += 1
+                    self._cond.wait(remaining)
+                    action = None
+
+            for stale in expired:
+                _close_quietly(stale)
+
+            if action == "open":
+                current_span().set(opened=True)
+                try:
+                    return self.connect()
+                except Exception:
+                    self._discard()
+                    raise
+
+            if action == "reuse":
+                if self._healthy(conn, last_used):
+                    with self._cond:
+                        self.hits += 1
+                    return conn
+                _close_quietly(conn)
+                self._discard(failed_check=True)
+
+    def release(self, conn, discard=False):
+        # End whatever transaction the caller left open so the next borrower
+        # neither inherits locks nor reads from a stale snapshot.
+        try:
+            if discard or _is_closed(conn):
+                raise RuntimeError("connection closed")
+            conn.rollback()
+        except Exception:
+            _close_quietly(conn)
+            self._discard()
+            return
+
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        _close_quietly(conn)
+        self._discard()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+    def exhausted(self):
+        """True when every connection is checked out and no new one may be opened."""
+        with self._cond:
+            return not self._idle and self._size >= self.max_size
+
+    def stats(self):
+        with self._cond:
+            requests = self.hits + self.misses
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "evictions": self.evictions,
+                "failed_health_checks": self.failed_health_checks,
+            }
+
+    def _healthy(self, conn, last_used):
+        if _is_closed(conn):
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            _ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, failed_check=False):
+        with self._cond:
+            self._size -= 1
+            if failed_check:
+                self.failed_health_checks += 1
+            self._cond.notify()
+
+    def _fill(self):
+        # Open min_size connections up front, so the first queries skip the handshake.
+        # An unreachable database is not an error yet: checkout will report it.
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self.connect()
+            except Exception as e:
+                self._discard()
+                logger.warning("Connection pool not prefilled: %s", e)
+                return
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _pop_expired(self):
+        # Called with the lock held; the caller closes the returned connections.
+        if self.idle_timeout <= 0:
+            return []
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        # Oldest connections sit at the front of the idle list.
+        while self._idle and self._idle[0][1] < cutoff and self._size > self.min_size:
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            self.evictions += 1
+            expired.append(conn)
+        return expired
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(db_type, host, port, user, db_name):
+    return (db_type, host, int(port), user, db_name)
+
+
+def get_pool(db_type, host, port, user, password, db_name, connect, role="query", **options):
+    """The process-wide pool for this database; `role` keeps a separate connection budget (e.g. "stream")."""
+    key = pool_key(db_type, host, port, user, db_name) + (role,)
+    # The password is not part of the key, but a changed password must not keep
+    # handing out connections opened with the old one.
+    secret = hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+    stale = None
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.secret != secret:
+            stale, pool = pool, None
+        if pool is None:
+            pool = ConnectionPool(connect, **options)
+            pool.secret = secret
+            _pools[key] = pool
+    if stale is not None:
+        stale.close()
+    return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {"{}://{}@{}:{}/{}".format(k[0], k[3], k[1], k[2], k[4]) + ("" if k[5] == "query" else f" ({k[5]})"): p.stats()
+            for k, p in pools}
+
+
+def _collect_pools():
+    stats = pool_stats()
+    gauges = ("size", "idle", "in_use", "max_size")
+    counters = ("hits", "misses", "waits", "timeouts", "evictions", "failed_health_checks")
+    families = [(f"chatdb_db_pool_{name}", "gauge", f"Connection pool {name.replace('_', ' ')}",
+                 [({"pool": pool}, s[name]) for pool, s in stats.items()]) for name in gauges]
+    families += [(f"chatdb_db_pool_{name}_total", "counter", f"Connection pool {name.replace('_', ' ')}",
+                  [({"pool": pool}, s[name]) for pool, s in stats.items()]) for name in counters]
+    return families
+
+
+get_registry().register_collector(_collect_pools)
+
+
+@atexit.register
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
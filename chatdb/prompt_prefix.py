@@ -0,0 +1,100 @@
+"""Byte-identical system prompts, so provider-side prompt caching can work.
+
+Nearly every prompt token in `generate_sql` is the system prompt: the fixed
+instructions followed by the schema context. Only the question, sent after it
+as the user message, changes from call to call. Providers cache long prompt
+prefixes (OpenAI and DeepSeek automatically, Gemini's REST API through cached
+content, Ollama by keeping the evaluated prefix while the model stays
+loaded), but only when the prefix is the same, byte for byte. The engine
+therefore renders the system prompt once per schema catalog revision (and
+table selection), keeps the rendered text with its hash and token estimate in
+a small LRU, and hands the same string to every call. The hash doubles as a
+cache key for providers that take one (OpenAI's prompt_cache_key, the Gemini
+cached content name).
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from chatdb.metrics import get_registry
+from chatdb.schema_selector import estimate_tokens
+
+
+def prefix_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptPrefix:
+    __slots__ = ("text", "key", "tokens", "schema_tokens")
+
+    def __init__(self, text, schema_tokens=0):
+        self.text = text
+        self.key = prefix_key(text)
+        self.tokens = estimate_tokens(text)
+        self.schema_tokens = schema_tokens
+
+
+class PrefixCache:
+    def __init__(self, max_entries=32):
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.builds = 0
+        self.last = None
+
+    def get(self, key, build):
+        """The prefix cached under `key`, or `build()`'s PromptPrefix."""
+        with self._lock:
+            prefix = self._entries.get(key)
+            if prefix is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.last = prefix
+                return prefix, True
+        # Built outside the lock; two callers racing on a new key both render it once
+        prefix = build()
+        with self._lock:
+            self.builds += 1
+            self._entries[key] = prefix
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.last = prefix
+        return prefix, False
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.builds
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "builds": self.builds,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "last_prefix": self.last.key if self.last else None,
+                "last_prefix_tokens": self.last.tokens if self.last else None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _collect_prefix_cache():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    return [("chatdb_prompt_prefix_lookups_total", "counter", "System prompt lookups (hit) and renders (build)",
+             [({"result": "hit"}, stats["hits"]), ({"result": "build"}, stats["builds"])])]
+
+
+get_registry().register_collector(_collect_prefix_cache)
+
+
+def get_prefix_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PrefixCache(int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", 32)))
+        return _cache
@@ -0,0 +1,108 @@
+"""Long-lived LLM provider clients.
+
+Building an SDK client per request throws away its HTTP connection pool, so
+every call pays DNS, TCP and TLS setup again. The registry builds one client per
+(provider, api key, base URL, model), keeps its keep-alive connections open
+well beyond httpx's 5 second default, uses HTTP/2 when the `h2` package is
+installed, and only replaces a client when the configuration for that provider
+actually changes. All methods run on the LLM event loop.
+"""
+
+import importlib.util
+import os
+
+
+def _http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+class ProviderRegistry:
+    def __init__(self, keepalive_expiry=None, max_keepalive=None):
+        self.keepalive_expiry = (float(os.getenv("LLM_KEEPALIVE_EXPIRY", 300))
+                                 if keepalive_expiry is None else keepalive_expiry)
+        self.max_keepalive = int(os.getenv("LLM_MAX_KEEPALIVE", 20)) if max_keepalive is None else max_keepalive
+        self.http2 = _http2_available()
+        self._clients = {}  # provider -> (config key, client)
+        self._gemini_key = None
+        self.builds = 0
+        self.reuses = 0
+        self.invalidations = 0
+
+    async def get(self, config, timeouts):
+        cached = self._clients.get(config.provider)
+        if cached is not None and cached[0] == config.key():
+            self.reuses += 1
+            return cached[1]
+        if cached is not None:
+            # The sidebar settings for this provider changed; drop the old pool
+            self.invalidations += 1
+            await self._close(cached[1])
+        client = self._build(config, timeouts)
+        self.builds += 1
+        self._clients[config.provider] = (config.key(), client)
+        return client
+
+    async def close_all(self):
+        clients, self._clients = self._clients, {}
+        for _, client in clients.values():
+            await self._close(client)
+
+    def stats(self):
+        return {
+            "clients": sorted(self._clients),
+            "builds": self.builds,
+            "reuses": self.reuses,
+            "invalidations": self.invalidations,
+            "http2": self.http2,
+            "keepalive_expiry_s": self.keepalive_expiry,
+        }
+
+    def _http_client(self, timeouts, **kwargs):
+        import httpx
+
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(timeouts.total, connect=timeouts.connect),
+            limits=httpx.Limits(
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            **kwargs,
+        )
+
+    def _build(self, config, timeouts):
+        if config.provider in ("OPENAI", "DEEPSEEK"):
+            from openai import AsyncOpenAI
+
+            return AsyncOpenAI(
+                api_key=config.api_key or None,
+                base_url=config.base_url or None,
+                max_retries=0,
+                http_client=self._http_client(timeouts, http2=self.http2),
+            )
+        if config.provider == "OLLAMA":
+            # Ollama only speaks HTTP/1.1
+            return self._http_client(timeouts, base_url=config.base_url.rstrip("/"))
+        if config.provider == "GEMINI" and config.base_url:
+            # A Gemini-compatible REST endpoint (proxy or local stand-in)
+            return self._http_client(timeouts, base_url=config.base_url.rstrip("/"), http2=self.http2)
+        if config.provider == "GEMINI":
+            import google.generativeai as genai
+
+            # genai keeps its (gRPC) clients in module state; reconfigure only on key change
+            if config.api_key and config.api_key != self._gemini_key:
+                genai.configure(api_key=config.api_key)
+                self._gemini_key = config.api_key
+            return genai.GenerativeModel(config.model)
+        raise ValueError(f"Unsupported provider {config.provider}")
+
+    @staticmethod
+    async def _close(client):
+        close = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if close is None:
+            return
+        try:
+            result = close()
+            if hasattr(result, "__await__"):
+                await result
+        except Exception:
+            pass
@@ -0,0 +1,225 @@
+"""Execution budgets and cancellation for running queries.
+
+Each query gets a server-enforced budget. On PostgreSQL that is `SET LOCAL
+statement_timeout`, scoped to the query's transaction so it ends when the
+pooled connection is rolled back; a streamed result's FETCHes are timed one by
+one, so a result left unread between pages is not. On MySQL a watchdog issues
+`KILL QUERY` once the budget is spent. No session variable is set there: it
+would stay on the pooled connection, and since an unbuffered result stream is
+one statement, it would also kill a result left open between pages. The
+watchdog stops once the first page is read. A running query can be cancelled
+from another thread with `pg_cancel_backend` / `KILL QUERY`, sent over a
+separate connection because the query's own connection is busy. SQLite has
+neither, so its queries are stopped with `Connection.interrupt()`, by the
+watchdog or on cancel.
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chatdb.metrics import get_registry
+
+
+_QUERY_CANCELED = "57014"  # PostgreSQL: statement timeout or cancel request
+_MYSQL_TIMEOUT = 3024  # max_execution_time exceeded (a server-wide limit)
+
+
+def backend_id(conn, db_type):
+    if db_type == "postgresql":
+        return conn.get_backend_pid()
+    if db_type == "mysql":
+        return conn.thread_id()
+    return None
+
+
+def apply_statement_timeout(conn, db_type, seconds):
+    # Only PostgreSQL: anything set on a MySQL session would outlive the query on the pooled connection
+    if not seconds or db_type != "postgresql":
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+    finally:
+        cursor.close()
+
+
+def cancel_backend(connect, db_type, target):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        if db_type == "postgresql":
+            cursor.execute("SELECT pg_cancel_backend(%s)", (target,))
+        elif db_type == "mysql":
+            cursor.execute(f"KILL QUERY {int(target)}")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancellations = 0
+
+    def record(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "cancellations": self.cancellations,
+            }
+
+
+_stats = QueryStats()
+
+
+def query_stats():
+    return _stats.snapshot()
+
+
+def _collect_query_stats():
+    return [("chatdb_query_outcomes_total", "counter", "Queries started, and how they ended",
+             [({"outcome": outcome}, count) for outcome, count in query_stats().items()])]
+
+
+get_registry().register_collector(_collect_query_stats)
+
+# Driver messages grouped into a few classes, so error rates can be watched by kind
+_ERROR_CLASSES = (
+    ("syntax", re.compile(r"syntax", re.IGNORECASE)),
+    ("undefined_object", re.compile(
+        r"no such (table|column|function)|unknown (column|table|database)|does ?n[o']t exist|undefined",
+        re.IGNORECASE)),
+    ("permission", re.compile(r"denied|permission|privilege|read-?only", re.IGNORECASE)),
+    ("constraint", re.compile(r"constraint|duplicate|unique|foreign key|violat", re.IGNORECASE)),
+    ("connection", re.compile(r"connect|gone away|lost|refused|broken pipe|no free connection|pool",
+                              re.IGNORECASE)),
+    ("lock", re.compile(r"deadlock|lock wait|database is locked", re.IGNORECASE)),
+)
+
+
+def error_class(error):
+    """A short class for an error message from execute_query, for metrics labels."""
+    if not error:
+        return None
+    if error.startswith("Query cancelled"):
+        return "cancelled"
+    if error.startswith("Query stopped after"):
+        return "timeout"
+    for name, pattern in _ERROR_CLASSES:
+        if pattern.search(error):
+            return name
+    return "other"
+
+
+class RunningQuery:
+    """Budget and cancel handle for one query.
+
+    Call `start(conn)` on the connection that will run the query before
+    executing it, `finish()` once it has returned, and `outcome(exc)` to turn
+    a driver error into a readable message (and count it).
+    """
+
+    def __init__(self, db_type, connect, timeout=None):
+        self.db_type = db_type
+        self.connect = connect
+        self.timeout = float(os.getenv("QUERY_TIMEOUT", 30)) if timeout is None else timeout
+        self.backend = None
+        self.cancelled = False
+        self.timed_out = False
+        self.done = False
+        self._watchdog = None
+        self._lock = threading.Lock()
+
+    def start(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelled("Query cancelled.")
+            self.backend = conn if self.db_type == "sqlite" else backend_id(conn, self.db_type)
+        _stats.record("started")
+        apply_statement_timeout(conn, self.db_type, self.timeout)
+        if self.db_type in ("mysql", "sqlite") and self.timeout:
+            self._watchdog = threading.Timer(self.timeout, self._expire)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def finish(self):
+        with self._lock:
+            self.done = True
+            if self._watchdog is not None:
+                self._watchdog.cancel()
+
+    def cancel(self):
+        with self._lock:
+            if self.done or self.cancelled:
+                return False
+            self.cancelled = True
+            target = self.backend
+        # Not started yet (e.g. waiting for a pooled connection): start() will refuse
+        if target is not None:
+            self._interrupt(target)
+        return True
+
+    def _interrupt(self, target):
+        if self.db_type == "sqlite":
+            target.interrupt()
+        else:
+            cancel_backend(self.connect, self.db_type, target)
+
+    def _expire(self):
+        with self._lock:
+            if self.done or self.cancelled:
+                return
+            self.timed_out = True
+        try:
+            self._interrupt(self.backend)
+        except Exception:
+            pass
+
+    def outcome(self, exc=None):
+        """Count how the query ended; for errors return the message to show."""
+        self.finish()
+        if exc is None:
+            _stats.record("completed")
+            return None
+        code = getattr(exc, "pgcode", None) or (exc.args[0] if exc.args else None)
+        if self.cancelled:
+            _stats.record("cancellations")
+            return "Query cancelled."
+        if self.timed_out or code in (_QUERY_CANCELED, _MYSQL_TIMEOUT):
+            _stats.record("timeouts")
+            return f"Query stopped after the {self.timeout:g}s execution budget (QUERY_TIMEOUT)."
+        _stats.record("failed")
+        return str(exc)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_query_executor():
+    # Queries run off the Streamlit script thread so the UI can keep polling
+    # and cancel them
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("QUERY_WORKERS", 16)), thread_name_prefix="chatdb-query"
+            )
+        return _executor
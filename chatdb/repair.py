@@ -0,0 +1,190 @@
+"""Self-repair: feed a failing query's database error back to the model.
+
+When generated SQL fails, `repair_query` asks the model again with the
+question, the failing SQL and the database error. The schema context is
+selected for that whole prompt, so the failing SQL and error text, which name
+the tables and columns involved, pick the tables. Repair prompts bypass the SQL
+cache: a cached failing candidate would be replayed instead of asking the model
+again. Only the answer that finally runs is cached, for the original question.
+Each attempt has its own timeout (generation and execution), candidates the
+model already produced are not executed again, and the loop stops after
+REPAIR_MAX_ATTEMPTS. Cancellations and execution-budget timeouts are not
+repaired: the model cannot see why they happened.
+
+Every attempt is logged with its outcome and the latency it added, and kept on
+the returned result so the apps can show it.
+"""
+
+import logging
+import os
+import time
+
+from chatdb import engine
+from chatdb.llm import Timeouts
+from chatdb.metrics import LLM_BUCKETS, get_registry
+from chatdb.query_control import RunningQuery
+from chatdb.result_cache import canonicalize_sql
+from chatdb.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+
+def repair_enabled():
+    return os.getenv("REPAIR_MODE", "0") == "1"
+
+
+def repairable(error):
+    # A cancelled or timed-out query is not something the model can fix from the message
+    return bool(error) and not error.startswith(("Query cancelled", "Query stopped after"))
+
+
+class RepairPolicy:
+    def __init__(self, max_attempts=None, attempt_timeout=None, history=None):
+        self.max_attempts = int(os.getenv("REPAIR_MAX_ATTEMPTS", 2)) if max_attempts is None else max_attempts
+        self.attempt_timeout = (
+            float(os.getenv("REPAIR_ATTEMPT_TIMEOUT", 30)) if attempt_timeout is None else attempt_timeout
+        )
+        # How many earlier failures are shown to the model
+        self.history = int(os.getenv("REPAIR_HISTORY", 3)) if history is None else history
+
+    def query_timeout(self):
+        budget = float(os.getenv("QUERY_TIMEOUT", 30))
+        return min(budget, self.attempt_timeout) if budget else self.attempt_timeout
+
+
+class RepairResult:
+    def __init__(self, sql, error, raw=None, result=None, attempts=None):
+        self.sql = sql
+        self.error = error
+        self.raw = raw
+        self.result = result
+        self.attempts = attempts or []
+
+    @property
+    def repaired(self):
+        return bool(self.attempts) and self.error is None
+
+    @property
+    def added_ms(self):
+        return round(sum(a["total_ms"] for a in self.attempts), 1)
+
+
+_REPAIRS = get_registry().counter("chatdb_repairs_total", "Failed queries sent back to the model", ("outcome",))
+_ATTEMPTS = get_registry().counter("chatdb_repair_attempts_total", "Repair attempts by outcome", ("outcome",))
+_ADDED = get_registry().histogram(
+    "chatdb_repair_added_seconds", "Latency added to a request by repairing it", (), LLM_BUCKETS)
+
+
+class RepairStats:
+    def record(self, result):
+        _REPAIRS.inc(outcome="fixed" if result.repaired else "gave_up")
+        for attempt in result.attempts:
+            _ATTEMPTS.inc(outcome=attempt["outcome"])
+        _ADDED.observe(result.added_ms / 1000)
+
+    def snapshot(self):
+        repairs = _REPAIRS.values()
+        attempts = _ATTEMPTS.values()
+        return {
+            "repairs": sum(repairs.values()),
+            "fixed": repairs.get(("fixed",), 0),
+            "gave_up": repairs.get(("gave_up",), 0),
+            "attempts": sum(attempts.values()),
+            "duplicates_skipped": attempts.get(("duplicate",), 0),
+            "added_latency": _ADDED.summary(),
+        }
+
+
+_stats = RepairStats()
+
+
+def repair_stats():
+    return _stats.snapshot()
+
+
+def build_repair_prompt(question, failures):
+    lines = [question, "", "The SQL generated for this question failed on the database."]
+    for sql, error in failures:
+        lines += ["", "Failed SQL:", sql, f"Database error: {error}"]
+    lines += ["", "Write a corrected SQL query that answers the question. Do not repeat a failed query."]
+    return "\n".join(lines)
+
+
+def _default_execute(settings, policy):
+    def execute(sql):
+        control = RunningQuery(settings.db_type, settings.connect, timeout=policy.query_timeout())
+        columns, data, error, stream = engine.execute_query(settings, sql, control)
+        return error, (columns, data, stream)
+    return execute
+
+
+def repair_query(settings, question, sql, error, execute=None, policy=None, on_attempt=None):
+    """Ask the model to fix `sql` until it runs or the attempt budget is spent.
+
+    `execute(sql)` runs a candidate and returns (error, result); by default it
+    is engine.execute_query with the per-attempt timeout. `on_attempt(attempt)`
+    is called after each attempt, e.g. to update a status line.
+    """
+    policy = policy or RepairPolicy()
+    execute = execute or _default_execute(settings, policy)
+    seen = {canonicalize_sql(sql, settings.db_type)}
+    failures = [(sql, error)]
+    result = RepairResult(sql, error)
+    if not repairable(error):
+        return result
+
+    timeouts = Timeouts(total=policy.attempt_timeout)
+
+    for number in range(1, policy.max_attempts + 1):
+        attempt = {"attempt": number, "sql": None, "error": None, "outcome": None,
+                   "generate_ms": None, "execute_ms": None, "total_ms": None}
+        with span("repair", attempt=number) as attempt_span:
+            started = time.perf_counter()
+            try:
+                prompt = build_repair_prompt(question, failures[-policy.history:])
+                prefix, _ = engine.load_prompt_prefix(settings, prompt)
+                with span("llm", provider=settings.ai_provider, model=settings.model):
+                    raw = engine.generate_text(settings, prefix.text, prompt, timeouts)
+                candidate = engine.extract_sql(raw)
+            except Exception as e:
+                raw, candidate = None, ""
+                attempt["error"] = f"Generation failed: {e}"
+            attempt["generate_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            attempt["sql"] = candidate
+
+            key = canonicalize_sql(candidate, settings.db_type) if candidate else None
+            if not candidate:
+                attempt["outcome"] = "no sql"
+            elif key in seen:
+                # The model repeated itself: running it again would fail the same way
+                attempt["outcome"] = "duplicate"
+            else:
+                seen.add(key)
+                stage = time.perf_counter()
+                attempt_error, payload = execute(candidate)
+                attempt["execute_ms"] = round((time.perf_counter() - stage) * 1000, 1)
+                attempt["error"] = attempt_error
+                if attempt_error is None:
+                    attempt["outcome"] = "fixed"
+                    result.sql, result.error, result.raw, result.result = candidate, None, raw, payload
+                else:
+                    attempt["outcome"] = "failed"
+                    failures.append((candidate, attempt_error))
+                    result.sql, result.error = candidate, attempt_error
+            attempt_span.set(outcome=attempt["outcome"], error=attempt["error"])
+        attempt["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result.attempts.append(attempt)
+        logger.info("Repair attempt %d/%d: %s (+%.0f ms)%s", number, policy.max_attempts, attempt["outcome"],
+                    attempt["total_ms"], ": " + attempt["error"] if attempt["error"] else "")
+        if on_attempt is not None:
+            on_attempt(attempt)
+        if attempt["outcome"] == "fixed":
+            # Later runs of the same question get the working answer from the SQL cache
+            engine.remember_sql(settings, question, raw)
+            break
+        if attempt["error"] and not repairable(attempt["error"]):
+            break
+
+    _stats.record(result)
+    return result
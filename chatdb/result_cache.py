@@ -0,0 +1,392 @@
+"""Process-wide cache of SELECT results.
+
+Entries are keyed by the connection identity and a canonical form of the SQL
+(comments dropped, whitespace collapsed, SQL keywords lower-cased, string
+literals and identifiers left as written), so re-running the same generated
+query with different formatting is a hit. Literals are read with the
+database's backslash escaping; where that is unknown and matters, the SQL as
+written is the key. Each entry remembers the tables it read; a write through
+execute_query invalidates every entry that references a table the write
+touched. Entries also expire after a TTL. When the memory or byte limit is hit,
+the least recently used entries are dropped, or spilled to SQLite if a spill
+path is configured.
+"""
+
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from chatdb.metrics import get_registry
+from chatdb.streaming import estimate_row_bytes
+
+
+# Only keywords are case-folded: MySQL table names can be case-sensitive
+_KEYWORDS = {
+    "select", "distinct", "from", "where", "and", "or", "not", "in", "is", "null", "like", "between",
+    "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on", "using", "as",
+    "group", "by", "order", "asc", "desc", "limit", "offset", "having", "union", "all", "with",
+    "case", "when", "then", "else", "end", "exists", "count", "sum", "avg", "min", "max",
+    "insert", "into", "values", "update", "set", "delete", "create", "alter", "drop", "table",
+}
+_TABLE_KEYWORDS = {"from", "join", "update", "into", "table"}
+_CLAUSE_END = {"where", "group", "order", "limit", "having", "on", "using", "set", "values",
+               "union", "select", "join", "inner", "left", "right", "full", "cross", "natural", "window"}
+
+
+# Where a backslash escapes the next character inside a literal: MySQL in '...' and
+# "..." (unless NO_BACKSLASH_ESCAPES), PostgreSQL only in E'...'; never in SQLite
+_BACKSLASH_ESCAPES = {"mysql": "all", "postgresql": "e", "sqlite": "none"}
+
+
+def _escapes(ch, sql, i, escapes):
+    if escapes == "all":
+        return ch != "`"
+    if escapes == "e":
+        # E'...', but not a word that happens to end in e
+        before = sql[i - 2] if i > 1 else " "
+        return ch == "'" and i > 0 and sql[i - 1] in "eE" and not (before.isalnum() or before in "_$")
+    return False
+
+
+def _canonicalize(sql, escapes):
+    """The canonical form under one escaping rule, and whether a literal contained a backslash."""
+    out = []
+    i, n = 0, len(sql)
+    pending_space = False
+    backslash = False
+    while i < n:
+        ch = sql[i]
+        if ch in "'\"`":
+            # Copy literals and quoted identifiers verbatim, including doubled quotes
+            escaped = _escapes(ch, sql, i, escapes)
+            j = i + 1
+            while j < n:
+                if sql[j] == "\\":
+                    backslash = True
+                    if escaped:
+                        j += 2
+                        continue
+                if sql[j] == ch:
+                    if j + 1 < n and sql[j + 1] == ch:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            out.append(sql[i:j + 1])
+            i = j + 1
+        elif sql.startswith("--", i):
+            j = sql.find("\n", i)
+            i = n if j == -1 else j
+            pending_space = True
+        elif sql.startswith("/*", i):
+            j = sql.find("*/", i + 2)
+            i = n if j == -1 else j + 2
+            pending_space = True
+        elif ch.isspace():
+            pending_space = True
+            i += 1
+        else:
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            if ch.isalpha() or ch == "_":
+                j = i + 1
+                while j < n and (sql[j].isalnum() or sql[j] in "_$"):
+                    j += 1
+                word = sql[i:j]
+                out.append(word.lower() if word.lower() in _KEYWORDS else word)
+                i = j
+            else:
+                out.append(ch)
+                i += 1
+    return "".join(out).strip().rstrip(";").strip(), backslash
+
+
+def _readings(sql, dialect):
+    """(canonical sql, escaping rule) for each way the literals of `sql` can be read.
+
+    With a known dialect there is one. Otherwise a backslash inside a literal
+    makes its end uncertain, so both readings are returned.
+    """
+    escapes = _BACKSLASH_ESCAPES.get(dialect)
+    if escapes is not None:
+        return [(_canonicalize(sql, escapes)[0], escapes)]
+    canonical, backslash = _canonicalize(sql, "none")
+    if not backslash:
+        return [(canonical, "none")]
+    return [(canonical, "none"), (_canonicalize(sql, "all")[0], "all")]
+
+
+def canonicalize_sql(sql, dialect=None):
+    """Comments dropped, whitespace collapsed and keywords lower-cased, literals kept as written.
+
+    `dialect` is the db_type whose backslash escaping applies. Without one, SQL
+    whose literal boundaries depend on it is returned as written (stripped), so
+    two different queries can never share a form.
+    """
+    readings = _readings(sql, dialect)
+    if len(readings) > 1:
+        return sql.strip()
+    return readings[0][0]
+
+
+_WORD = r"[\w.$]+|[(),;]"
+_IDENTIFIER = r'"(?:[^"]|"")*"|`(?:[^`]|``)*`'
+_TOKEN_RES = {
+    "none": re.compile(_IDENTIFIER + r"|'(?:[^']|'')*'|" + _WORD),
+    "all": re.compile(r'"(?:[^"\\]|""|\\.)*"|`(?:[^`]|``)*`' + r"|'(?:[^'\\]|''|\\.)*'|" + _WORD),
+    # An E'...' literal is matched before the E can be read as a word
+    "e": re.compile(r"(?<![\w$])[Ee]'(?:[^'\\]|''|\\.)*'|" + _IDENTIFIER + r"|'(?:[^']|'')*'|" + _WORD),
+}
+
+
+def _tokens(canonical, escapes):
+    # Quoted tokens end with their quote; E'...' starts with a letter
+    return [token if token[-1] in "'\"`" else token.lower() for token in _TOKEN_RES[escapes].findall(canonical)]
+
+
+def referenced_tables(sql, dialect=None):
+    """Best-effort set of unqualified table names read or written by `sql`, lower-cased.
+
+    Empty when the literals cannot be read for certain, which invalidates every entry.
+    """
+    readings = _readings(sql, dialect)
+    if len(readings) > 1:
+        return set()
+    tokens = _tokens(*readings[0])
+    tables = set()
+    i = 0
+    while i < len(tokens):
+        if tokens[i] in _TABLE_KEYWORDS:
+            i += 1
+            # FROM a x, b AS y -- keep reading comma-separated table references
+            while i < len(tokens):
+                token = tokens[i]
+                if token == "(" or token in _CLAUSE_END:
+                    break
+                if token not in ("if", "not", "exists", "only", "ignore", "as", ","):
+                    tables.add(token.split(".")[-1].strip('"`').lower())
+                    i += 1
+                    # Skip an alias
+                    if i < len(tokens) and tokens[i] == "as":
+                        i += 2
+                    elif i < len(tokens) and tokens[i] not in (",", "(") and tokens[i] not in _CLAUSE_END \
+                            and tokens[i] not in _TABLE_KEYWORDS:
+                        i += 1
+                    if i < len(tokens) and tokens[i] == ",":
+                        i += 1
+                        continue
+                    break
+                i += 1
+            continue
+        i += 1
+    return tables
+
+
+# Statements that return rows rather than a row count
+ROW_STATEMENTS = {"select", "values", "show", "explain", "describe", "desc", "pragma", "table"}
+_CTE_WRITES = {("insert", "into"), ("delete", "from"), ("merge", "into")}
+
+
+def _kind(tokens):
+    words = [token for token in tokens if token[-1] not in "'\"`"]
+    if not words:
+        return ""
+    if words[0] != "with":
+        return words[0]
+    for i, word in enumerate(words):
+        if tuple(words[i:i + 2]) in _CTE_WRITES or (word == "update" and "set" in words[i + 1:i + 4]):
+            return word
+    return "select"
+
+
+def statement_kind(sql, dialect=None):
+    """The statement's leading keyword, read past comments ("select", "insert", ...; "" if none).
+
+    A WITH query is reported as the INSERT/UPDATE/DELETE/MERGE it wraps, and as
+    "select" otherwise. If the readings of uncertain literals disagree, the
+    write wins, so it is not served from the cache.
+    """
+    kinds = [_kind(_tokens(canonical, escapes)) for canonical, escapes in _readings(sql, dialect)]
+    return next((kind for kind in kinds if kind != "select"), kinds[0])
+
+
+def estimate_result_bytes(data):
+    nbytes = getattr(data, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    return sum(estimate_row_bytes(row) for row in data)
+
+
+class ResultCache:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=60, spill_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (connection key, canonical sql) -> (columns, data, tables, created_at, nbytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        self._spill = None
+        if spill_path:
+            os.makedirs(os.path.dirname(os.path.abspath(spill_path)), exist_ok=True)
+            self._spill = sqlite3.connect(spill_path, check_same_thread=False)
+            self._spill.execute("DROP TABLE IF EXISTS spilled")
+            self._spill.execute(
+                "CREATE TABLE spilled (conn TEXT, sql TEXT, tables TEXT, created_at REAL, payload BLOB, "
+                "PRIMARY KEY (conn, sql))"
+            )
+            self._spill.commit()
+
+    def get(self, conn_key, sql, dialect=None):
+        key = (repr(conn_key), canonicalize_sql(sql, dialect))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[3], now):
+                    self._drop(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[1]
+            if self._spill is not None:
+                row = self._spill.execute(
+                    "SELECT tables, created_at, payload FROM spilled WHERE conn = ? AND sql = ?", key
+                ).fetchone()
+                if row is not None:
+                    self._spill.execute("DELETE FROM spilled WHERE conn = ? AND sql = ?", key)
+                    self._spill.commit()
+                    if self._expired(row[1], now):
+                        self.expirations += 1
+                    else:
+                        columns, data = pickle.loads(row[2])
+                        self.disk_hits += 1
+                        # Promote back into memory
+                        self._insert(key, columns, data, set(row[0].split(",")) - {""}, row[1])
+                        return columns, data
+            self.misses += 1
+            return None
+
+    def put(self, conn_key, sql, columns, data, dialect=None):
+        key = (repr(conn_key), canonicalize_sql(sql, dialect))
+        with self._lock:
+            self._insert(key, columns, data, referenced_tables(sql, dialect), time.time())
+
+    def invalidate(self, conn_key, tables=None):
+        """Drop entries for `conn_key` that read any of `tables` (all of them if None/empty)."""
+        conn = repr(conn_key)
+        tables = {t.lower() for t in tables or ()}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if key[0] == conn and (not tables or entry[2] & tables or not entry[2])]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+            if self._spill is not None:
+                rows = self._spill.execute("SELECT sql, tables FROM spilled WHERE conn = ?", (conn,)).fetchall()
+                for sql, spilled_tables in rows:
+                    spilled_tables = set(spilled_tables.split(",")) - {""}
+                    if not tables or spilled_tables & tables or not spilled_tables:
+                        self._spill.execute("DELETE FROM spilled WHERE conn = ? AND sql = ?", (conn, sql))
+                        self.invalidations += 1
+                self._spill.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            spilled = self._spill.execute("SELECT COUNT(*) FROM spilled").fetchone()[0] if self._spill else 0
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "spilled_entries": spilled,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _expired(self, created_at, now):
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _insert(self, key, columns, data, tables, created_at):
+        nbytes = estimate_result_bytes(data)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (columns, data, tables, created_at, nbytes)
+        self._bytes += nbytes
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, old = next(iter(self._entries.items()))
+            self._drop(old_key)
+            self.evictions += 1
+            if self._spill is not None and not self._expired(old[3], time.time()):
+                self._spill.execute(
+                    "INSERT OR REPLACE INTO spilled VALUES (?, ?, ?, ?, ?)",
+                    (*old_key, ",".join(sorted(old[2])), old[3],
+                     pickle.dumps((old[0], old[1]), protocol=pickle.HIGHEST_PROTOCOL)),
+                )
+                self._spill.commit()
+                self.spills += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[4]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _collect_result_cache():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    lookups = [({"result": result}, stats[key]) for result, key in
+               (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))]
+    return [
+        ("chatdb_result_cache_lookups_total", "counter", "Result cache lookups by result", lookups),
+        ("chatdb_result_cache_entries", "gauge", "Results held in memory", [({}, stats["entries"])]),
+        ("chatdb_result_cache_bytes", "gauge", "Estimated size of the results held", [({}, stats["bytes"])]),
+        ("chatdb_result_cache_evictions_total", "counter", "Results evicted", [({}, stats["evictions"])]),
+        ("chatdb_result_cache_invalidations_total", "counter", "Results dropped after writes",
+         [({}, stats["invalidations"])]),
+    ]
+
+
+get_registry().register_collector(_collect_result_cache)
+
+
+def get_result_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 256)),
+                max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+                ttl=float(os.getenv("RESULT_CACHE_TTL", 60)),
+                spill_path=os.getenv("RESULT_CACHE_SPILL_PATH") or None,
+            )
+        return _cache
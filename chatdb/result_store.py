@@ -0,0 +1,99 @@
+"""Per-session result storage outside the Python heap.
+
+Chat history records keep only a handle and a row count; the result sets
+themselves are pickled into a per-session SQLite file, with a small LRU of
+recently shown results kept in memory. Memory per session therefore stays
+bounded however long the session runs. The file is deleted when the store is
+closed or garbage collected with the session state.
+"""
+
+import glob
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+
+def _remove_file(path, db):
+    try:
+        db.close()
+    except Exception:
+        pass
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_stale_stores(directory, max_age):
+    # Sessions that ended without a clean shutdown (e.g. the server was killed)
+    cutoff = time.time() - max_age
+    for path in glob.glob(os.path.join(directory, "results_*.sqlite")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class ResultStore:
+    def __init__(self, directory=None, hot_entries=None):
+        directory = directory or os.getenv("RESULT_STORE_DIR", ".chatdb_cache/results")
+        self.hot_entries = hot_entries or int(os.getenv("RESULT_HOT_ENTRIES", 3))
+        os.makedirs(directory, exist_ok=True)
+        remove_stale_stores(directory, float(os.getenv("RESULT_STORE_MAX_AGE", 86400)))
+
+        self.path = os.path.join(directory, f"results_{uuid.uuid4().hex}.sqlite")
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE results (id INTEGER PRIMARY KEY, payload BLOB, row_count INTEGER)")
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()  # id -> data, most recently used last
+        self._finalizer = weakref.finalize(self, _remove_file, self.path, self._db)
+
+    def put(self, data):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO results (payload, row_count) VALUES (?, ?)", (payload, len(data))
+            )
+            self._db.commit()
+            handle = cursor.lastrowid
+            self._remember(handle, data)
+        return handle
+
+    def update(self, handle, data):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db.execute(
+                "UPDATE results SET payload = ?, row_count = ? WHERE id = ?", (payload, len(data), handle)
+            )
+            self._db.commit()
+            self._remember(handle, data)
+
+    def get(self, handle):
+        with self._lock:
+            data = self._hot.get(handle)
+            if data is not None:
+                self._hot.move_to_end(handle)
+                return data
+            row = self._db.execute("SELECT payload FROM results WHERE id = ?", (handle,)).fetchone()
+            if row is None:
+                return None
+            data = pickle.loads(row[0])
+            self._remember(handle, data)
+            return data
+
+    def close(self):
+        with self._lock:
+            self._hot.clear()
+        self._finalizer()
+
+    def _remember(self, handle, data):
+        self._hot[handle] = data
+        self._hot.move_to_end(handle)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
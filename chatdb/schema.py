@@ -0,0 +1,337 @@
+"""Cached database schema catalog used to ground the SQL generation prompt.
+
+The full catalog (tables, columns, types, keys, row estimates, comments) is
+read once from information_schema (MySQL), pg_catalog (PostgreSQL) or
+sqlite_master and the table-info pragmas (SQLite), kept in memory and mirrored
+to disk. Later refreshes run one cheap per-table signature query (covering
+columns and foreign keys) and re-read only the tables whose signature changed,
+and they run at most once per refresh interval no matter how often Streamlit
+reruns the script.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# One row per table: name, signature parts..., row estimate, comment
+_SIGNATURE_QUERIES = {
+    # In-place and INSTANT ALTERs keep create_time, so the columns and foreign keys themselves are hashed
+    "mysql": """
+        SELECT t.table_name, t.table_type, t.create_time,
+               MD5(GROUP_CONCAT(c.column_name, ':', c.column_type, ':', c.is_nullable, ':', c.column_key,
+                                ':', c.column_comment ORDER BY c.ordinal_position SEPARATOR ',')),
+               (SELECT MD5(GROUP_CONCAT(k.constraint_name, ':', k.column_name, ':', k.referenced_table_name, ':',
+                                        k.referenced_column_name
+                                        ORDER BY k.constraint_name, k.ordinal_position SEPARATOR ','))
+                  FROM information_schema.key_column_usage k
+                  WHERE k.table_schema = DATABASE() AND k.table_name = t.table_name
+                    AND k.referenced_table_name IS NOT NULL),
+               t.table_rows, t.table_comment
+        FROM information_schema.tables t
+        LEFT JOIN information_schema.columns c
+          ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+        WHERE t.table_schema = DATABASE()
+        GROUP BY t.table_name, t.table_type, t.create_time, t.table_rows, t.table_comment
+    """,
+    "postgresql": """
+        SELECT c.relname, c.relkind,
+               md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod) || ':' || a.attnotnull,
+                              ',' ORDER BY a.attnum)),
+               (SELECT md5(string_agg(con.conname || ':' || pg_get_constraintdef(con.oid), ',' ORDER BY con.conname))
+                  FROM pg_constraint con WHERE con.conrelid = c.oid),
+               c.reltuples::bigint, obj_description(c.oid, 'pg_class')
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'v', 'm', 'p')
+        GROUP BY c.oid, c.relname, c.relkind, c.reltuples
+    """,
+    # SQLite keeps the CREATE statement, which changes with every DDL change
+    "sqlite": """
+        SELECT name, type, sql, 0, NULL
+        FROM sqlite_master
+        WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'
+    """,
+}
+
+# (table, column, type, nullable, is_primary_key, comment)
+_COLUMN_QUERIES = {
+    "mysql": """
+        SELECT table_name, column_name, column_type, is_nullable = 'YES', column_key = 'PRI', column_comment
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name IN %s
+        ORDER BY table_name, ordinal_position
+    """,
+    "postgresql": """
+        SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull,
+               COALESCE(a.attnum = ANY(pk.conkey), false), col_description(c.oid, a.attnum)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_constraint pk ON pk.conrelid = c.oid AND pk.contype = 'p'
+        WHERE n.nspname = current_schema() AND c.relname = ANY(%s)
+          AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
+    """,
+    # SQLite has no list parameters; rows for other tables are skipped while loading
+    "sqlite": """
+        SELECT m.name, p.name, p.type, NOT p."notnull", p.pk > 0, NULL
+        FROM sqlite_master m
+        JOIN pragma_table_info(m.name) p
+        WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%'
+        ORDER BY m.name, p.cid
+    """,
+}
+
+# (table, column, referenced table, referenced column, constraint name)
+_FOREIGN_KEY_QUERIES = {
+    "mysql": """
+        SELECT table_name, column_name, referenced_table_name, referenced_column_name, constraint_name
+        FROM information_schema.key_column_usage
+        WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL AND table_name IN %s
+        ORDER BY table_name, constraint_name, ordinal_position
+    """,
+    "postgresql": """
+        SELECT c.relname, a.attname, rc.relname, ra.attname, con.conname
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_class rc ON rc.oid = con.confrelid
+        CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+        JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+        WHERE con.contype = 'f' AND n.nspname = current_schema() AND c.relname = ANY(%s)
+        ORDER BY c.relname, con.conname, k.ord
+    """,
+    "sqlite": """
+        SELECT m.name, f."from", f."table", f."to", f.id
+        FROM sqlite_master m
+        JOIN pragma_foreign_key_list(m.name) f
+        WHERE m.type = 'table'
+        ORDER BY m.name, f.id, f.seq
+    """,
+}
+
+
+def _names_param(db_type, names):
+    # pymysql expands a tuple for IN %s, psycopg2 adapts a list for = ANY(%s)
+    if db_type == "sqlite":
+        return None
+    return (tuple(names) if db_type == "mysql" else list(names),)
+
+
+def _query(conn, sql, params=None):
+    cursor = conn.cursor()
+    try:
+        if params is None:
+            cursor.execute(sql)  # sqlite3 rejects params=None
+        else:
+            cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def rough_count(n):
+    """`n` to one significant digit (48213 -> "50k"), so the prompt only changes when a table really grows."""
+    if not n:
+        return "0"
+    magnitude = 10 ** (len(str(int(n))) - 1)
+    n = round(n / magnitude) * magnitude
+    for size, suffix in ((10 ** 9, "G"), (10 ** 6, "M"), (10 ** 3, "k")):
+        if n >= size:
+            return f"{n // size}{suffix}"
+    return str(n)
+
+
+class SchemaCatalog:
+    def __init__(self, db_type, cache_path=None, refresh_interval=60):
+        self.db_type = db_type
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        # name -> {"signature", "row_estimate", "comment", "columns", "primary_key", "foreign_keys"}
+        self.tables = {}
+        # Bumped whenever the rendered prompt would change; prompt prefixes are cached per revision
+        self.revision = 0
+        self.last_checked = 0.0
+        self.full_loads = 0
+        self.incremental_refreshes = 0
+        self.tables_reloaded = 0
+        self._lock = threading.Lock()
+        self._load_from_disk()
+
+    def refresh(self, pool, force=False):
+        """Bring the catalog up to date if the refresh interval has passed."""
+        if self.db_type not in _SIGNATURE_QUERIES:
+            return False
+        with self._lock:
+            if not force and self.tables and time.time() - self.last_checked < self.refresh_interval:
+                return False
+            with pool.connection() as conn:
+                changed = self._refresh(conn)
+            self.last_checked = time.time()
+            if changed:
+                self._save_to_disk()
+            return changed
+
+    def _refresh(self, conn):
+        if self.db_type == "mysql":
+            # GROUP_CONCAT stops at 1024 bytes by default, which would hide changes to later columns
+            _query(conn, "SET SESSION group_concat_max_len = 1048576")
+        signatures = {}
+        for row in _query(conn, _SIGNATURE_QUERIES[self.db_type]):
+            name, parts, row_estimate, comment = row[0], row[1:-2], row[-2], row[-1]
+            # PostgreSQL reports -1 for a table that was never analyzed: unknown, not empty
+            row_estimate = None if row_estimate is None or row_estimate < 0 else int(row_estimate)
+            signatures[name] = ("|".join(str(p) for p in parts), row_estimate, comment or "")
+
+        changed = [name for name, sig in signatures.items()
+                   if name not in self.tables or self.tables[name]["signature"] != sig[0]]
+        dropped = [name for name in self.tables if name not in signatures]
+
+        # Row estimates come with the signature query, so keep them current for free
+        details_changed = False
+        for name, (_, row_estimate, comment) in signatures.items():
+            if name in self.tables:
+                table = self.tables[name]
+                if rough_count(table["row_estimate"]) != rough_count(row_estimate) or table["comment"] != comment:
+                    details_changed = True
+                table["row_estimate"] = row_estimate
+                table["comment"] = comment
+
+        for name in dropped:
+            del self.tables[name]
+        if changed:
+            if self.tables:
+                self.incremental_refreshes += 1
+            else:
+                self.full_loads += 1
+            self._load_tables(conn, changed, signatures)
+            self.tables_reloaded += len(changed)
+        if changed or dropped or details_changed:
+            self.revision += 1
+        return bool(changed or dropped)
+
+    def _load_tables(self, conn, names, signatures):
+        loaded = {
+            name: {
+                "signature": signatures[name][0],
+                "row_estimate": signatures[name][1],
+                "comment": signatures[name][2],
+                "columns": [],
+                "primary_key": [],
+                "foreign_keys": [],
+            }
+            for name in names
+        }
+        param = _names_param(self.db_type, names)
+        for table, column, col_type, nullable, is_pk, comment in _query(conn, _COLUMN_QUERIES[self.db_type], param):
+            if table not in loaded:
+                continue
+            loaded[table]["columns"].append({
+                "name": column,
+                "type": col_type,
+                "nullable": bool(nullable),
+                "comment": comment or "",
+            })
+            if is_pk:
+                loaded[table]["primary_key"].append(column)
+
+        foreign_keys = {}
+        for table, column, ref_table, ref_column, constraint in _query(conn, _FOREIGN_KEY_QUERIES[self.db_type], param):
+            if table not in loaded:
+                continue
+            fk = foreign_keys.setdefault((table, constraint), {"columns": [], "ref_table": ref_table, "ref_columns": []})
+            fk["columns"].append(column)
+            fk["ref_columns"].append(ref_column)
+        for (table, _), fk in foreign_keys.items():
+            loaded[table]["foreign_keys"].append(fk)
+
+        self.tables.update(loaded)
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for name in sorted(self.tables):
+            digest.update(f"{name}\x1f{self.tables[name]['signature']}\x1e".encode("utf-8"))
+        return digest.hexdigest()[:16] if self.tables else ""
+
+    def describe_table(self, name):
+        table = self.tables[name]
+        fk_columns = {}
+        for fk in table["foreign_keys"]:
+            for column, ref_column in zip(fk["columns"], fk["ref_columns"]):
+                fk_columns[column] = f"{fk['ref_table']}.{ref_column}"
+        parts = []
+        for column in table["columns"]:
+            text = f"{column['name']} {column['type']}"
+            if column["name"] in table["primary_key"]:
+                text += " PK"
+            if column["name"] in fk_columns:
+                text += f" FK->{fk_columns[column['name']]}"
+            if not column["nullable"]:
+                text += " NOT NULL"
+            parts.append(text)
+        line = f"{name}({', '.join(parts)})"
+        if table["row_estimate"]:
+            line += f" -- ~{rough_count(table['row_estimate'])} rows"
+        if table["comment"]:
+            line += f" -- {table['comment']}"
+        return line
+
+    def to_prompt(self, table_names=None):
+        names = sorted(self.tables) if table_names is None else [n for n in table_names if n in self.tables]
+        return "\n".join(self.describe_table(name) for name in names)
+
+    def stats(self):
+        return {
+            "tables": len(self.tables),
+            "fingerprint": self.fingerprint(),
+            "full_loads": self.full_loads,
+            "incremental_refreshes": self.incremental_refreshes,
+            "tables_reloaded": self.tables_reloaded,
+            "last_checked": time.strftime("%H:%M:%S", time.localtime(self.last_checked)) if self.last_checked else None,
+        }
+
+    def _load_from_disk(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("db_type") == self.db_type:
+            # last_checked stays 0 so the first use still verifies signatures
+            self.tables = data.get("tables", {})
+
+    def _save_to_disk(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"db_type": self.db_type, "tables": self.tables}, f, default=str)
+        os.replace(tmp_path, self.cache_path)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(db_type, host, port, user, db_name):
+    key = (db_type, host, int(port), user, db_name)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            cache_dir = os.getenv("SCHEMA_CACHE_DIR", ".chatdb_cache")
+            name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+            catalog = SchemaCatalog(
+                db_type,
+                cache_path=os.path.join(cache_dir, f"schema_{name}.json") if cache_dir else None,
+                refresh_interval=float(os.getenv("SCHEMA_REFRESH_INTERVAL", 60)),
+            )
+            _catalogs[key] = catalog
+        return catalog
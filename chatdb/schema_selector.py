@@ -0,0 +1,145 @@
+"""Pick the tables relevant to a question so large schemas fit the prompt.
+
+Each table becomes a small document built from its name, column names, comments
+and the names of tables it is linked to by foreign keys. Documents are ranked
+with BM25 against the question; the best tables, plus their direct foreign-key
+neighbours when there is room, are kept until the token budget runs out. When
+nothing in the question matches, the most connected (then largest) tables are
+sent instead, so the prompt always has some schema to ground the SQL in.
+"""
+
+import math
+import re
+import threading
+
+
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+# Field weights: a match on the table name says more than a match on a comment
+TABLE_NAME_WEIGHT = 3
+COLUMN_WEIGHT = 1
+NEIGHBOUR_WEIGHT = 1
+COMMENT_WEIGHT = 1
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and SQL identifiers
+    return max(1, len(text) // 4)
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    text = _CAMEL_RE.sub(" ", text or "")
+    return [_stem(word.lower()) for word in _WORD_RE.findall(text)]
+
+
+class SchemaSelector:
+    def __init__(self, tables, k1=1.2, b=0.75):
+        """`tables` is SchemaCatalog.tables: name -> table info dict."""
+        self.k1 = k1
+        self.b = b
+        self.names = sorted(tables)
+        self.neighbours = {name: set() for name in self.names}
+        for name in self.names:
+            for fk in tables[name].get("foreign_keys", []):
+                if fk["ref_table"] in self.neighbours:
+                    self.neighbours[name].add(fk["ref_table"])
+                    self.neighbours[fk["ref_table"]].add(name)
+
+        self.postings = {}  # term -> [(doc index, term frequency)]
+        self.doc_lengths = []
+        for i, name in enumerate(self.names):
+            counts = {}
+            table = tables[name]
+            fields = [(name, TABLE_NAME_WEIGHT), (table.get("comment", ""), COMMENT_WEIGHT)]
+            for column in table.get("columns", []):
+                fields.append((column["name"], COLUMN_WEIGHT))
+                fields.append((column.get("comment", ""), COMMENT_WEIGHT))
+            for neighbour in self.neighbours[name]:
+                fields.append((neighbour, NEIGHBOUR_WEIGHT))
+            for text, weight in fields:
+                for term in tokenize(text):
+                    counts[term] = counts.get(term, 0) + weight
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+            self.doc_lengths.append(sum(counts.values()))
+
+        # Hub tables first: most foreign-key links, then most rows
+        self.fallback = sorted(self.names, key=lambda name: (-len(self.neighbours[name]),
+                                                            -max(tables[name].get("row_estimate") or 0, 0), name))
+
+        n = len(self.names)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, question):
+        scores = {}
+        for term in set(tokenize(question)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for i, tf in docs:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return {self.names[i]: score for i, score in scores.items()}
+
+    def select(self, question, describe, top_k=8, token_budget=2000):
+        """Return table names to include, best first, within `token_budget`.
+
+        `describe(name)` renders a table the way it will appear in the prompt.
+        """
+        ranked = sorted(self.scores(question).items(), key=lambda item: (-item[1], item[0]))
+        candidates = [name for name, _ in ranked[:top_k]]
+        # Join partners of the best matches are usually needed to write the query
+        for name in list(candidates):
+            for neighbour in sorted(self.neighbours[name]):
+                if neighbour not in candidates:
+                    candidates.append(neighbour)
+
+        selected = self._fit(candidates, describe, token_budget)
+        if not selected:
+            # No question term matched (or nothing that did fits): an empty schema would have the model guess
+            selected = self._fit(self.fallback, describe, token_budget, top_k)
+        return selected
+
+    def _fit(self, names, describe, token_budget, limit=None):
+        selected, used = [], 0
+        for name in names:
+            if limit is not None and len(selected) >= limit:
+                break
+            cost = estimate_tokens(describe(name))
+            if used + cost > token_budget:
+                continue
+            selected.append(name)
+            used += cost
+        return selected
+
+
+_selectors = {}
+_selectors_lock = threading.Lock()
+
+
+def get_selector(catalog):
+    # The index only depends on the catalog contents, so rebuild it when the
+    # schema fingerprint changes rather than on every rerun.
+    key = (id(catalog), catalog.fingerprint())
+    with _selectors_lock:
+        selector = _selectors.get(key)
+        if selector is None:
+            for stale in [k for k in _selectors if k[0] == key[0]]:
+                del _selectors[stale]
+            selector = SchemaSelector(catalog.tables)
+            _selectors[key] = selector
+        return selector
@@ -0,0 +1,560 @@
+"""HTTP/JSON API for the assistant, as a plain ASGI application.
+
+Other services can ask for SQL and results without going through Streamlit:
+
+    POST /generate  {"prompt": ...}                      -> raw answer and extracted SQL
+    POST /execute   {"sql": ..., "max_rows": 1000}       -> columns and rows
+    POST /ask       {"prompt": ..., "execute": true}     -> both, in one call
+    GET  /health                                         -> worker and queue counts
+    GET  /metrics                                        -> Prometheus text format (chatdb/metrics.py)
+
+Requests are handled on the event loop; the blocking parts (schema refresh,
+provider calls through the engine, database drivers) run on a bounded worker
+pool. At most API_WORKERS requests run at once and at most API_MAX_QUEUE more
+wait for a worker; beyond that, or after waiting API_QUEUE_TIMEOUT seconds, the
+server answers 503 with Retry-After instead of piling up threads.
+
+With "stream": "sse" (or "ndjson", or an Accept: text/event-stream header) the
+response is a stream of events: `token` pieces while the model writes, `sql`
+once it is extracted, `plan`, `columns`, `rows` per page and a final `done`
+(or `error`). A client that disconnects mid-stream cancels its query.
+
+/ask with "repair": true (default: REPAIR_MODE) sends a failing query's error
+back to the model (chatdb/repair.py); the attempts are returned as `repairs`,
+or streamed as `query_error` and `repair` events.
+
+Database and provider settings come from `.env`, as for the batch runner; a
+request may pick another "provider". When API_TOKEN is set, requests must send
+`Authorization: Bearer <token>`.
+
+    python -m chatdb.server --host 0.0.0.0 --port 8000     # needs uvicorn
+    uvicorn chatdb.server:app --env-file .env
+
+Every request is traced (chatdb/tracing.py): its id is returned in the
+X-Trace-Id header and its spans go to TRACE_EXPORT_PATH if that is set.
+
+Run one process per server: pools, caches and the worker limits are per process.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from chatdb import engine
+from chatdb.columnar import ColumnarResult
+from chatdb.metrics import CONTENT_TYPE, get_registry
+from chatdb.planner import plan_query
+from chatdb.query_control import QueryCancelled, RunningQuery
+from chatdb.repair import RepairPolicy, repair_enabled, repair_query, repairable
+from chatdb.tracing import current_span, span, start_trace
+
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **extra}
+
+
+class Admission:
+    """Bounded concurrency with a bounded wait queue (backpressure)."""
+
+    def __init__(self, workers, max_queue, queue_timeout):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            # Created lazily so it binds to the server's running loop
+            self._semaphore = asyncio.Semaphore(self.workers)
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.active} requests running and {self.waiting} queued")
+        self.waiting += 1
+        try:
+            with span("queue"):
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(f"no worker free within {self.queue_timeout:g}s") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+def _json_rows(data):
+    if isinstance(data, ColumnarResult):
+        return [list(row) for row in data]
+    return [list(row) for row in data or ()]
+
+
+def _stream_format(scope, body):
+    mode = body.get("stream")
+    if mode in ("sse", "ndjson"):
+        return mode
+    if mode is True:
+        return "ndjson"
+    headers = dict(scope.get("headers") or [])
+    if mode is None and b"text/event-stream" in headers.get(b"accept", b""):
+        return "sse"
+    return None
+
+
+def _trace_headers():
+    trace_id = current_span().trace_id
+    return [] if trace_id is None else [(b"x-trace-id", f"{trace_id:032x}".encode())]
+
+
+_servers = weakref.WeakSet()
+
+
+def _collect_admission():
+    # Summed over the servers in this process; normally there is one
+    total = {"active": 0, "queued": 0, "workers": 0, "rejected": 0}
+    for server in list(_servers):
+        stats = server.admission.stats()
+        for key in total:
+            total[key] += stats[key]
+    return [
+        ("chatdb_api_requests_in_flight", "gauge", "API requests holding a worker", [({}, total["active"])]),
+        ("chatdb_api_requests_queued", "gauge", "API requests waiting for a worker", [({}, total["queued"])]),
+        ("chatdb_api_workers", "gauge", "API worker pool size", [({}, total["workers"])]),
+        ("chatdb_api_requests_rejected_total", "counter", "API requests answered 503 by backpressure",
+         [({}, total["rejected"])]),
+    ]
+
+
+get_registry().register_collector(_collect_admission)
+
+
+class ApiServer:
+    def __init__(self, workers=None, max_queue=None, queue_timeout=None, token=None):
+        workers = workers or int(os.getenv("API_WORKERS", 8))
+        self.admission = Admission(
+            workers,
+            int(os.getenv("API_MAX_QUEUE", 32)) if max_queue is None else max_queue,
+            float(os.getenv("API_QUEUE_TIMEOUT", 10)) if queue_timeout is None else queue_timeout,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chatdb-api")
+        self.token = os.getenv("API_TOKEN", "") if token is None else token
+        self.max_rows = int(os.getenv("API_MAX_ROWS", 10000))
+        self._settings = {}
+        self._settings_lock = threading.Lock()
+        _servers.add(self)
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+            ("POST", "/generate"): self.generate,
+            ("POST", "/execute"): self.execute,
+            ("POST", "/ask"): self.ask,
+        }
+
+    # ── ASGI plumbing ────────────────────────────────────────────────────
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        # Health checks and scrapes are polled; tracing them would only add noise to the export
+        probe = scope["method"] == "GET" and scope["path"] in ("/health", "/metrics")
+        with nullcontext() if probe else start_trace(f"{scope['method']} {scope['path']}"):
+            try:
+                handler = self.routes.get((scope["method"], scope["path"]))
+                if handler is None:
+                    known = any(path == scope["path"] for _, path in self.routes)
+                    raise HTTPError(405 if known else 404, "method not allowed" if known else "not found")
+                self._authorize(scope)
+                body = await self._read_json(receive) if scope["method"] == "POST" else {}
+                if probe:
+                    await handler(send)
+                    return
+                current_span().set(provider=body.get("provider"))
+                async with self.admission:
+                    await handler(scope, receive, send, body)
+            except Overloaded as e:
+                await self._send_json(send, 503, {"error": f"Server busy: {e}"}, [(b"retry-after", b"1")])
+            except HTTPError as e:
+                current_span().set(status=e.status)
+                await self._send_json(send, e.status, e.body)
+            except Exception as e:
+                current_span().set(status=500, error=str(e))
+                await self._send_json(send, 500, {"error": str(e)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self._preload()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _authorize(self, scope):
+        if not self.token:
+            return
+        headers = dict(scope.get("headers") or [])
+        supplied = headers.get(b"authorization", b"").decode("latin-1")
+        if not hmac.compare_digest(supplied, f"Bearer {self.token}"):
+            raise HTTPError(401, "missing or invalid bearer token")
+
+    async def _read_json(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "client disconnected")
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        raw = b"".join(chunks)
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            raise HTTPError(400, "request body is not valid JSON") from None
+        if not isinstance(body, dict):
+            raise HTTPError(400, "request body must be a JSON object")
+        return body
+
+    async def _send_json(self, send, status, payload, headers=()):
+        await self._send(send, status, json.dumps(payload, default=str).encode(), b"application/json", headers)
+
+    async def _send(self, send, status, data, content_type, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(data)).encode()),
+                        *_trace_headers(), *headers],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    def _run(self, fn, *args):
+        # The worker joins the request's trace
+        return asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run, fn, *args)
+
+    async def _preload(self):
+        # Start serving with the model already loaded rather than let the first request wait for it
+        try:
+            future = engine.preload_model(self.settings())
+            if future is not None:
+                logger.info("Model preloaded in %.1fs", await asyncio.wrap_future(future))
+        except Exception as e:
+            logger.warning("Model preload failed: %s", e)
+
+    def settings(self, provider=None):
+        provider = (provider or "").upper() or None
+        with self._settings_lock:
+            if provider not in self._settings:
+                try:
+                    self._settings[provider] = engine.Settings.from_env(provider)
+                except ValueError as e:
+                    raise HTTPError(400, str(e)) from None
+            return self._settings[provider]
+
+    # ── Handlers ─────────────────────────────────────────────────────────
+
+    async def health(self, send):
+        await self._send_json(send, 200, {"status": "ok", **self.admission.stats()})
+
+    async def metrics(self, send):
+        await self._send(send, 200, get_registry().exposition().encode(), CONTENT_TYPE.encode())
+
+    async def generate(self, scope, receive, send, body):
+        prompt = self._require(body, "prompt")
+        settings = self.settings(body.get("provider"))
+        fmt = _stream_format(scope, body)
+        if fmt is None:
+            raw, sql = await self._generate(settings, prompt)
+            await self._send_json(send, 200, {"raw": raw, "sql": sql})
+            return
+        await self._stream(scope, receive, send, fmt, lambda events, control: self._generate_events(
+            settings, prompt, events, control))
+
+    async def execute(self, scope, receive, send, body):
+        sql = self._require(body, "sql")
+        settings = self.settings(body.get("provider"))
+        max_rows = self._max_rows(body)
+        fmt = _stream_format(scope, body)
+        if fmt is None:
+            await self._send_json(send, 200, await self._execute(settings, sql, max_rows, body.get("force")))
+            return
+        await self._stream(scope, receive, send, fmt, lambda events, control: self._execute_events(
+            settings, sql, max_rows, body.get("force"), events, control))
+
+    async def ask(self, scope, receive, send, body):
+        prompt = self._require(body, "prompt")
+        settings = self.settings(body.get("provider"))
+        max_rows = self._max_rows(body)
+        run = body.get("execute", True)
+        # Failed queries go back to the model with their error (REPAIR_MODE sets the default)
+        repair_for = prompt if body.get("repair", repair_enabled()) else None
+        fmt = _stream_format(scope, body)
+        if fmt is None:
+            raw, sql = await self._generate(settings, prompt)
+            result = {"raw": raw, "sql": sql}
+            if run and sql:
+                result.update(await self._execute(settings, sql, max_rows, body.get("force"), repair_for))
+            await self._send_json(send, 200, result)
+            return
+
+        async def events_for(events, control):
+            sql = await self._generate_events(settings, prompt, events, control)
+            if run and sql:
+                await self._execute_events(settings, sql, max_rows, body.get("force"), events, control, repair_for)
+
+        await self._stream(scope, receive, send, fmt, events_for)
+
+    # ── Pipeline steps ───────────────────────────────────────────────────
+
+    def _require(self, body, key):
+        value = body.get(key)
+        if not isinstance(value, str) or not value.strip():
+            raise HTTPError(400, f"'{key}' is required")
+        return value
+
+    def _max_rows(self, body):
+        try:
+            requested = int(body.get("max_rows") or self.max_rows)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "'max_rows' must be an integer") from None
+        return max(1, min(requested, self.max_rows))
+
+    async def _generate(self, settings, prompt):
+        try:
+            raw = await self._run(engine.generate_sql, settings, prompt)
+        except Exception as e:
+            raise HTTPError(502, f"Generation failed: {e}") from None
+        return raw, engine.extract_sql(raw)
+
+    def _plan(self, settings, sql, force):
+        if os.getenv("PLAN_QUERIES", "1") != "1":
+            return None, sql
+        plan = plan_query(settings.pool(), settings.db_type, sql)
+        if plan["action"] == "confirm" and not force:
+            raise HTTPError(409, f"Not executed: {plan['reason']} (send \"force\": true to run it).", plan=plan)
+        return plan, plan["sql"]
+
+    async def _execute(self, settings, sql, max_rows, force, repair_for=None):
+        plan, sql = await self._run(self._plan, settings, sql, force)
+        columns, data, error, truncated = await self._run(engine.run_query, settings, sql, max_rows)
+        repairs = None
+        if error and repair_for and repairable(error):
+            fix = await self._run(self._repair, settings, repair_for, sql, error, max_rows, force, False, {}, None)
+            repairs = fix.attempts
+            if not fix.repaired:
+                raise HTTPError(400, fix.error, sql=fix.sql, repairs=repairs)
+            plan, sql, columns, data, truncated = fix.result
+            error = None
+        if error:
+            raise HTTPError(400, error, sql=sql, plan=plan)
+        if isinstance(data, str):
+            return {"sql": sql, "plan": plan, "message": data, "repairs": repairs}
+        rows = _json_rows(data)
+        return {"sql": sql, "plan": plan, "columns": columns, "rows": rows,
+                "row_count": len(rows), "truncated": truncated, "repairs": repairs}
+
+    def _repair(self, settings, question, sql, error, max_rows, force, streaming, control, on_attempt):
+        policy = RepairPolicy()
+
+        def execute_candidate(candidate):
+            try:
+                plan, candidate = self._plan(settings, candidate, force)
+            except HTTPError as e:
+                return e.body["error"], None
+            query = control["query"] = RunningQuery(settings.db_type, settings.connect,
+                                                     timeout=policy.query_timeout())
+            if streaming:
+                columns, data, error, stream = engine.execute_query(settings, candidate, query)
+                return error, (plan, candidate, columns, data, stream)
+            columns, data, error, truncated = engine.run_query(settings, candidate, max_rows, query)
+            return error, (plan, candidate, columns, data, truncated)
+
+        return repair_query(settings, question, sql, error, execute_candidate, policy, on_attempt)
+
+    async def _generate_events(self, settings, prompt, events, control):
+        loop = asyncio.get_running_loop()
+
+        def call(prompt, system_prompt):
+            stream = control["llm"] = engine.stream_sql(settings, system_prompt, prompt)
+            for piece in stream:
+                if piece:
+                    loop.call_soon_threadsafe(events.put_nowait, ("token", {"text": piece}))
+            return stream.text
+
+        raw = await self._run(engine.generate_sql, settings, prompt, call)
+        sql = engine.extract_sql(raw)
+        await events.put(("sql", {"raw": raw, "sql": sql}))
+        return sql
+
+    async def _execute_events(self, settings, sql, max_rows, force, events, control, repair_for=None):
+        plan, sql = await self._run(self._plan, settings, sql, force)
+        if plan is not None:
+            await events.put(("plan", plan))
+        query = RunningQuery(settings.db_type, settings.connect)
+        control["query"] = query
+        columns, data, error, stream = await self._run(engine.execute_query, settings, sql, query)
+        if error and repair_for and repairable(error):
+            loop = asyncio.get_running_loop()
+            await events.put(("query_error", {"sql": sql, "error": error}))
+
+            def on_attempt(attempt):
+                loop.call_soon_threadsafe(events.put_nowait, ("repair", attempt))
+
+            fix = await self._run(self._repair, settings, repair_for, sql, error, max_rows, force, True,
+                                  control, on_attempt)
+            if not fix.repaired:
+                raise HTTPError(400, fix.error, sql=fix.sql)
+            plan, sql, columns, data, stream = fix.result
+            error = None
+            if plan is not None:
+                await events.put(("plan", plan))
+        if error:
+            raise HTTPError(400, error, sql=sql)
+        if isinstance(data, str):
+            await events.put(("message", {"sql": sql, "message": data}))
+            return
+        await events.put(("columns", {"sql": sql, "columns": columns}))
+        sent, truncated = 0, None
+        page = _json_rows(data)
+        try:
+            while True:
+                if len(page) > max_rows - sent:
+                    page, truncated = page[:max_rows - sent], "max rows"
+                if page:
+                    sent += len(page)
+                    await events.put(("rows", {"rows": page}))
+                if truncated or stream is None or stream.closed:
+                    break
+                # Each page is fetched on a worker, so a slow client only holds its own cursor
+                page = _json_rows(await self._run(stream.fetch_page))
+        finally:
+            if stream is not None:
+                truncated = truncated or stream.truncated
+                await self._run(stream.close)
+        await events.put(("done_rows", {"row_count": sent, "truncated": truncated}))
+
+    # ── Streaming responses ──────────────────────────────────────────────
+
+    async def _stream(self, scope, receive, send, fmt, produce):
+        events = asyncio.Queue()
+        control = {}
+        started = time.perf_counter()
+        content_type = b"text/event-stream" if fmt == "sse" else b"application/x-ndjson"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", content_type), (b"cache-control", b"no-cache"), *_trace_headers()],
+        })
+
+        async def run():
+            try:
+                await produce(events, control)
+            except HTTPError as e:
+                await events.put(("error", {"status": e.status, **e.body}))
+            except QueryCancelled as e:
+                await events.put(("error", {"status": 499, "error": str(e)}))
+            except Exception as e:
+                await events.put(("error", {"status": 500, "error": str(e)}))
+            finally:
+                await events.put(None)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        producer = asyncio.ensure_future(run())
+        disconnected = asyncio.ensure_future(watch_disconnect())
+        summary = {}
+        try:
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                event = getter.result()
+                if event is None:
+                    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    await self._send_event(send, fmt, "done", summary, more=False)
+                    return
+                name, payload = event
+                if name == "done_rows":
+                    # Folded into the final done event
+                    summary.update(payload)
+                    continue
+                await self._send_event(send, fmt, name, payload)
+        finally:
+            disconnected.cancel()
+            if not producer.done():
+                # The client went away: stop its generation and query instead of
+                # finishing them for nobody
+                for key in ("llm", "query"):
+                    if control.get(key) is not None:
+                        control[key].cancel()
+                producer.cancel()
+
+    async def _send_event(self, send, fmt, name, payload, more=True):
+        if fmt == "sse":
+            data = f"event: {name}\ndata: {json.dumps(payload, default=str)}\n\n"
+        else:
+            data = json.dumps({"event": name, **payload}, default=str) + "\n"
+        await send({"type": "http.response.body", "body": data.encode(), "more_body": more})
+
+
+app = ApiServer()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8000)))
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    import uvicorn
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(name)s: %(message)s")
+    uvicorn.run("chatdb.server:app", host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
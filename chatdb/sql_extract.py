@@ -0,0 +1,364 @@
+"""Finding SQL inside model output, whole or streamed.
+
+`SqlExtractor` reads text once, character by character, and can be fed as
+tokens arrive. It tracks ``` fences, string literals ('...', "...", `...`,
+$$...$$ and $tag$...$tag$), -- and /* */ comments, so a `;` or a keyword inside
+any of those does not confuse it, and it splits the output into statements.
+
+- Inside a fence everything is SQL; a leading language tag (`sql`, `mysql`, ...)
+  is dropped, and statements end at a top-level `;` or at the closing fence.
+- Outside a fence, a statement starts at a line whose first word is a SQL
+  keyword (SELECT, WITH, INSERT, ...) and runs over as many lines as it needs,
+  until a top-level `;`, a blank line or the end of the text. Prose lines are
+  skipped, so apostrophes in them are never taken for string literals.
+
+When the output has fenced statements only those are used, since the prose
+around a fence can itself start with "Select" or "Update".
+"""
+
+import re
+from collections import namedtuple
+
+
+Statement = namedtuple("Statement", "text fenced terminated")
+
+# First words a statement may start with
+_STATEMENT_START = frozenset((
+    "select", "with", "insert", "update", "delete", "create", "alter", "drop", "truncate",
+    "replace", "merge", "explain", "show", "describe", "desc", "values", "call", "grant",
+    "revoke", "set", "use", "pragma", "begin", "commit", "rollback", "analyze", "vacuum",
+))
+# ... and the subset trusted to start SQL in prose ("Show me", "Use the" are English)
+_PROSE_START = frozenset((
+    "select", "with", "insert", "update", "delete", "create", "alter", "drop", "truncate", "explain",
+))
+# Words that make an unterminated line of prose-started text look like SQL
+_CLAUSE_WORDS = frozenset(("from", "into", "set", "table", "values", "where", "join", "view", "index", "as"))
+# Labels models put before the query inside a fence
+_LANGUAGE_TAGS = frozenset(("sql", "mysql", "postgresql", "postgres", "psql", "sqlite", "plpgsql", "tsql"))
+
+_LINE_START, _PROSE, _SQL = range(3)
+# Runs that need no per-character decisions, consumed with one regex match each
+_PROSE_STOP_RE = re.compile(r"[\n`]")
+_WORD_RUN_RE = re.compile(r"\w+")
+# Spaces and punctuation that never start a comment, string or statement end
+_PUNCT_RUN_RE = re.compile(r"[ \t\r(),.=<>+%!?:@#&|^~\[\]{}]+")
+_COMMENT_RUN_RE = re.compile(r"[^\n`]+")
+_BLOCK_COMMENT_RUN_RE = re.compile(r"[^*/`]+")
+# Once a statement's first word and a clause word are known no word matters, so
+# whole stretches of words, spaces and plain punctuation go in one step
+_PLAIN = r"[\w \t\r(),.=<>+%!?:@#&|^~\[\]{}*]|-(?!-)|/(?!\*)"
+_PLAIN_RUN_RE = re.compile(f"(?:{_PLAIN})+")
+# Inside a fence a blank line ends nothing, so newlines are plain too
+_FENCED_PLAIN_RUN_RE = re.compile(f"(?:{_PLAIN}|\n)+")
+_QUOTED_RUN_RES = {"'": re.compile(r"[^'\\`]+"), '"': re.compile(r'[^"\\`]+'), "`": re.compile(r"[^`]+")}
+_DOLLAR_RUN_RE = re.compile(r"[^$`]+")
+
+
+class SqlExtractor:
+    """Incrementally split model output into SQL statements.
+
+    `feed()` returns True once at least one complete statement has been seen,
+    so streaming callers can show (or act on) the SQL before the model has
+    finished writing. `finish()` closes a statement left open at the end.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.complete = False
+        self._mode = _LINE_START
+        self._in_fence = False
+        self._ticks = 0
+        self._saw_prose = False
+        self._reset_statement()
+
+    def _reset_statement(self):
+        self._buf = []
+        self._word = []
+        self._first_word = None
+        self._has_clause = False
+        self._line_has_text = False
+        self._quote = None
+        self._escape = False
+        # PostgreSQL dollar quotes: the tag read since an opening "$" (None if there is none),
+        # and the last characters read inside one, to spot the closing delimiter
+        self._dollar_tag = None
+        self._dollar_tail = ""
+        self._line_comment = False
+        self._block_comment = False
+        self._prev = ""
+
+    @property
+    def sql(self):
+        fenced = [s.text for s in self.statements if s.fenced]
+        return "\n".join(fenced or [s.text for s in self.statements])
+
+    def feed(self, chunk):
+        i, n = 0, len(chunk)
+        while i < n:
+            if not self._ticks:
+                if self._mode == _PROSE:
+                    # Prose is skipped a line at a time; only newlines and fences matter there
+                    match = _PROSE_STOP_RE.search(chunk, i)
+                    if match is None:
+                        break
+                    i = match.start()
+                else:
+                    match = self._run(chunk, i)
+                    if match is not None:
+                        i = match.end()
+                        continue
+            ch = chunk[i]
+            if ch == "`" or self._ticks:
+                self._step(ch)
+            else:
+                self._char(ch)
+            i += 1
+        return self.complete
+
+    def finish(self):
+        self._resolve_ticks()
+        if self._mode == _SQL:
+            self._end_statement(terminated=False)
+        return self
+
+    # ── Scanner ──────────────────────────────────────────────────────────
+
+    def _step(self, ch):
+        if ch == "`":
+            self._ticks += 1
+            if self._ticks == 3:
+                self._ticks = 0
+                self._fence()
+            return
+        self._resolve_ticks()
+        self._char(ch)
+
+    def _run(self, chunk, i):
+        # Consume a word, a run of punctuation, or the inside of a comment or string, in one step
+        if self._mode == _LINE_START:
+            match = _WORD_RUN_RE.match(chunk, i)
+            if match is not None:
+                self._word.append(match.group())
+            return match
+        if self._escape:
+            return None
+        if self._line_comment:
+            match = _COMMENT_RUN_RE.match(chunk, i)
+        elif self._block_comment:
+            match = _BLOCK_COMMENT_RUN_RE.match(chunk, i)
+        elif self._quote and self._quote[0] == "$":
+            match = _DOLLAR_RUN_RE.match(chunk, i)
+            if match is not None:
+                # The closing tag may be split across chunks ("$q" + "$")
+                self._dollar_tail = (self._dollar_tail + match.group())[-len(self._quote):]
+        elif self._quote:
+            match = _QUOTED_RUN_RES[self._quote].match(chunk, i)
+        elif self._first_word is not None and self._dollar_tag is None:
+            # A "--" or "/*" split across chunks is finished by the per-character path
+            if self._prev + chunk[i] in ("--", "/*"):
+                return None
+            match = (_FENCED_PLAIN_RUN_RE if self._in_fence else _PLAIN_RUN_RE).match(chunk, i)
+            if match is None:
+                return None
+            text = match.group()
+            if self._has_clause:
+                self._word = []
+            else:
+                self._scan_words(text)
+            newline = text.rfind("\n")
+            if newline >= 0:
+                self._line_has_text = not text[newline + 1:].isspace() and newline + 1 < len(text)
+            elif not self._line_has_text and not text.isspace():
+                self._line_has_text = True
+        else:
+            match = _WORD_RUN_RE.match(chunk, i)
+            if match is not None:
+                self._word.append(match.group())
+                self._line_has_text = True
+                if self._dollar_tag is not None:
+                    self._dollar_tag += match.group()
+            else:
+                match = _PUNCT_RUN_RE.match(chunk, i)
+                if match is None:
+                    return None
+                self._end_word()
+                self._dollar_tag = None
+                if not match.group().isspace():
+                    self._line_has_text = True
+        if match is not None:
+            self._buf.append(match.group())
+            self._prev = match.group()[-1]
+        return match
+
+    def _scan_words(self, text):
+        # Clause words in a plain run; a word at its end may go on in the next chunk
+        words = _WORD_RUN_RE.findall(text)
+        if self._word and _WORD_RUN_RE.match(text):
+            words[0] = "".join(self._word) + words[0]
+        elif self._word:
+            words.insert(0, "".join(self._word))
+        self._word = [words.pop()] if words and _WORD_RUN_RE.match(text[-1]) else []
+        if any(word.lower() in _CLAUSE_WORDS for word in words):
+            self._has_clause = True
+
+    def _resolve_ticks(self):
+        # One or two backticks are identifier quotes (or inline code in prose)
+        ticks, self._ticks = self._ticks, 0
+        for _ in range(ticks):
+            self._char("`")
+
+    def _fence(self):
+        if self._in_fence:
+            if self._mode == _SQL:
+                self._end_statement(terminated=False)
+            self._in_fence = False
+            self._mode = _PROSE
+            return
+        if self._mode == _SQL:
+            self._end_statement(terminated=False)
+        self._in_fence = True
+        self._reset_statement()
+        self._mode = _SQL
+
+    def _char(self, ch):
+        if self._mode == _SQL:
+            self._sql_char(ch)
+        elif self._mode == _PROSE:
+            if ch == "\n":
+                self._mode = _LINE_START
+        elif ch.isalnum() or ch == "_":
+            self._word.append(ch)
+        elif self._word:
+            word = "".join(self._word)
+            self._word = []
+            if word.lower() in _PROSE_START and (ch.isspace() or ch in "(*;"):
+                self._mode = _SQL
+                self._buf = list(word)
+                self._first_word = word.lower()
+                self._line_has_text = True
+                self._sql_char(ch)
+            else:
+                self._saw_prose = True
+                self._mode = _LINE_START if ch == "\n" else _PROSE
+        elif not ch.isspace():
+            self._saw_prose = True
+            self._mode = _PROSE
+
+    def _sql_char(self, ch):
+        prev, self._prev = self._prev, ch
+        if self._line_comment:
+            self._buf.append(ch)
+            if ch == "\n":
+                self._line_comment = False
+                self._line_has_text = False
+            return
+        if self._block_comment:
+            self._buf.append(ch)
+            if prev == "*" and ch == "/":
+                self._block_comment = False
+                self._prev = ""
+            return
+        if self._quote:
+            self._buf.append(ch)
+            if self._escape:
+                self._escape = False
+            elif self._quote[0] == "$":
+                self._dollar_tail = (self._dollar_tail + ch)[-len(self._quote):]
+                if self._dollar_tail == self._quote:
+                    self._quote = None
+                    self._prev = ""
+            elif ch == "\\" and self._quote != "`":
+                self._escape = True
+            elif ch == self._quote:
+                self._quote = None
+            return
+        if ch.isalnum() or ch == "_":
+            self._word.append(ch)
+            self._buf.append(ch)
+            self._line_has_text = True
+            if self._dollar_tag is not None:
+                self._dollar_tag += ch
+            return
+        if ch == "$":
+            if self._dollar_tag is not None and not self._dollar_tag[:1].isdigit():
+                # $$ or $tag$ (a tag cannot start with a digit: $1 is a parameter)
+                self._buf.append(ch)
+                self._quote = "$" + self._dollar_tag + "$"
+                self._dollar_tag = None
+                self._dollar_tail = ""
+                self._word = []
+                self._line_has_text = True
+                return
+            # "$" inside an identifier (a$b) does not open a quote
+            self._dollar_tag = "" if not (prev.isalnum() or prev in "_$") else None
+        else:
+            self._dollar_tag = None
+        self._end_word()
+        if ch == "\n":
+            if not self._line_has_text and not self._in_fence and self._first_word is not None:
+                # A blank line ends SQL that was not fenced or terminated
+                self._end_statement(terminated=False)
+                self._mode = _LINE_START
+                return
+            self._buf.append(ch)
+            self._line_has_text = False
+            return
+        self._buf.append(ch)
+        if ch.isspace():
+            return
+        self._line_has_text = True
+        if ch in "'\"`":
+            self._quote = ch
+        elif ch == "-" and prev == "-":
+            self._line_comment = True
+        elif ch == "*" and prev == "/":
+            self._block_comment = True
+            self._prev = ""
+        elif ch == ";":
+            self._end_statement(terminated=True)
+            if not self._in_fence:
+                self._mode = _LINE_START
+
+    def _end_word(self):
+        if not self._word:
+            return
+        word = "".join(self._word).lower()
+        self._word = []
+        if self._first_word is None:
+            if word in _LANGUAGE_TAGS:
+                # "```sql" or a bare "sql" line: a label, not part of the query
+                self._buf = []
+                return
+            self._first_word = word
+        elif word in _CLAUSE_WORDS:
+            self._has_clause = True
+
+    def _end_statement(self, terminated):
+        self._end_word()
+        text = "".join(self._buf).strip()
+        fenced = self._in_fence
+        if self._first_word in _STATEMENT_START and (
+            fenced or terminated or self._has_clause
+            # a whole answer like "SELECT NOW()", but not a sentence
+            or (not self._saw_prose and text[-1:] not in ".!?:")
+        ):
+            self.statements.append(Statement(text, fenced, terminated))
+            self.complete = True
+        elif self._first_word is not None and not fenced:
+            self._saw_prose = True
+        self._reset_statement()
+
+
+def split_statements(text):
+    """All statements in `text`, fenced ones only if there are any."""
+    extractor = SqlExtractor()
+    extractor.feed(text)
+    extractor.finish()
+    fenced = [s.text for s in extractor.statements if s.fenced]
+    return fenced or [s.text for s in extractor.statements]
+
+
+def extract_sql(text):
+    """The SQL in a model answer, statements separated by newlines ("" if none)."""
+    return "\n".join(split_statements(text))
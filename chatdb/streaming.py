@@ -0,0 +1,228 @@
+"""Incremental result fetching with server-side cursors.
+
+Instead of cursor.fetchall(), SELECT results are pulled in pages through a
+psycopg2 named cursor or a pymysql SSCursor, so only the rows that are actually
+shown are transferred and held in memory. A row cap and a byte cap stop runaway
+result sets.
+
+An open stream keeps its connection checked out (and, on PostgreSQL, a
+transaction open) until its last page is read. Streams nobody has read for
+RESULT_STREAM_IDLE_TIMEOUT seconds are closed by a background reaper, and when
+the stream pool is exhausted the longest-idle stream gives its connection up to
+the new query instead of making it wait.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+
+from chatdb.metrics import get_registry
+from chatdb.tracing import span
+
+
+_ROWS = get_registry().counter(
+    "chatdb_query_rows_total", "Rows returned, from the database or the result cache", ("db_type", "source"))
+
+
+def _setting(name, default):
+    return int(os.getenv(name, default))
+
+
+def open_server_cursor(conn, db_type, server_side=True):
+    if db_type == "postgresql" and server_side:
+        # Named cursors are declared on the server and fetched with FETCH FORWARD
+        return conn.cursor(name=f"chatdb_{uuid.uuid4().hex}")
+    if db_type == "mysql":
+        import pymysql.cursors
+        return conn.cursor(pymysql.cursors.SSCursor)
+    return conn.cursor()
+
+
+def estimate_row_bytes(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+def _close_stream(pool, conn, cursor, db_type, exhausted):
+    # An unbuffered MySQL result has to be drained before the connection can be
+    # reused, which is exactly the work we are trying to avoid, so drop it.
+    discard = db_type == "mysql" and not exhausted
+    if not discard:
+        try:
+            cursor.close()
+        except Exception:
+            discard = True
+    pool.release(conn, discard=discard)
+
+
+class _OpenStreams:
+    """Open streams by last use, so idle ones can be closed and their connections reused."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = weakref.WeakSet()
+        self._thread = None
+
+    def add(self, stream):
+        with self._lock:
+            self._streams.add(stream)
+            if self._thread is None and _setting("RESULT_STREAM_IDLE_TIMEOUT", 120) > 0:
+                self._thread = threading.Thread(target=self._run, name="chatdb-stream-reaper", daemon=True)
+                self._thread.start()
+
+    def discard(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def reclaim(self, pool):
+        """Close the longest-idle stream holding a connection of `pool`; True if one was closed."""
+        with self._lock:
+            candidates = sorted((s for s in self._streams if s._pool is pool), key=lambda s: s.last_used)
+        return any(stream._expire("reclaimed") for stream in candidates)
+
+    def reap(self, timeout):
+        cutoff = time.monotonic() - timeout
+        with self._lock:
+            idle = [s for s in self._streams if s.last_used < cutoff]
+        for stream in idle:
+            stream._expire("idle timeout")
+
+    def _run(self):
+        while True:
+            timeout = _setting("RESULT_STREAM_IDLE_TIMEOUT", 120)
+            if timeout <= 0:
+                with self._lock:
+                    self._thread = None
+                return
+            time.sleep(min(timeout / 4, 15))
+            self.reap(timeout)
+
+
+_open_streams = _OpenStreams()
+
+
+class ResultStream:
+    def __init__(self, pool, db_type, sql, page_size=None, max_rows=None, max_bytes=None, control=None,
+                 server_side=True):
+        self.db_type = db_type
+        self.sql = sql
+        self.page_size = page_size or _setting("RESULT_PAGE_SIZE", 500)
+        self.max_rows = max_rows or _setting("RESULT_MAX_ROWS", 100000)
+        self.max_bytes = max_bytes or _setting("RESULT_MAX_BYTES", 64 * 1024 * 1024)
+
+        self.columns = None
+        self.description = None
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.exhausted = False
+        self.truncated = None  # "row cap" / "byte cap" when a limit cut the result short
+        self.closed = False
+        self.last_used = time.monotonic()
+
+        self._pool = pool
+        # Held while a page is read, so the reaper never closes a stream mid-fetch
+        self._lock = threading.Lock()
+        if pool.exhausted():
+            # Usually every connection is held by a result nobody is reading any more
+            _open_streams.reclaim(pool)
+        self._conn = pool.acquire()
+        try:
+            if control is not None:
+                # Execution budget and cancel handle (chatdb.query_control.RunningQuery)
+                control.start(self._conn)
+            # PostgreSQL can only DECLARE a cursor for SELECT/VALUES; SHOW and EXPLAIN use a client cursor
+            self._cursor = open_server_cursor(self._conn, db_type, server_side)
+            with span("db.query"):
+                self._cursor.execute(sql)
+        except Exception:
+            pool.release(self._conn, discard=db_type == "mysql")
+            self.closed = True
+            raise
+        self._set_columns()
+        # Give the connection back even if the stream is dropped without close()
+        self._finalizer = weakref.finalize(
+            self, _close_stream, pool, self._conn, self._cursor, db_type, False
+        )
+        _open_streams.add(self)
+
+    def fetch_page(self, size=None):
+        with self._lock:
+            self.last_used = time.monotonic()
+            return self._fetch_page(size)
+
+    def _fetch_page(self, size):
+        if self.closed:
+            return []
+        size = min(size or self.page_size, self.max_rows - self.rows_fetched)
+        try:
+            with span("db.fetch") as stage:
+                rows = list(self._cursor.fetchmany(size))
+                stage.set(rows=len(rows))
+        except Exception:
+            self._close()
+            raise
+        self._set_columns()
+
+        self.rows_fetched += len(rows)
+        _ROWS.inc(len(rows), db_type=self.db_type, source="database")
+        self.bytes_fetched += sum(estimate_row_bytes(row) for row in rows)
+        if len(rows) < size:
+            self.exhausted = True
+            self._close()
+        elif self.rows_fetched >= self.max_rows:
+            self.truncated = "row cap"
+            self._close()
+        elif self.bytes_fetched >= self.max_bytes:
+            self.truncated = "byte cap"
+            self._close()
+        return rows
+
+    def __iter__(self):
+        while not self.closed:
+            rows = self.fetch_page()
+            if rows:
+                yield rows
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _expire(self, reason):
+        # Called by the reaper or a query that needs the connection; skipped while a page is read
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.closed:
+                return False
+            self.truncated = reason
+            self._close()
+            return True
+        finally:
+            self._lock.release()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        _open_streams.discard(self)
+        self._finalizer.detach()
+        _close_stream(self._pool, self._conn, self._cursor, self.db_type, self.exhausted)
+        self._conn = self._cursor = None
+
+    def _set_columns(self):
+        # psycopg2 only fills in description for named cursors after the first fetch
+        if self.columns is None and self._cursor.description:
+            self.description = self._cursor.description
+            self.columns = [desc[0] for desc in self.description]
+
+
+def stream_query(pool, db_type, sql, page_size=None, max_rows=None, max_bytes=None):
+    """Yield (columns, rows) batches, releasing the connection when done."""
+    stream = ResultStream(pool, db_type, sql, page_size, max_rows, max_bytes)
+    try:
+        for rows in stream:
+            yield stream.columns, rows
+    finally:
+        stream.close()
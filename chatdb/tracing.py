@@ -0,0 +1,348 @@
+"""Per-stage timings for the generate-and-execute pipeline.
+
+`start_trace()` opens a trace for one request and `span()` times a stage in it:
+
+    with start_trace("chat", provider="OLLAMA") as trace:
+        with span("llm", model="llama3"):
+            ...
+    trace.timings()   # [{"name", "depth", "ms", "attributes"}, ...] for a timings panel
+
+Spans nest through a context variable, so library code calls `span()` without
+being handed the trace, and outside a trace (or with TRACING=0) it does nothing.
+Work handed to a thread pool joins the trace when it is submitted through
+`contextvars.copy_context().run`. A span costs two clock reads and a list
+append, which stays far below 1% of a request that calls a model
+(benchmarks/bench_tracing.py measures it).
+
+Finished traces are appended to TRACE_EXPORT_PATH, if set, as OTLP/JSON lines:
+the OpenTelemetry file format that the collector's `otlpjsonfile` receiver
+reads, so they can be forwarded to Jaeger, Tempo and the like. Traces slower
+than TRACE_SLOW_MS are logged with their stages and thread id (for matching a
+`py-spy record --threads` profile), and with PROFILE_SAMPLE_RATE a fraction of
+traces runs under cProfile; the slow ones are saved to PROFILE_DIR as .prof
+files for pstats or snakeviz.
+"""
+
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from chatdb.metrics import get_registry
+
+
+logger = logging.getLogger(__name__)
+
+
+_current = contextvars.ContextVar("chatdb_span", default=None)
+# Span ids only need to be unique within a trace; a counter is cheaper than random bits
+_span_ids = itertools.count(random.getrandbits(62) + 1)
+
+
+def tracing_enabled():
+    return os.getenv("TRACING", "1") == "1"
+
+
+class _NoopSpan:
+    trace_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def timings(self):
+        return []
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = self.end_ns = None
+        self.error = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.trace.spans.append(self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    @property
+    def ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, name, attributes):
+        self.trace_id = random.getrandbits(128)
+        self.spans = []
+        self.root = Span(self, name, None, attributes)
+        # Spans are timed with perf_counter_ns; this anchors them to wall-clock time for export
+        self._wall_offset_ns = time.time_ns() - time.perf_counter_ns()
+        self._profiler = None
+
+    def __enter__(self):
+        self._profiler = _profiling.start()
+        self.root.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.root.__exit__(exc_type, exc, tb)
+        _finish(self)
+        return False
+
+    def set(self, **attributes):
+        self.root.set(**attributes)
+
+    @property
+    def ms(self):
+        return self.root.ms
+
+    def timings(self):
+        """Finished spans in start order, each with its nesting depth."""
+        depth = {self.root.parent_id: -1}
+        rows = []
+        for s in sorted(self.spans, key=lambda s: s.start_ns):
+            depth[s.span_id] = depth.get(s.parent_id, 0) + 1
+            rows.append({"name": s.name, "depth": depth[s.span_id], "ms": round(s.ms, 2),
+                         "attributes": s.attributes, "error": s.error})
+        return rows
+
+    def to_otlp(self):
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": os.getenv("TRACE_SERVICE_NAME", "chatdb")})},
+            "scopeSpans": [{"scope": {"name": "chatdb.tracing"}, "spans": [self._otlp_span(s) for s in self.spans]}],
+        }]}
+
+    def _otlp_span(self, s):
+        span = {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{s.span_id:016x}",
+            "name": s.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s.start_ns + self._wall_offset_ns),
+            "endTimeUnixNano": str(s.end_ns + self._wall_offset_ns),
+            "attributes": _otlp_attributes(s.attributes),
+            "status": {"code": 2, "message": s.error} if s.error else {},
+        }
+        if s.parent_id is not None:
+            span["parentSpanId"] = f"{s.parent_id:016x}"
+        return span
+
+
+def _otlp_attributes(attributes):
+    values = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            values.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            values.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            values.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            values.append({"key": key, "value": {"stringValue": str(value)}})
+    return values
+
+
+def start_trace(name, **attributes):
+    if not tracing_enabled():
+        return _NOOP
+    return Trace(name, attributes)
+
+
+def span(name, **attributes):
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def current_span():
+    """The innermost open span, to attach attributes to (a no-op outside a trace)."""
+    return _current.get() or _NOOP
+
+
+# ── Finished traces ──────────────────────────────────────────────────────
+
+_STAGE_SECONDS = get_registry().histogram("chatdb_stage_seconds", "Time spent per pipeline stage (span)", ("stage",))
+_STAGE_ERRORS = get_registry().counter("chatdb_stage_errors_total", "Spans that ended with an exception", ("stage",))
+
+
+def _record_stages(trace):
+    for s in trace.spans:
+        _STAGE_SECONDS.observe((s.end_ns - s.start_ns) / 1e9, stage=s.name)
+        if s.error is not None:
+            _STAGE_ERRORS.inc(stage=s.name)
+
+
+class _Exporter:
+    """Serializes and appends finished traces on a background thread."""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, path, trace):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="chatdb-trace-export", daemon=True)
+                    self._thread.start()
+        self._queue.put((path, trace))
+
+    def close(self, timeout=2):
+        # Writes what is queued and stops the writer; the next submit starts a new one
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Write whatever piled up in one go
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = {}
+            for item in batch:
+                if item is not None:
+                    path, trace = item
+                    lines.setdefault(path, []).append(json.dumps(trace.to_otlp(), separators=(",", ":")))
+            for path, chunk in lines.items():
+                try:
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.write("\n".join(chunk) + "\n")
+                except OSError as e:
+                    logger.warning("Trace export failed: %s", e)
+            if None in batch:
+                return
+
+
+class _Profiling:
+    """cProfile for a sample of traces; only one profiler can run at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._busy = False
+
+    def start(self):
+        rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        if not rate or random.random() >= rate:
+            return None
+        with self._lock:
+            if self._busy:
+                return None
+            self._busy = True
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (or a debugger) already owns the hook
+            self._release()
+            return None
+        return profiler
+
+    def stop(self, trace, slow):
+        profiler, trace._profiler = trace._profiler, None
+        if profiler is None:
+            return None
+        profiler.disable()
+        self._release()
+        if not slow:
+            return None
+        directory = os.getenv("PROFILE_DIR", ".chatdb_cache/profiles")
+        name = re.sub(r"\W+", "_", trace.root.name).strip("_")
+        path = os.path.join(directory, f"{name}-{trace.trace_id:032x}.prof")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning("Saving profile failed: %s", e)
+            return None
+        return path
+
+    def _release(self):
+        with self._lock:
+            self._busy = False
+
+
+_exporter = _Exporter()
+atexit.register(_exporter.close)
+_profiling = _Profiling()
+
+
+def _finish(trace):
+    slow_ms = float(os.getenv("TRACE_SLOW_MS", 0))
+    slow = bool(slow_ms) and trace.ms >= slow_ms
+    profile_path = _profiling.stop(trace, slow)
+    _record_stages(trace)
+    path = os.getenv("TRACE_EXPORT_PATH")
+    if path:
+        _exporter.submit(path, trace)
+    if slow:
+        stages = ", ".join(f"{s['name']} {s['ms']:.0f} ms" for s in trace.timings() if s["depth"] == 1)
+        logger.warning("Slow request %s %032x (thread %d): %.0f ms [%s]%s", trace.root.name, trace.trace_id,
+                       threading.get_native_id(), trace.ms, stages,
+                       f", profile in {profile_path}" if profile_path else "")
+
+
+def stage_stats():
+    errors = _STAGE_ERRORS.values()
+    stats = {}
+    for (stage,), values in _STAGE_SECONDS.series().items():
+        summary = _STAGE_SECONDS.summary(stage=stage)
+        stats[stage] = {
+            "count": values[-1],
+            "mean_ms": round(values[-2] / values[-1] * 1000, 2),
+            "p95_s": summary["p95_s"],
+            "errors": errors.get((stage,), 0),
+        }
+    return stats
+
+
+def flush_exports():
+    """Wait until finished traces have been written to TRACE_EXPORT_PATH."""
+    _exporter.close()
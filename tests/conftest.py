@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture
+def shop_db(tmp_path, monkeypatch):
+    """Settings for a fresh seeded SQLite shop database (benchmarks/fixture_db.py)."""
+    from fixture_db import build_fixture
+    from chatdb import engine
+
+    monkeypatch.setenv("DB_TYPE", "sqlite")
+    monkeypatch.setenv("DB_NAME", build_fixture(str(tmp_path / "shop.sqlite"), customers=20, orders=50))
+    monkeypatch.setenv("SCHEMA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("SQL_CACHE_PATH", "")
+    return engine.Settings.from_env("OLLAMA")
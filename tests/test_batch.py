@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from chatdb import batch, engine
+from mock_llm_server import MockLLMServer
+
+
+@pytest.fixture
+def mock_llm(shop_db, monkeypatch):
+    with MockLLMServer(default_answer="SELECT COUNT(*) FROM orders;") as server:
+        monkeypatch.setenv("OLLAMA_BASE_URL", server.url)
+        monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+        yield server
+
+
+@pytest.fixture
+def settings(mock_llm):
+    return engine.Settings.from_env("OLLAMA")
+
+
+def test_prompts_are_read_as_objects_or_plain_strings(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text('{"q": "how many orders", "key": "a"}\n\n"how many customers"\n{"q": "top products"}\n')
+    assert list(batch.read_prompts(str(path), "q", "key")) == [
+        {"id": "a", "prompt": "how many orders"},
+        {"id": 3, "prompt": "how many customers"},
+        {"id": 4, "prompt": "top products"},
+    ]
+
+
+def test_generated_sql_is_executed_with_timings(settings):
+    result = batch.run_one(settings, {"id": 1, "prompt": "how many orders (batch)"}, execute=True)
+    assert result["error"] is None
+    assert result["sql"] == "SELECT COUNT(*) FROM orders;"
+    assert (result["columns"], result["rows"], result["row_count"]) == (["COUNT(*)"], [[50]], 1)
+    assert {"generate_ms", "extract_ms", "execute_ms", "total_ms"} <= set(result["timings"])
+
+    result = batch.run_one(settings, {"id": 2, "prompt": "how many orders (not executed)"})
+    assert result["sql"] == "SELECT COUNT(*) FROM orders;" and result["rows"] is None
+
+
+def test_held_queries_need_force(settings, monkeypatch):
+    def plan(pool, db_type, sql):
+        return {"action": "confirm", "reason": "~5,000,000 estimated rows", "sql": sql}
+
+    monkeypatch.setattr(batch, "plan_query", plan)
+    item = {"id": 1, "prompt": "how many orders (held)"}
+    result = batch.run_one(settings, item, execute=True)
+    assert result["error"].startswith("Not executed: ~5,000,000 estimated rows")
+    assert result["rows"] is None and "execute_ms" not in result["timings"]
+    assert batch.run_one(settings, item, execute=True, force=True)["rows"] == [[50]]
+
+
+def test_failing_query_is_repaired_when_asked(settings, mock_llm):
+    broken = {"id": 1, "prompt": "how many orders (batch repair)"}
+    unrepaired = {"id": 2, "prompt": "how many orders (batch no repair)"}
+    mock_llm.answers = {item["prompt"]: "SELECT COUNT(*) FROM missing_orders;" for item in (broken, unrepaired)}
+
+    result = batch.run_one(settings, unrepaired, execute=True)
+    assert "missing_orders" in result["error"] and result["repairs"] is None
+
+    result = batch.run_one(settings, broken, execute=True, repair=True)
+    assert result["error"] is None and result["rows"] == [[50]]
+    assert result["sql"] == "SELECT COUNT(*) FROM orders;"
+    assert [attempt["outcome"] for attempt in result["repairs"]] == ["fixed"]
+    assert "repair_ms" in result["timings"]
+
+
+def test_provider_errors_are_recorded_per_prompt(shop_db, monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:9")
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+    result = batch.run_one(engine.Settings.from_env("OLLAMA"), {"id": 1, "prompt": "how many orders (offline)"})
+    assert result["error"] and result["sql"] is None
+    assert "total_ms" in result["timings"]
+
+
+def test_summary_counts_errors_and_stage_percentiles():
+    results = [{"error": None if i % 4 else "boom", "timings": {"total_ms": float(i)}} for i in range(1, 21)]
+    lines = batch.summarize(results).splitlines()
+    assert lines[0] == "20 prompts, 5 with errors"
+    assert lines[1].split() == ["total_ms", "p50", "11.0", "ms", "p95", "20.0", "ms"]
+
+
+def test_main_writes_results_in_input_order(settings, tmp_path, capsys):
+    pytest.importorskip("dotenv")
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text("\n".join(json.dumps(f"how many orders ({i})") for i in range(6)) + "\n")
+    output = tmp_path / "results.jsonl"
+    assert batch.main([str(prompts), "-o", str(output), "--concurrency", "3", "--execute", "--provider", "OLLAMA"]) == 0
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r["id"] for r in results] == [1, 2, 3, 4, 5, 6]
+    assert all(r["rows"] == [[50]] for r in results)
+    assert "6 prompts, 0 with errors" in capsys.readouterr().err
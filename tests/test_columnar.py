@@ -0,0 +1,68 @@
+from array import array
+
+import pytest
+
+from chatdb.columnar import FLOAT, INT, OBJECT, ColumnarResult
+
+# (name, type_code) as in cursor.description; pymysql codes: 8 BIGINT, 5 DOUBLE, 253 VARCHAR
+DESCRIPTION = [("id", 8), ("total", 5), ("name", 253)]
+
+
+def _result(rows):
+    return ColumnarResult.from_rows("mysql", DESCRIPTION, rows)
+
+
+def test_numbers_go_to_typed_buffers_with_null_masks():
+    result = _result([(1, 9.5, "a"), (2, None, "b"), (None, 1.25, None)])
+    assert result.kinds == [INT, FLOAT, OBJECT]
+    assert isinstance(result.buffers[0], array) and isinstance(result.buffers[2], list)
+    assert list(result) == [(1, 9.5, "a"), (2, None, "b"), (None, 1.25, None)]
+    assert result.column("total") == [9.5, None, 1.25]
+    assert len(result) == 3 and result[-1] == (None, 1.25, None)
+    with pytest.raises(IndexError):
+        result[3]
+    assert result.nbytes == 2 * (3 * 8 + 3) + 3 * 8
+
+
+def test_unknown_driver_types_stay_objects():
+    result = ColumnarResult.from_rows("sqlite", DESCRIPTION, [(1, 2.0, "x")])
+    assert result.kinds == [OBJECT, OBJECT, OBJECT]
+    assert list(result) == [(1, 2.0, "x")]
+
+
+def test_value_that_does_not_fit_demotes_the_column():
+    result = _result([(1, 1.0, "a"), (None, 2.0, "b")])
+    result.extend([(2 ** 64 - 1, 3.0, "c")])  # unsigned BIGINT beyond int64
+    assert result.kinds[0] == OBJECT and result.nulls[0] is None
+    assert result.column("id") == [1, None, 2 ** 64 - 1]
+    assert result.kinds[1] == FLOAT
+
+
+def test_slices_are_columnar_too():
+    result = _result([(i, i / 2, str(i)) for i in range(10)])
+    page = result[2:8:2]
+    assert isinstance(page, ColumnarResult) and len(page) == 3
+    assert list(page) == [(2, 1.0, "2"), (4, 2.0, "4"), (6, 3.0, "6")]
+
+
+def test_rows_load_while_a_column_is_exported():
+    result = _result([(1, 1.5, "a"), (None, 2.5, "b")])
+    # What to_arrow() does: share the buffers instead of copying them
+    ids, id_nulls = memoryview(result.buffers[0]), memoryview(result.nulls[0])
+    result.extend([(3, 3.5, "c")])
+    assert result.column("id") == [1, None, 3]
+    assert list(result) == [(1, 1.5, "a"), (None, 2.5, "b"), (3, 3.5, "c")]
+    # The exported view keeps the rows it was taken from
+    assert (ids.tolist(), id_nulls.tolist()) == ([1, 0], [0, 1])
+    ids.release()
+    id_nulls.release()
+
+
+def test_more_rows_after_to_arrow():
+    pytest.importorskip("pyarrow")
+    result = _result([(1, 1.5, "a"), (None, 2.5, "b")])
+    table = result.to_arrow()
+    result.extend([(3, 3.5, "c")])
+    assert table.column("id").to_pylist() == [1, None]
+    assert table.num_rows == 2
+    assert result.to_arrow().column("id").to_pylist() == [1, None, 3]
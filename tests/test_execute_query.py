@@ -0,0 +1,59 @@
+import pytest
+
+from chatdb import engine
+from chatdb.result_cache import get_result_cache, statement_kind
+
+
+@pytest.mark.parametrize("sql, kind", [
+    ("SELECT 1", "select"),
+    ("-- users\nSELECT * FROM customers", "select"),
+    ("/* top */ SELECT 1;", "select"),
+    ("WITH c AS (SELECT id FROM customers) SELECT COUNT(*) FROM c", "select"),
+    ("WITH c AS (SELECT 1) SELECT * FROM c FOR UPDATE", "select"),
+    ("WITH old AS (SELECT id FROM orders) DELETE FROM orders WHERE id IN (SELECT id FROM old)", "delete"),
+    ('WITH x AS (SELECT 1) UPDATE "orders" SET status = \'x\'', "update"),
+    ("  insert into orders values (1)", "insert"),
+    ("SELECT 'delete from t'", "select"),
+    ("", ""),
+])
+def test_statement_kind(sql, kind):
+    assert statement_kind(sql) == kind
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH c AS (SELECT id FROM customers) SELECT COUNT(*) FROM c",
+    "-- users\nSELECT COUNT(*) FROM customers",
+    "/* top */ SELECT COUNT(*) FROM customers;",
+])
+def test_row_returning_statements_return_rows(shop_db, sql):
+    columns, data, error, stream = engine.execute_query(shop_db, sql)
+    assert error is None
+    assert stream is None
+    assert not isinstance(data, str)
+    assert list(data) == [(20,)]
+    assert len(columns) == 1
+
+
+def test_commented_select_does_not_clear_result_cache(shop_db):
+    cache = get_result_cache()
+    cached_sql = "SELECT name FROM products ORDER BY id"
+    engine.execute_query(shop_db, cached_sql)
+    assert cache.get(shop_db.pool_key(), cached_sql) is not None
+
+    engine.execute_query(shop_db, "-- users\nSELECT COUNT(*) FROM customers")
+    engine.execute_query(shop_db, "WITH c AS (SELECT 1) SELECT * FROM c")
+    assert cache.get(shop_db.pool_key(), cached_sql) is not None
+
+
+def test_cte_write_is_committed_and_invalidates(shop_db):
+    cache = get_result_cache()
+    count_sql = "SELECT COUNT(*) FROM orders"
+    _, before, _, _ = engine.execute_query(shop_db, count_sql)
+    _, message, error, _ = engine.execute_query(
+        shop_db, "WITH old AS (SELECT id FROM orders ORDER BY id LIMIT 5) DELETE FROM orders "
+                 "WHERE id IN (SELECT id FROM old)")
+    assert error is None
+    assert message == "Query executed successfully."
+    assert cache.get(shop_db.pool_key(), count_sql) is None
+    _, after, _, _ = engine.execute_query(shop_db, count_sql)
+    assert list(after)[0][0] == list(before)[0][0] - 5
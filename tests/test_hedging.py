@@ -0,0 +1,97 @@
+import pytest
+
+from chatdb import llm
+from chatdb.hedging import HedgedStream, hedge_delay, hedge_stats
+from chatdb.llm import LLMRunner, ProviderConfig
+from mock_llm_server import MockLLMServer
+
+
+def test_hedge_delay_is_an_exact_percentile_of_recent_samples(monkeypatch):
+    monkeypatch.setenv("HEDGE_MIN_SAMPLES", "20")
+    monkeypatch.setenv("HEDGE_AFTER_DEFAULT", "3")
+    for ms in range(1, 20):
+        llm._remember_first_token("TEST_DELAY", ms / 1000)
+    assert hedge_delay("TEST_DELAY") == 3.0
+    for ms in range(20, 101):
+        llm._remember_first_token("TEST_DELAY", ms / 1000)
+
+    for setting, expected in (("p50", 0.05), ("p95", 0.095), ("p99", 0.099)):
+        monkeypatch.setenv("HEDGE_AFTER", setting)
+        assert hedge_delay("TEST_DELAY") == expected
+    monkeypatch.setenv("HEDGE_AFTER", "0.25")
+    assert hedge_delay("TEST_DELAY") == 0.25
+
+
+def test_window_keeps_only_recent_samples(monkeypatch):
+    monkeypatch.setenv("HEDGE_WINDOW", "10")
+    monkeypatch.setenv("HEDGE_MIN_SAMPLES", "5")
+    for _ in range(50):
+        llm._remember_first_token("TEST_WINDOW", 5.0)
+    for _ in range(10):
+        llm._remember_first_token("TEST_WINDOW", 0.2)
+    assert llm.recent_first_tokens("TEST_WINDOW") == [0.2] * 10
+    assert hedge_delay("TEST_WINDOW") == 0.2
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+    answer = "SELECT COUNT(*) FROM orders; -- and a long explanation of the query follows"
+    with MockLLMServer(first_token_ms=600, token_ms=20, default_answer=answer) as slow, \
+            MockLLMServer(token_ms=20, default_answer=answer) as fast:
+        yield LLMRunner(), ProviderConfig("OLLAMA", "slow", base_url=slow.url), \
+            ProviderConfig("OLLAMA", "fast", base_url=fast.url)
+
+
+def _hedged(providers, delay):
+    runner, slow, fast = providers
+    return HedgedStream(runner, slow, fast, "system", "how many orders", lambda text: "SELECT" in text, delay)
+
+
+def test_secondary_wins_when_primary_is_slow(providers):
+    before = hedge_stats()
+    stream = _hedged(providers, delay=0.1)
+    for _ in stream:
+        pass
+    after = hedge_stats()
+    assert stream.hedged and stream.text.startswith("SELECT COUNT(*)")
+    assert after["requests"] == before["requests"] + 1
+    assert after["hedged"] == before["hedged"] + 1
+    assert after["wins"]["OLLAMA"]["secondary"] == before["wins"].get("OLLAMA", {}).get("secondary", 0) + 1
+
+
+def test_early_stop_is_counted_as_a_primary_answer(providers):
+    before = hedge_stats()
+    stream = _hedged(providers, delay=30)
+    for piece in stream:
+        if "orders;" in "".join(stream.parts):
+            # As appV4 does with LLM_STOP_AFTER_STATEMENT
+            stream.close()
+            break
+    assert stream.winner == "OLLAMA" and not stream.hedged
+    assert stream.text.startswith("SELECT COUNT(*) FROM orders;")
+    after = hedge_stats()
+    assert after["requests"] == before["requests"] + 1
+    assert after["cancelled"] == before["cancelled"]
+    # The caller's cleanup after the fact changes nothing
+    stream.cancel()
+    assert hedge_stats() == after
+
+
+def test_abandoned_race_is_not_a_win(providers):
+    before = hedge_stats()
+    stream = _hedged(providers, delay=0.1)
+    pieces = iter(stream)
+    while not stream.hedged:
+        next(pieces)
+    # A rerun supersedes the request while both providers are still running
+    stream.cancel()
+    pieces.close()
+    after = hedge_stats()
+    assert stream.winner is None
+    assert after["requests"] == before["requests"]
+    assert after["wins"] == before["wins"]
+    assert after["extra_tokens"] == before["extra_tokens"]
+    assert after["cancelled"] == before["cancelled"] + 1
+    stream.close()
+    assert hedge_stats() == after
@@ -0,0 +1,108 @@
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from chatdb import llm
+from chatdb.llm import LLMRunner, LLMTimeout, ProviderConfig, Timeouts
+from mock_llm_server import MockLLMServer
+
+ANSWER = "SELECT COUNT(*) FROM orders;"
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+    with MockLLMServer(default_answer=ANSWER) as server:
+        yield server
+
+
+def _ollama(server):
+    return ProviderConfig("OLLAMA", "mock", base_url=server.url)
+
+
+def _outcomes(provider):
+    return {outcome: llm._REQUESTS.values().get((provider, outcome), 0) for outcome in llm._OUTCOMES}
+
+
+def test_stream_yields_text_as_it_arrives(mock_llm):
+    mock_llm.token_ms = 50
+    before = _outcomes("OLLAMA")
+    stream = LLMRunner().stream(_ollama(mock_llm), "system", "how many orders", poll_interval=0.01)
+    pieces = [piece for piece in stream if piece]
+    assert pieces == ["SELECT ", "COUNT(*) ", "FROM ", "orders;"]
+    assert stream.text == ANSWER and stream.done()
+    assert _outcomes("OLLAMA")["ok"] == before["ok"] + 1
+    assert llm.recent_first_tokens("OLLAMA")
+
+
+@pytest.mark.parametrize("provider, path", [("OPENAI", "/v1"), ("DEEPSEEK", "/v1"), ("GEMINI", "")])
+def test_every_provider_streams_through_the_runner(mock_llm, provider, path):
+    mock_llm.token_ms = 20
+    config = ProviderConfig(provider, "mock", api_key="test", base_url=mock_llm.url + path)
+    stream = LLMRunner().stream(config, "system", "how many orders", poll_interval=0.01)
+    assert len([piece for piece in stream if piece]) == 4
+    assert stream.text == ANSWER
+
+
+def test_silent_provider_times_out_at_the_first_token(mock_llm):
+    mock_llm.first_token_ms = 1000
+    before = _outcomes("OLLAMA")
+    started = time.monotonic()
+    with pytest.raises(LLMTimeout, match="no output within 0.2s"):
+        LLMRunner().generate(_ollama(mock_llm), "system", "how many orders", Timeouts(first_token=0.2))
+    assert time.monotonic() - started < 0.8
+    assert _outcomes("OLLAMA")["timeout"] == before["timeout"] + 1
+
+
+def test_slow_answer_times_out_in_total(mock_llm):
+    mock_llm.token_ms = 200
+    with pytest.raises(LLMTimeout, match="did not finish within 0.3s"):
+        LLMRunner().generate(_ollama(mock_llm), "system", "how many orders", Timeouts(total=0.3))
+
+
+def test_cancelled_stream_stops_the_request(mock_llm):
+    mock_llm.first_token_ms = 1000
+    before = _outcomes("OLLAMA")
+    stream = LLMRunner().stream(_ollama(mock_llm), "system", "how many orders", poll_interval=0.01)
+    while not mock_llm.received:
+        time.sleep(0.01)
+    stream.cancel()
+    assert list(stream) == []
+    with pytest.raises(CancelledError):
+        stream.future.result()
+    deadline = time.monotonic() + 2
+    while _outcomes("OLLAMA")["cancelled"] == before["cancelled"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert _outcomes("OLLAMA")["cancelled"] == before["cancelled"] + 1
+
+
+@pytest.mark.parametrize("limit, serial", [(1, True), (2, False)])
+def test_concurrency_is_limited(mock_llm, limit, serial):
+    mock_llm.first_token_ms = 300
+    runner = LLMRunner(max_concurrency=limit)
+    started = time.monotonic()
+    futures = [runner.submit(_ollama(mock_llm), "system", f"question {i}") for i in range(2)]
+    assert [f.result() for f in futures] == [ANSWER, ANSWER]
+    assert (time.monotonic() - started >= 0.6) == serial
+
+
+def test_cold_and_warm_first_tokens_are_told_apart(mock_llm):
+    mock_llm.load_ms = 400
+    runner = LLMRunner()
+    cold = llm._FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="cold")["count"]
+    warm = llm._FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="warm")["count"]
+    runner.generate(_ollama(mock_llm), "system", "how many orders")
+    runner.generate(_ollama(mock_llm), "system", "how many orders")
+    assert llm._FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="cold")["count"] == cold + 1
+    assert llm._FIRST_TOKEN_BY_START.summary(provider="OLLAMA", start="warm")["count"] == warm + 1
+
+
+def test_ollama_prefix_served_from_its_cache():
+    system_prompt = "x" * 4000  # about 1000 tokens
+    usage = llm._ollama_usage({"prompt_eval_count": 12, "eval_count": 7}, system_prompt, "how many orders")
+    assert usage["out"] == 7 and usage["load_s"] is None
+    assert usage["in"] == 1003 and usage["cached"] == 1003 - 12
+    # Evaluating the whole prompt means nothing was cached
+    usage = llm._ollama_usage({"prompt_eval_count": 1003, "load_duration": 2e9}, system_prompt, "how many orders")
+    assert (usage["in"], usage["cached"], usage["load_s"]) == (1003, None, 2.0)
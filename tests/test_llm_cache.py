@@ -0,0 +1,78 @@
+import time
+
+from chatdb.llm_cache import SQLCache
+
+SCOPE = ("OLLAMA", "llama3", "sqlite", "schema-v1")
+
+
+def test_exact_hit_ignores_case_spacing_and_trailing_punctuation():
+    cache = SQLCache()
+    cache.put(*SCOPE, "How many orders?", "SELECT COUNT(*) FROM orders;")
+    assert cache.get(*SCOPE, "  how many   ORDERS ") == "SELECT COUNT(*) FROM orders;"
+    assert cache.get(*SCOPE, "how many customers") is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_entries_are_scoped_to_model_and_schema():
+    cache = SQLCache()
+    cache.put(*SCOPE, "how many orders", "SELECT COUNT(*) FROM orders;")
+    assert cache.get("OLLAMA", "llama3", "sqlite", "schema-v2", "how many orders") is None
+    assert cache.get("OPENAI", "llama3", "sqlite", "schema-v1", "how many orders") is None
+    assert cache.get("OLLAMA", "mistral", "sqlite", "schema-v1", "how many orders") is None
+
+
+def test_similar_prompt_hits_only_when_enabled_and_numbers_match():
+    question = "total revenue per customer in the last 7 days"
+    exact_only = SQLCache()
+    similar = SQLCache(similarity_threshold=0.8)
+    for cache in (exact_only, similar):
+        cache.put(*SCOPE, question, "SELECT ... 7 days")
+    rephrased = "total revenue for each customer in the last 7 days"
+    assert exact_only.get(*SCOPE, rephrased) is None
+    assert similar.get(*SCOPE, rephrased) == "SELECT ... 7 days"
+    assert similar.stats()["similar_hits"] == 1
+    # Alike as n-grams, but a different number needs different SQL
+    assert similar.get(*SCOPE, "total revenue per customer in the last 30 days") is None
+    assert similar.get("OLLAMA", "llama3", "sqlite", "schema-v2", rephrased) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SQLCache(max_entries=2)
+    cache.put(*SCOPE, "first", "SELECT 1;")
+    cache.put(*SCOPE, "second", "SELECT 2;")
+    assert cache.get(*SCOPE, "first") == "SELECT 1;"
+    cache.put(*SCOPE, "third", "SELECT 3;")
+    assert cache.get(*SCOPE, "second") is None
+    assert cache.get(*SCOPE, "first") == "SELECT 1;"
+    assert cache.get(*SCOPE, "third") == "SELECT 3;"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_dropped():
+    cache = SQLCache(ttl=0.05, similarity_threshold=0.5)
+    cache.put(*SCOPE, "how many orders", "SELECT COUNT(*) FROM orders;")
+    cache.put(*SCOPE, "how many customers", "SELECT COUNT(*) FROM customers;")
+    time.sleep(0.1)
+    assert cache.get(*SCOPE, "how many orders") is None
+    # The similarity scan drops the other one
+    assert cache.get(*SCOPE, "how many customers are there") is None
+    stats = cache.stats()
+    assert (stats["expirations"], stats["entries"]) == (2, 0)
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache" / "llm_cache.sqlite")
+    cache = SQLCache(path, max_entries=2)
+    cache.put(*SCOPE, "first", "SELECT 1;")
+    cache.put(*SCOPE, "second", "SELECT 2;")
+    cache.put(*SCOPE, "third", "SELECT 3;")
+    assert cache.get(*SCOPE, "second") == "SELECT 2;"
+
+    reopened = SQLCache(path, max_entries=1)
+    assert reopened.stats()["persistent"]
+    # Only the most recently used entries are loaded back
+    assert reopened.get(*SCOPE, "second") == "SELECT 2;"
+    assert reopened.get(*SCOPE, "third") is None
+    reopened.clear()
+    assert SQLCache(path).get(*SCOPE, "second") is None
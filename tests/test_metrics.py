@@ -0,0 +1,49 @@
+import threading
+
+from chatdb.metrics import Counter, Histogram, Registry
+
+
+def _in_threads(n, fn):
+    for _ in range(n):
+        thread = threading.Thread(target=fn)
+        thread.start()
+        thread.join()
+
+
+def test_exited_threads_do_not_leave_shards():
+    counter = Counter("test_requests_total", "help", ("kind",))
+    histogram = Histogram("test_seconds", "help", ("stage",))
+
+    def record():
+        counter.inc(kind="a")
+        counter.inc(2, kind="b")
+        histogram.observe(0.02, stage="llm")
+
+    _in_threads(200, record)
+    assert len(counter._shards) == 0
+    assert len(histogram._shards) == 0
+    assert counter.values() == {("a",): 200, ("b",): 400}
+    assert histogram.summary(stage="llm")["count"] == 200
+
+
+def test_live_and_exited_threads_are_summed():
+    counter = Counter("test_mixed_total", "help")
+    counter.inc()
+    _in_threads(3, lambda: counter.inc(5))
+    counter.inc()
+    assert counter.value() == 17
+    assert len(counter._shards) == 1
+
+
+def test_base_is_not_changed_by_reading():
+    histogram = Histogram("test_read_seconds", "help")
+    _in_threads(2, lambda: histogram.observe(1))
+    histogram.series()[()][-1] += 100
+    assert histogram.summary()["count"] == 2
+
+
+def test_exposition_after_threads_exit():
+    registry = Registry()
+    counter = registry.counter("test_exposed_total", "Exposed", ("kind",))
+    _in_threads(5, lambda: counter.inc(kind="x"))
+    assert 'test_exposed_total{kind="x"} 5' in registry.exposition()
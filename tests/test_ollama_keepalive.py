@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from chatdb.llm import LLMRunner, ProviderConfig
+from chatdb.server import ApiServer
+from mock_llm_server import MockLLMServer
+
+
+@pytest.fixture
+def mock_ollama(monkeypatch):
+    with MockLLMServer() as server:
+        monkeypatch.setenv("OLLAMA_BASE_URL", server.url)
+        monkeypatch.setenv("OLLAMA_KEEP_ALIVE", "30m")
+        monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+        yield server
+
+
+def _config(server, model="mock"):
+    return ProviderConfig("OLLAMA", model, base_url=server.url)
+
+
+def test_keep_alive_is_sent_on_every_request(mock_ollama):
+    runner = LLMRunner()
+    for question in ("how many customers", "how many orders", "how many customers"):
+        runner.generate(_config(mock_ollama), "system", question)
+    runner.preload(_config(mock_ollama)).result(timeout=10)
+
+    assert [path for _, path, _ in mock_ollama.received] == ["/api/chat"] * 3 + ["/api/generate"]
+    assert all(body["keep_alive"] == "30m" for _, _, body in mock_ollama.received)
+
+
+def test_heartbeat_fires_at_the_interval(mock_ollama, monkeypatch):
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0.2")
+    runner = LLMRunner()
+    runner.generate(_config(mock_ollama), "system", "how many customers")
+    time.sleep(1.1)
+    runner.stop_heartbeat()
+
+    pings = [(at, body) for at, path, body in mock_ollama.received if path == "/api/generate"]
+    assert 4 <= len(pings) <= 6
+    assert all(body == {"model": "mock", "keep_alive": "30m"} for _, body in pings)
+    gaps = [b[0] - a[0] for a, b in zip(pings, pings[1:])]
+    assert all(0.15 < gap < 0.35 for gap in gaps)
+    assert runner.ollama_stats()["heartbeat"]
+
+
+def test_heartbeat_pauses_when_idle(mock_ollama, monkeypatch):
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0.1")
+    monkeypatch.setenv("OLLAMA_HEARTBEAT_IDLE", "0.25")
+    runner = LLMRunner()
+    runner.generate(_config(mock_ollama), "system", "how many customers")
+    time.sleep(0.8)
+    runner.stop_heartbeat()
+
+    pings = [at for at, path, _ in mock_ollama.received if path == "/api/generate"]
+    # Pings stop once the model has been unused for longer than OLLAMA_HEARTBEAT_IDLE
+    assert 1 <= len(pings) <= 3
+    assert pings[-1] - mock_ollama.received[0][0] < 0.4
+
+
+def test_preload_once_per_config(mock_ollama):
+    runner = LLMRunner()
+    assert runner.preload(ProviderConfig("OPENAI", "gpt")) is None
+    runner.preload(_config(mock_ollama)).result(timeout=10)
+    assert runner.preload(_config(mock_ollama)) is None
+
+    assert mock_ollama.loads == 1
+    assert [path for _, path, _ in mock_ollama.received] == ["/api/generate"]
+    assert runner.ollama_stats()["last_preload_s"] is not None
+
+
+def test_api_server_preloads_at_startup(shop_db, mock_ollama, monkeypatch):
+    monkeypatch.setenv("AI_PROVIDER", "OLLAMA")
+    monkeypatch.setenv("OLLAMA_PRELOAD", "1")
+    # A model name of its own, as the process-wide runner preloads each configuration once
+    monkeypatch.setenv("OLLAMA_MODEL", "mock-startup")
+    server = ApiServer(workers=1)
+
+    async def lifespan():
+        messages = asyncio.Queue()
+        sent = []
+        await messages.put({"type": "lifespan.startup"})
+        await messages.put({"type": "lifespan.shutdown"})
+
+        async def send(message):
+            sent.append((message["type"], len(mock_ollama.received)))
+
+        await server(dict(type="lifespan"), messages.get, send)
+        return sent
+
+    sent = asyncio.run(lifespan())
+    # The model was loaded before the server reported itself started
+    assert sent[0] == ("lifespan.startup.complete", 1)
+    assert [(path, body) for _, path, body in mock_ollama.received] == [
+        ("/api/generate", {"model": "mock-startup", "keep_alive": "30m"})]
+    assert mock_ollama.loads == 1
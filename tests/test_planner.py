@@ -0,0 +1,88 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+from chatdb.planner import Guardrails, plan_query
+
+
+class _PlanCursor:
+    """Answers EXPLAIN (FORMAT JSON) with a fixed PostgreSQL plan."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        self.conn.explained.append(sql)
+
+    def fetchone(self):
+        return [json.dumps([{"Plan": {"Node Type": "Seq Scan", "Relation Name": "orders",
+                                      "Plan Rows": self.conn.rows, "Total Cost": 1234.5}}])]
+
+    def close(self):
+        pass
+
+
+class _PlanConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.explained = []
+
+    def cursor(self):
+        return _PlanCursor(self)
+
+    def rollback(self):
+        pass
+
+
+class _Pool:
+    def __init__(self, rows):
+        self.conn = _PlanConnection(rows)
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders",
+    "-- all orders\nSELECT * FROM orders",
+    "/* top */ SELECT * FROM orders;",
+    "WITH o AS (SELECT * FROM orders) SELECT * FROM o",
+])
+def test_commented_and_cte_selects_are_explained_and_limited(sql):
+    pool = _Pool(rows=50000)
+    summary = plan_query(pool, "postgresql", sql, Guardrails(limit_rows=10000, auto_limit=100,
+                                                              confirm_rows=10**9, confirm_cost=10**9))
+    assert len(pool.conn.explained) == 1
+    assert summary["full_scans"] == ["orders"]
+    assert summary["action"] == "limit"
+    assert summary["sql"].rstrip().endswith("LIMIT 100;")
+
+
+def test_writes_are_explained_but_never_limited():
+    pool = _Pool(rows=50000)
+    summary = plan_query(pool, "postgresql", "-- cleanup\nDELETE FROM orders",
+                         Guardrails(limit_rows=10000, confirm_rows=10**9, confirm_cost=10**9))
+    assert pool.conn.explained
+    assert summary["action"] == "run"
+
+
+def test_non_explainable_statements_are_run_as_is():
+    pool = _Pool(rows=1)
+    summary = plan_query(pool, "postgresql", "/* x */ CREATE TABLE t (id int)")
+    assert not pool.conn.explained
+    assert summary["action"] == "run"
+
+
+def test_zero_thresholds_can_be_set_explicitly(monkeypatch):
+    monkeypatch.setenv("PLAN_CONFIRM_ROWS", "1000000")
+    guardrails = Guardrails(limit_rows=0, confirm_rows=0, confirm_cost=0)
+    assert (guardrails.limit_rows, guardrails.confirm_rows, guardrails.confirm_cost) == (0, 0, 0)
+    summary = plan_query(_Pool(rows=1), "postgresql", "SELECT 1 FROM orders", guardrails)
+    assert summary["action"] == "confirm"
+
+
+def test_missing_thresholds_fall_back_to_settings(monkeypatch):
+    monkeypatch.setenv("PLAN_LIMIT_ROWS", "42")
+    assert Guardrails().limit_rows == 42
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from chatdb.pool import ConnectionPool, PoolTimeout
+
+
+class _Connection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.rollbacks = 0
+        self.broken = False
+
+    def ping(self, reconnect=False):
+        if self.broken:
+            raise ConnectionError("server has gone away")
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError("server has gone away")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class _Database:
+    def __init__(self):
+        self.opened = []
+        self.down = False
+
+    def connect(self):
+        if self.down:
+            raise ConnectionError("connection refused")
+        conn = _Connection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def _pool(db, **options):
+    options = {"min_size": 0, "max_size": 2, "idle_timeout": 0, "checkout_timeout": 0.2,
+               "health_check_interval": 0, **options}
+    return ConnectionPool(db.connect, **options)
+
+
+def test_min_size_connections_are_opened_up_front():
+    db = _Database()
+    pool = _pool(db, min_size=2, max_size=3)
+    assert len(db.opened) == 2
+    assert pool.stats()["idle"] == 2
+    with pool.connection() as conn:
+        assert conn in db.opened
+    assert len(db.opened) == 2 and pool.stats()["hits"] == 1
+
+
+def test_unreachable_database_reports_on_checkout():
+    db = _Database()
+    db.down = True
+    pool = _pool(db, min_size=2)
+    assert pool.stats()["size"] == 0
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    db.down = False
+    with pool.connection():
+        pass
+    assert pool.stats()["size"] == 1
+
+
+def test_released_connection_is_rolled_back_and_reused():
+    db = _Database()
+    pool = _pool(db)
+    with pool.connection() as first:
+        pass
+    assert first.rollbacks == 1
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.stats()
+    assert (stats["misses"], stats["hits"], stats["in_use"], stats["idle"]) == (1, 1, 0, 1)
+
+
+def test_broken_connections_are_discarded():
+    db = _Database()
+    pool = _pool(db)
+    with pool.connection() as conn:
+        pass
+    # Dropped by the server while idle: the checkout ping fails and a new one is opened
+    conn.broken = True
+    with pool.connection() as replacement:
+        assert replacement is not conn
+    assert conn.closed and pool.stats()["failed_health_checks"] == 1
+
+    # Broken while checked out: the rollback on release fails
+    conn = pool.acquire()
+    assert conn is replacement
+    conn.broken = True
+    pool.release(conn)
+    assert conn.closed
+    assert pool.stats()["size"] == 0
+
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+    assert conn.closed and pool.stats()["size"] == 0
+
+
+def test_exhausted_pool_waits_then_times_out():
+    db = _Database()
+    pool = _pool(db)
+    first, second = pool.acquire(), pool.acquire()
+    assert pool.exhausted()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.2
+    assert pool.stats()["timeouts"] == 1
+
+    # A release wakes up a waiting checkout
+    threading.Timer(0.05, pool.release, (first,)).start()
+    assert pool.acquire() is first
+    assert len(db.opened) == 2
+    pool.release(first)
+    pool.release(second)
+    assert not pool.exhausted()
+
+
+def test_idle_connections_expire_down_to_min_size():
+    db = _Database()
+    pool = _pool(db, min_size=1, max_size=3, idle_timeout=0.05)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    time.sleep(0.1)
+    pool.release(pool.acquire())
+    stats = pool.stats()
+    assert (stats["size"], stats["evictions"]) == (1, 2)
+    assert sum(conn.closed for conn in conns) == 2
@@ -0,0 +1,59 @@
+import sqlite3
+
+from chatdb import engine
+from chatdb.prompt_prefix import PrefixCache, PromptPrefix, prefix_key
+from mock_llm_server import MockLLMServer
+
+
+def test_prefix_key_and_tokens_follow_the_text():
+    prefix = PromptPrefix("You write SQLite queries." * 8, schema_tokens=5)
+    assert prefix.key == prefix_key("You write SQLite queries." * 8) and len(prefix.key) == 16
+    assert prefix.key != prefix_key("You write MySQL queries." * 8)
+    assert (prefix.tokens, prefix.schema_tokens) == (50, 5)
+
+
+def test_prefixes_are_rendered_once_per_key():
+    cache = PrefixCache(max_entries=2)
+    renders = []
+
+    def build(text):
+        def render():
+            renders.append(text)
+            return PromptPrefix(text)
+        return render
+
+    first, cached = cache.get("a", build("schema a"))
+    assert not cached
+    again, cached = cache.get("a", build("schema a"))
+    assert cached and again is first
+    cache.get("b", build("schema b"))
+    cache.get("a", build("schema a"))
+    cache.get("c", build("schema c"))  # evicts b, the least recently used
+    cache.get("b", build("schema b"))
+    assert renders == ["schema a", "schema b", "schema c", "schema b"]
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["builds"], stats["hit_rate"]) == (2, 2, 4, 0.333)
+    assert stats["last_prefix"] == prefix_key("schema b")
+
+
+def test_every_question_gets_the_same_system_prompt(shop_db, monkeypatch):
+    monkeypatch.setenv("SCHEMA_REFRESH_INTERVAL", "0")
+    with MockLLMServer(default_answer="SELECT COUNT(*) FROM orders;") as llm:
+        monkeypatch.setenv("OLLAMA_BASE_URL", llm.url)
+        monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+        settings = engine.Settings.from_env("OLLAMA")
+        for question in ("how many orders (prefix)", "how many customers (prefix)"):
+            engine.generate_sql(settings, question)
+
+        conn = sqlite3.connect(shop_db.db_name)
+        conn.execute("ALTER TABLE customers ADD COLUMN loyalty_tier TEXT")
+        conn.commit()
+        conn.close()
+        engine.generate_sql(settings, "how many products (prefix)")
+
+    systems = [body["messages"][0]["content"] for _, path, body in llm.received if path == "/api/chat"]
+    assert len(systems) == 3
+    # Byte for byte, so the provider can serve it from its prompt cache
+    assert systems[0] == systems[1] and "orders(" in systems[0]
+    # A schema change renders a new one
+    assert systems[2] != systems[0] and "loyalty_tier" in systems[2]
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from chatdb.llm import ProviderConfig, Timeouts
+from chatdb.providers import ProviderRegistry
+
+OLLAMA = ProviderConfig("OLLAMA", "llama3", base_url="http://127.0.0.1:11434/")
+
+
+def _get(registry, *configs):
+    async def scenario():
+        return [await registry.get(config, Timeouts(connect=2, total=30)) for config in configs]
+    return asyncio.run(scenario())
+
+
+def test_client_is_built_once_per_configuration():
+    registry = ProviderRegistry()
+    first, second = _get(registry, OLLAMA, ProviderConfig("OLLAMA", "llama3", base_url="http://127.0.0.1:11434/"))
+    assert first is second and isinstance(first, httpx.AsyncClient)
+    assert str(first.base_url) == "http://127.0.0.1:11434"
+    stats = registry.stats()
+    assert (stats["builds"], stats["reuses"], stats["invalidations"]) == (1, 1, 0)
+
+
+def test_changed_configuration_replaces_the_client():
+    registry = ProviderRegistry()
+    old, new = _get(registry, OLLAMA, ProviderConfig("OLLAMA", "mistral", base_url="http://127.0.0.1:11434"))
+    assert new is not old and old.is_closed
+    stats = registry.stats()
+    assert (stats["builds"], stats["invalidations"], stats["clients"]) == (2, 1, ["OLLAMA"])
+
+
+def test_each_provider_keeps_its_own_client():
+    registry = ProviderRegistry()
+    openai = ProviderConfig("OPENAI", "gpt-4o-mini", api_key="sk-test")
+    deepseek = ProviderConfig("DEEPSEEK", "deepseek-chat", api_key="sk-test", base_url="https://api.deepseek.com")
+    gemini = ProviderConfig("GEMINI", "gemini-pro", api_key="test", base_url="http://127.0.0.1:8765")
+    clients = _get(registry, openai, deepseek, gemini, OLLAMA, openai)
+    assert isinstance(clients[0], AsyncOpenAI) and clients[0].max_retries == 0
+    assert str(clients[1].base_url).startswith("https://api.deepseek.com")
+    assert isinstance(clients[2], httpx.AsyncClient)
+    assert clients[4] is clients[0]
+    assert registry.stats()["clients"] == ["DEEPSEEK", "GEMINI", "OLLAMA", "OPENAI"]
+
+
+def test_keepalive_and_timeout_settings(monkeypatch):
+    monkeypatch.setenv("LLM_KEEPALIVE_EXPIRY", "120")
+    monkeypatch.setenv("LLM_MAX_KEEPALIVE", "4")
+    registry = ProviderRegistry()
+    assert (registry.keepalive_expiry, registry.max_keepalive) == (120, 4)
+    client = registry._http_client(Timeouts(connect=2, total=30))
+    assert (client.timeout.connect, client.timeout.read) == (2, 30)
+
+
+def test_close_all_closes_every_client():
+    registry = ProviderRegistry()
+
+    async def scenario():
+        clients = [await registry.get(config, Timeouts()) for config in
+                   (OLLAMA, ProviderConfig("OPENAI", "gpt-4o-mini", api_key="sk-test"))]
+        await registry.close_all()
+        return clients
+
+    ollama, openai = asyncio.run(scenario())
+    assert ollama.is_closed and openai.is_closed()
+    assert registry.stats()["clients"] == []
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported provider"):
+        _get(ProviderRegistry(), ProviderConfig("ACME", "x"))
@@ -0,0 +1,54 @@
+import time
+
+from chatdb import engine
+from chatdb.query_control import RunningQuery, apply_statement_timeout, error_class
+
+
+class _Connection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.executed.append(sql)
+
+    def close(self):
+        pass
+
+
+def test_timeout_is_scoped_to_the_postgresql_transaction():
+    conn = _Connection()
+    apply_statement_timeout(conn, "postgresql", 2.5)
+    assert conn.executed == ["SET LOCAL statement_timeout = 2500"]
+
+
+def test_nothing_is_left_on_a_mysql_session():
+    # A session variable would outlive the query on the pooled connection, and kill open streams
+    conn = _Connection()
+    apply_statement_timeout(conn, "mysql", 30)
+    apply_statement_timeout(conn, "mysql", 0)
+    assert conn.executed == []
+
+
+def test_stream_left_open_outlives_the_budget(shop_db, monkeypatch):
+    monkeypatch.setenv("RESULT_PAGE_SIZE", "10")
+    control = RunningQuery("sqlite", shop_db.connect, timeout=0.2)
+    columns, data, error, stream = engine.execute_query(shop_db, "SELECT id FROM orders ORDER BY id", control)
+    assert error is None and len(data) == 10
+    time.sleep(0.4)
+    # The watchdog stopped with the first page: reading on is not a timeout
+    assert [row[0] for row in stream.fetch_page()] == list(range(11, 21))
+    assert not control.timed_out
+    stream.close()
+
+
+def test_slow_query_is_stopped_by_the_watchdog(shop_db):
+    control = RunningQuery("sqlite", shop_db.connect, timeout=0.2)
+    sql = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+           "SELECT COUNT(*) FROM n")
+    started = time.monotonic()
+    _, _, error, _ = engine.execute_query(shop_db, sql, control)
+    assert time.monotonic() - started < 5
+    assert error_class(error) == "timeout"
@@ -0,0 +1,47 @@
+import pytest
+
+from chatdb import engine
+from chatdb.llm_cache import get_sql_cache
+from chatdb.repair import RepairPolicy, build_repair_prompt, repair_query
+from mock_llm_server import MockLLMServer
+
+
+@pytest.fixture
+def mock_ollama(shop_db, monkeypatch):
+    with MockLLMServer(default_answer="SELECT nope FROM missing_table;") as server:
+        monkeypatch.setenv("OLLAMA_BASE_URL", server.url)
+        monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+        monkeypatch.delenv("HEDGE_PROVIDER", raising=False)
+        yield server, engine.Settings.from_env("OLLAMA")
+
+
+def _repair(settings, question):
+    return repair_query(settings, question, "SELECT * FROM missing", "no such table: missing",
+                        policy=RepairPolicy(max_attempts=2, attempt_timeout=10))
+
+
+def test_failing_candidates_are_not_cached(mock_ollama):
+    server, settings = mock_ollama
+    question = "how many orders are there (repair cache)"
+    result = _repair(settings, question)
+    assert [a["outcome"] for a in result.attempts] == ["failed", "duplicate"]
+    assert server.requests == 2
+
+    prompt = build_repair_prompt(question, [("SELECT * FROM missing", "no such table: missing")])
+    _, fingerprint = engine.load_prompt_prefix(settings, prompt)
+    assert get_sql_cache().get(settings.ai_provider, settings.model, settings.db_type, fingerprint, prompt) is None
+
+    # The same failure again asks the model again instead of replaying a cached candidate
+    _repair(settings, question)
+    assert server.requests == 4
+
+
+def test_fixed_answer_is_cached_for_the_question(mock_ollama):
+    server, settings = mock_ollama
+    server.default_answer = "SELECT COUNT(*) FROM orders;"
+    question = "how many orders are there (repair fixed)"
+    result = _repair(settings, question)
+    assert result.repaired
+    _, fingerprint = engine.load_prompt_prefix(settings, question)
+    cached = get_sql_cache().get(settings.ai_provider, settings.model, settings.db_type, fingerprint, question)
+    assert engine.extract_sql(cached) == "SELECT COUNT(*) FROM orders;"
@@ -0,0 +1,97 @@
+import pytest
+
+from chatdb import result_cache
+from chatdb.result_cache import ResultCache, canonicalize_sql, referenced_tables, statement_kind
+
+CONN = ("mysql", "db", 3306, "app", "shop")
+BACKSLASH = "SELECT * FROM t WHERE a = 'x\\' -- ' AND b = {}"
+
+
+def test_formatting_differences_share_a_key():
+    assert canonicalize_sql("SELECT  id\nFROM orders -- recent\nWHERE x = 'A  b';") == \
+        canonicalize_sql("select id from orders where x = 'A  b'")
+    assert canonicalize_sql("SELECT 'a' FROM t") != canonicalize_sql("SELECT 'A' FROM t")
+    assert canonicalize_sql("SELECT * FROM Orders") != canonicalize_sql("SELECT * FROM orders")
+
+
+@pytest.mark.parametrize("dialect", ["mysql", None])
+def test_backslash_escaped_literal_does_not_collide(dialect):
+    # In MySQL the literal runs to the second quote, so b = 1 and b = 2 are different queries
+    first, second = BACKSLASH.format(1), BACKSLASH.format(2)
+    assert canonicalize_sql(first, dialect) != canonicalize_sql(second, dialect)
+    if dialect == "mysql":
+        assert canonicalize_sql(first, dialect) == "select * from t where a = 'x\\' -- ' and b = 1"
+    else:
+        assert canonicalize_sql(first, dialect) == first
+
+    cache = ResultCache()
+    cache.put(CONN, first, ["a"], [(1,)], dialect)
+    assert cache.get(CONN, second, dialect) is None
+    assert cache.get(CONN, first, dialect) == (["a"], [(1,)])
+
+
+@pytest.mark.parametrize("dialect", ["sqlite", "postgresql"])
+def test_standard_literals_end_at_the_quote(dialect):
+    # Without backslash escapes the rest really is a comment: the same query
+    assert canonicalize_sql(BACKSLASH.format(1), dialect) == "select * from t where a = 'x\\'"
+    assert canonicalize_sql("SELECT E'x\\' -- ' AS a", "postgresql") == "select E'x\\' -- ' as a"
+
+
+def test_write_next_to_escaped_quote_is_classified():
+    sql = "WITH a AS (SELECT 'x\\') DELETE FROM orders -- ') SELECT * FROM a"
+    # In MySQL the DELETE is inside the literal; in SQLite it is the statement
+    assert statement_kind(sql, "mysql") == "select"
+    assert statement_kind(sql, "sqlite") == "delete"
+    # Unknown dialect: the write reading wins, and every entry is treated as touched
+    assert statement_kind(sql) == "delete"
+    assert referenced_tables(sql) == set()
+    assert referenced_tables("UPDATE orders SET note = 'it\\'s' WHERE id = 1", "mysql") == {"orders"}
+
+
+def test_write_invalidates_entries_reading_the_table():
+    cache = ResultCache()
+    cache.put(CONN, "SELECT * FROM orders o JOIN customers c ON c.id = o.customer_id", ["id"], [(1,)])
+    cache.put(CONN, "SELECT * FROM products", ["id"], [(2,)])
+    cache.put(("sqlite", "", 0, "", "other"), "SELECT * FROM customers", ["id"], [(3,)])
+
+    cache.invalidate(CONN, referenced_tables("UPDATE customers SET name = 'x'"))
+    assert cache.get(CONN, "SELECT * FROM orders o JOIN customers c ON c.id = o.customer_id") is None
+    assert cache.get(CONN, "SELECT * FROM products") is not None
+    assert cache.get(("sqlite", "", 0, "", "other"), "SELECT * FROM customers") is not None
+
+    # A write whose tables are unknown drops everything for the connection
+    cache.invalidate(CONN, set())
+    assert cache.get(CONN, "SELECT * FROM products") is None
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "time", lambda: now[0])
+    cache = ResultCache(ttl=60)
+    cache.put(CONN, "SELECT 1", ["1"], [(1,)])
+    now[0] += 59
+    assert cache.get(CONN, "SELECT 1") is not None
+    now[0] += 2
+    assert cache.get(CONN, "SELECT 1") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_evicted_entries_spill_and_are_promoted(tmp_path):
+    cache = ResultCache(max_entries=2, spill_path=str(tmp_path / "spill.sqlite"))
+    for i in range(3):
+        cache.put(CONN, f"SELECT * FROM orders WHERE id = {i}", ["id"], [(i,)])
+    stats = cache.stats()
+    assert (stats["entries"], stats["spilled_entries"], stats["spills"]) == (2, 1, 1)
+
+    # The oldest entry comes back from disk and is promoted, spilling the next oldest
+    assert cache.get(CONN, "SELECT * FROM orders WHERE id = 0") == (["id"], [(0,)])
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["entries"], stats["spilled_entries"]) == (1, 2, 1)
+    assert cache.get(CONN, "SELECT * FROM orders WHERE id = 0") == (["id"], [(0,)])
+    assert cache.stats()["hits"] == 1
+
+    # Spilled entries are invalidated by writes too
+    cache.invalidate(CONN, {"orders"})
+    assert cache.stats()["spilled_entries"] == 0
+    assert cache.get(CONN, "SELECT * FROM orders WHERE id = 1") is None
@@ -0,0 +1,60 @@
+import gc
+import os
+import time
+
+from chatdb.columnar import ColumnarResult
+from chatdb.result_store import ResultStore
+
+
+def test_results_round_trip_through_the_file(tmp_path):
+    store = ResultStore(str(tmp_path), hot_entries=1)
+    rows = ColumnarResult.from_rows("mysql", [("id", 8), ("name", 253)], [(1, "a"), (None, "b")])
+    first = store.put(rows)
+    second = store.put([(3, "c")])
+    # Only the last result stays in memory; the first is read back from SQLite
+    assert list(store._hot) == [second]
+    loaded = store.get(first)
+    assert loaded is not rows and list(loaded) == [(1, "a"), (None, "b")]
+    assert list(store._hot) == [first]
+    assert store.get(second) == [(3, "c")]
+    assert store.get(12345) is None
+
+
+def test_loading_more_rows_updates_the_stored_result(tmp_path):
+    store = ResultStore(str(tmp_path), hot_entries=1)
+    handle = store.put([(1,)])
+    store.update(handle, [(1,), (2,)])
+    other = store.put([(9,)])
+    assert store.get(handle) == [(1,), (2,)]
+    row_counts = dict(store._db.execute("SELECT id, row_count FROM results"))
+    assert row_counts == {handle: 2, other: 1}
+
+
+def test_file_is_removed_when_the_session_ends(tmp_path):
+    store = ResultStore(str(tmp_path))
+    path = store.path
+    store.put([(1,)])
+    assert os.path.exists(path)
+    store.close()
+    assert not os.path.exists(path)
+
+    # Streamlit drops the session state without calling close()
+    path = ResultStore(str(tmp_path)).path
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_stores_left_by_a_killed_server_are_cleaned_up(tmp_path, monkeypatch):
+    stale = tmp_path / "results_old.sqlite"
+    recent = tmp_path / "results_recent.sqlite"
+    other = tmp_path / "notes.txt"
+    for path in (stale, recent, other):
+        path.write_bytes(b"")
+    old = time.time() - 7200
+    os.utime(stale, (old, old))
+    os.utime(other, (old, old))
+    monkeypatch.setenv("RESULT_STORE_MAX_AGE", "3600")
+    store = ResultStore(str(tmp_path))
+    assert not stale.exists()
+    assert recent.exists() and other.exists()
+    store.close()
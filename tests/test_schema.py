@@ -0,0 +1,89 @@
+import sqlite3
+from contextlib import contextmanager
+
+from chatdb.schema import SchemaCatalog
+
+
+class _Cursor:
+    def __init__(self, results):
+        self._results = results
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self._rows = next(rows for marker, rows in self._results if marker in sql)
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class _Pool:
+    """Answers the catalog's queries from canned rows, picked by a marker in the SQL."""
+
+    def __init__(self, results):
+        self.results = results
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return _Cursor(self.results)
+
+
+def test_unanalyzed_postgresql_table_has_no_row_estimate(tmp_path):
+    pool = _Pool([
+        ("reltuples", [("orders", "r", "cols1", "cons1", -1, None),
+                       ("customers", "r", "cols2", "cons2", 1234, "people who order")]),
+        ("col_description", [("orders", "id", "integer", False, True, None),
+                             ("customers", "id", "integer", False, True, None)]),
+        ("confrelid", []),
+    ])
+    catalog = SchemaCatalog("postgresql", str(tmp_path / "schema.json"))
+    catalog.refresh(pool)
+    # -1 means never analyzed: saying "~0 rows" would tell the model the table is empty
+    assert catalog.describe_table("orders") == "orders(id integer PK NOT NULL)"
+    assert catalog.describe_table("customers") == "customers(id integer PK NOT NULL) -- ~1k rows -- people who order"
+
+
+def _sqlite_pool(path):
+    class Pool:
+        @contextmanager
+        def connection(self):
+            conn = sqlite3.connect(path)
+            try:
+                yield conn
+            finally:
+                conn.close()
+    return Pool()
+
+
+def test_only_changed_tables_are_reloaded(tmp_path):
+    path = str(tmp_path / "shop.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customers(id));
+    """)
+    pool = _sqlite_pool(path)
+    catalog = SchemaCatalog("sqlite", str(tmp_path / "schema.json"))
+    assert catalog.refresh(pool)
+    assert catalog.tables["orders"]["foreign_keys"] == [
+        {"columns": ["customer_id"], "ref_table": "customers", "ref_columns": ["id"]}]
+    fingerprint, revision = catalog.fingerprint(), catalog.revision
+
+    assert not catalog.refresh(pool, force=True)
+    assert (catalog.fingerprint(), catalog.revision) == (fingerprint, revision)
+
+    conn.execute("ALTER TABLE customers ADD COLUMN country TEXT")
+    conn.commit()
+    assert catalog.refresh(pool, force=True)
+    assert [c["name"] for c in catalog.tables["customers"]["columns"]] == ["id", "name", "country"]
+    assert (catalog.full_loads, catalog.incremental_refreshes, catalog.tables_reloaded) == (1, 1, 3)
+    assert catalog.fingerprint() != fingerprint and catalog.revision > revision
+
+    # A new catalog starts from the disk copy
+    assert SchemaCatalog("sqlite", str(tmp_path / "schema.json")).fingerprint() == catalog.fingerprint()
+    conn.close()
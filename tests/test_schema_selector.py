@@ -0,0 +1,43 @@
+from chatdb import engine
+from chatdb.schema_selector import SchemaSelector
+
+
+def _table(columns, refs=(), rows=None):
+    return {"columns": [{"name": c} for c in columns], "row_estimate": rows,
+            "foreign_keys": [{"ref_table": r} for r in refs]}
+
+
+TABLES = {
+    "customers": _table(["id", "name", "country"], rows=1000),
+    "products": _table(["id", "name", "price"], rows=50),
+    "orders": _table(["id", "customer_id", "product_id", "total"], ["customers", "products"], rows=-1),
+    "audit_log": _table(["id", "event"], rows=5000000),
+    "settings": _table(["key", "value"], rows=10),
+}
+
+
+def _describe(name):
+    return name + "(" + ", ".join(c["name"] for c in TABLES[name]["columns"]) + ")"
+
+
+def test_matching_tables_come_with_their_join_partners():
+    selected = SchemaSelector(TABLES).select("total price per customer", _describe)
+    assert {"customers", "orders", "products"} <= set(selected)
+    assert "settings" not in selected
+
+
+def test_no_matching_term_falls_back_to_hub_tables():
+    selector = SchemaSelector(TABLES)
+    assert selector.scores("how is the weather today") == {}
+    # Most foreign-key links first, then most rows; never an empty schema
+    assert selector.select("how is the weather today", _describe, top_k=3) == ["orders", "customers", "products"]
+    budget = len(_describe("orders")) // 4
+    assert selector.select("how is the weather today", _describe, token_budget=budget) == ["orders"]
+
+
+def test_prompt_keeps_schema_when_nothing_matches(shop_db, monkeypatch):
+    monkeypatch.setenv("SCHEMA_TOKEN_BUDGET", "80")
+    prefix, _ = engine.load_prompt_prefix(shop_db, "how is the weather today")
+    assert "Use only these tables and columns:" in prefix.text
+    assert 0 < prefix.schema_tokens <= 80
+    assert "orders(" in prefix.text
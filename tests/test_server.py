@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from chatdb import llm
+from chatdb.query_control import query_stats
+from chatdb.server import ApiServer
+from mock_llm_server import MockLLMServer
+
+SLOW_SQL = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+            "SELECT COUNT(*) FROM n")
+
+
+class Response:
+    def __init__(self, messages):
+        start = messages[0]
+        self.status = start["status"]
+        self.headers = {name.decode(): value.decode() for name, value in start["headers"]}
+        self.body = b"".join(m.get("body", b"") for m in messages[1:])
+
+    def json(self):
+        return json.loads(self.body)
+
+    def events(self):
+        return [json.loads(line) for line in self.body.decode().splitlines()]
+
+
+async def request(app, method, path, body=None, headers=(), disconnect_after=None):
+    """Drive one request through the ASGI app, as a server would."""
+    raw = json.dumps(body).encode() if body is not None else b""
+    messages = []
+    pending = [{"type": "http.request", "body": raw, "more_body": False}]
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path,
+             "headers": [(name.encode(), value.encode()) for name, value in headers]}
+    await app(scope, receive, send)
+    return Response(messages)
+
+
+def run(app, *args, **kwargs):
+    return asyncio.run(request(app, *args, **kwargs))
+
+
+@pytest.fixture
+def api(shop_db, monkeypatch):
+    """The API server's environment: a mock Ollama and the seeded shop database."""
+    with MockLLMServer(default_answer="SELECT COUNT(*) FROM orders;") as llm:
+        monkeypatch.setenv("AI_PROVIDER", "OLLAMA")
+        monkeypatch.setenv("OLLAMA_BASE_URL", llm.url)
+        monkeypatch.setenv("OLLAMA_HEARTBEAT_INTERVAL", "0")
+        monkeypatch.delenv("HEDGE_PROVIDER", raising=False)
+        monkeypatch.delenv("API_TOKEN", raising=False)
+        yield llm
+
+
+def test_bearer_token_is_required_when_set(api):
+    app = ApiServer(token="s3cret")
+    assert run(app, "GET", "/health").status == 401
+    assert run(app, "GET", "/health", headers=[("authorization", "Bearer wrong")]).status == 401
+    response = run(app, "GET", "/health", headers=[("authorization", "Bearer s3cret")])
+    assert response.status == 200 and response.json()["status"] == "ok"
+    response = run(app, "POST", "/execute", {"sql": "SELECT 1"})
+    assert response.status == 401 and "bearer token" in response.json()["error"]
+
+
+def test_requests_beyond_the_queue_get_503(api):
+    api.first_token_ms = 600
+    app = ApiServer(workers=1, max_queue=0, queue_timeout=5, token="")
+
+    async def scenario():
+        first = asyncio.ensure_future(request(app, "POST", "/generate", {"prompt": "count the orders (busy)"}))
+        await asyncio.sleep(0.2)
+        second = await request(app, "POST", "/generate", {"prompt": "count the orders (rejected)"})
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.status == 200 and first.json()["sql"] == "SELECT COUNT(*) FROM orders;"
+    assert second.status == 503
+    assert second.headers["retry-after"] == "1"
+    assert "queued" in second.json()["error"]
+    assert app.admission.stats()["rejected"] == 1
+
+
+def test_queued_request_times_out_with_503(api):
+    api.first_token_ms = 600
+    app = ApiServer(workers=1, max_queue=1, queue_timeout=0.1, token="")
+
+    async def scenario():
+        first = asyncio.ensure_future(request(app, "POST", "/generate", {"prompt": "count the orders (slow)"}))
+        await asyncio.sleep(0.1)
+        # Health checks bypass admission, so they answer while the server is saturated
+        second = await request(app, "GET", "/health")
+        third = await request(app, "POST", "/generate", {"prompt": "count the orders (waits)"})
+        return await first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first.status == 200
+    assert second.status == 200 and (second.json()["active"], second.json()["queued"]) == (1, 0)
+    assert third.status == 503 and "no worker free within 0.1s" in third.json()["error"]
+
+
+def test_rows_stream_as_ndjson_pages(api, monkeypatch):
+    monkeypatch.setenv("RESULT_PAGE_SIZE", "10")
+    app = ApiServer(token="")
+    response = run(app, "POST", "/execute", {"sql": "SELECT id FROM orders ORDER BY id", "stream": "ndjson",
+                                             "max_rows": 35})
+    assert response.status == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = response.events()
+    names = [event["event"] for event in events]
+    assert names == ["plan", "columns", "rows", "rows", "rows", "rows", "done"]
+    assert events[1]["columns"] == ["id"]
+    ids = [row[0] for event in events if event["event"] == "rows" for row in event["rows"]]
+    assert ids == list(range(1, 36))
+    assert events[-1]["row_count"] == 35 and events[-1]["truncated"] == "max rows"
+
+
+def test_client_disconnect_cancels_the_query(api, monkeypatch):
+    monkeypatch.setenv("PLAN_QUERIES", "0")
+    app = ApiServer(token="")
+    before = query_stats()["cancellations"]
+    started = time.monotonic()
+    response = run(app, "POST", "/execute", {"sql": SLOW_SQL, "stream": "ndjson"}, disconnect_after=0.3)
+    assert time.monotonic() - started < 3
+    assert response.status == 200
+    assert "done" not in [event["event"] for event in response.events()]
+    # The interrupted query ends on its worker shortly after
+    deadline = time.monotonic() + 5
+    while query_stats()["cancellations"] == before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert query_stats()["cancellations"] == before + 1
+
+
+def test_client_disconnect_cancels_the_generation(api):
+    api.first_token_ms = 2000
+    app = ApiServer(token="")
+    cancelled = llm._REQUESTS.values().get(("OLLAMA", "cancelled"), 0)
+    started = time.monotonic()
+    response = run(app, "POST", "/generate", {"prompt": "count the orders (gone)", "stream": "ndjson"},
+                   disconnect_after=0.2)
+    assert time.monotonic() - started < 1.5
+    assert response.events() == []
+    deadline = time.monotonic() + 5
+    while llm._REQUESTS.values().get(("OLLAMA", "cancelled"), 0) == cancelled and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert llm._REQUESTS.values().get(("OLLAMA", "cancelled"), 0) == cancelled + 1
+
+
+def test_ask_repairs_a_failing_query(api):
+    question = "how many orders are there (server repair)"
+    streamed = "how many orders are there (streamed repair)"
+    api.answers = {q: "SELECT COUNT(*) FROM missing_orders;" for q in (question, streamed)}
+    app = ApiServer(token="")
+
+    response = run(app, "POST", "/ask", {"prompt": question, "repair": True})
+    assert response.status == 200
+    result = response.json()
+    assert result["sql"] == "SELECT COUNT(*) FROM orders;"
+    assert result["rows"] == [[50]]
+    assert [attempt["outcome"] for attempt in result["repairs"]] == ["fixed"]
+
+    # The fix is cached for the question, so the streamed case asks another one
+    events = run(app, "POST", "/ask", {"prompt": streamed, "repair": True, "stream": "ndjson"}).events()
+    names = [event["event"] for event in events]
+    assert names.index("query_error") < names.index("repair") < names.index("columns")
+    assert events[names.index("repair")]["outcome"] == "fixed"
+    assert events[-1]["event"] == "done" and events[-1]["row_count"] == 1
+
+
+def test_repair_off_reports_the_error(api):
+    question = "how many orders are there (no repair)"
+    api.answers = {question: "SELECT COUNT(*) FROM missing_orders;"}
+    response = run(ApiServer(token=""), "POST", "/ask", {"prompt": question, "repair": False})
+    assert response.status == 400
+    assert "missing_orders" in response.json()["error"]
+    assert response.json()["sql"] == "SELECT COUNT(*) FROM missing_orders;"
@@ -0,0 +1,41 @@
+import pytest
+
+from chatdb.sql_extract import SqlExtractor, extract_sql, split_statements
+
+
+CASES = [
+    ("SELECT $tag$a;b$tag$;", ["SELECT $tag$a;b$tag$;"]),
+    ("SELECT $$a;b$$; SELECT 2;", ["SELECT $$a;b$$;", "SELECT 2;"]),
+    ("SELECT $a$x$b$y;$a$;", ["SELECT $a$x$b$y;$a$;"]),
+    ("```sql\nCREATE FUNCTION f() RETURNS int AS $body$\nBEGIN\n  RETURN 1;\nEND;\n$body$ LANGUAGE plpgsql;\n```",
+     ["CREATE FUNCTION f() RETURNS int AS $body$\nBEGIN\n  RETURN 1;\nEND;\n$body$ LANGUAGE plpgsql;"]),
+    ("SELECT * FROM t WHERE a = $1; SELECT 2;", ["SELECT * FROM t WHERE a = $1;", "SELECT 2;"]),
+    ("SELECT a$b$c FROM t; SELECT 3;", ["SELECT a$b$c FROM t;", "SELECT 3;"]),
+    ("```sql\n-- users\nSELECT * FROM users;\n```", ["-- users\nSELECT * FROM users;"]),
+    ("```\n/* top; spenders */\nSELECT 1 - -2 / 3 * 4;\n```", ["/* top; spenders */\nSELECT 1 - -2 / 3 * 4;"]),
+    ("SELECT 1 -- a; b\n, 2 FROM t;", ["SELECT 1 -- a; b\n, 2 FROM t;"]),
+    ("SELECT 'it''s; here' FROM t;", ["SELECT 'it''s; here' FROM t;"]),
+    ("Here it is:\n\nSELECT name\nFROM users\n\nThat lists them.", ["SELECT name\nFROM users"]),
+]
+
+
+@pytest.mark.parametrize("text, statements", CASES)
+def test_whole_text(text, statements):
+    assert split_statements(text) == statements
+
+
+@pytest.mark.parametrize("text, statements", CASES)
+def test_fed_one_character_at_a_time(text, statements):
+    extractor = SqlExtractor()
+    for ch in text:
+        extractor.feed(ch)
+    extractor.finish()
+    assert extractor.sql == extract_sql(text) == "\n".join(statements)
+
+
+def test_feed_reports_the_first_complete_statement():
+    extractor = SqlExtractor()
+    assert not extractor.feed("SELECT $q$;")
+    assert not extractor.feed(" still quoted $q")
+    assert extractor.feed("$;\nmore")
+    assert extractor.sql == "SELECT $q$; still quoted $q$;"
@@ -0,0 +1,48 @@
+import time
+
+from chatdb import engine
+from chatdb.streaming import _open_streams
+
+
+LARGE = "SELECT * FROM orders"
+
+
+def _open(settings, sql=LARGE):
+    columns, data, error, stream = engine.execute_query(settings, sql)
+    assert error is None and stream is not None
+    return stream
+
+
+def test_streams_use_their_own_pool(shop_db, monkeypatch):
+    monkeypatch.setenv("RESULT_PAGE_SIZE", "10")
+    stream = _open(shop_db)
+    assert stream._pool is shop_db.stream_pool()
+    assert shop_db.stream_pool() is not shop_db.pool()
+    assert shop_db.pool().stats()["in_use"] == 0
+    stream.close()
+
+
+def test_idle_stream_is_reaped(shop_db, monkeypatch):
+    monkeypatch.setenv("RESULT_PAGE_SIZE", "10")
+    stream = _open(shop_db)
+    in_use = shop_db.stream_pool().stats()["in_use"]
+    stream.last_used = time.monotonic() - 10
+    _open_streams.reap(5)
+    assert stream.closed
+    assert stream.truncated == "idle timeout"
+    assert shop_db.stream_pool().stats()["in_use"] == in_use - 1
+    assert stream.fetch_page() == []
+
+
+def test_full_stream_pool_reclaims_longest_idle_stream(shop_db, monkeypatch):
+    monkeypatch.setenv("RESULT_PAGE_SIZE", "10")
+    pool = shop_db.stream_pool()
+    streams = [_open(shop_db) for _ in range(pool.max_size - pool.stats()["in_use"])]
+    assert pool.exhausted()
+    streams[1].last_used -= 100  # the one nobody has read for longest
+    newest = _open(shop_db)
+    assert streams[1].closed and streams[1].truncated == "reclaimed"
+    assert not any(s.closed for i, s in enumerate(streams) if i != 1)
+    for s in streams + [newest]:
+        s.close()
+    assert pool.stats()["in_use"] == 0
@@ -0,0 +1,107 @@
+import contextvars
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from chatdb import tracing
+from chatdb.tracing import current_span, flush_exports, span, stage_stats, start_trace
+
+
+def test_spans_nest_without_being_passed_the_trace():
+    def stage():
+        with span("test.inner", rows=3):
+            current_span().set(cached=False)
+
+    with start_trace("test.request", provider="OLLAMA") as trace:
+        with span("test.outer"):
+            stage()
+        with span("test.after"):
+            pass
+    assert [(t["name"], t["depth"]) for t in trace.timings()] == [
+        ("test.request", 0), ("test.outer", 1), ("test.inner", 2), ("test.after", 1)]
+    assert trace.timings()[2]["attributes"] == {"rows": 3, "cached": False}
+    assert trace.ms >= sum(t["ms"] for t in trace.timings() if t["depth"] == 1)
+
+
+def test_spans_outside_a_trace_or_with_tracing_off_do_nothing(monkeypatch):
+    with span("test.orphan") as orphan:
+        orphan.set(ignored=True)
+    assert orphan.timings() == [] and current_span().trace_id is None
+    monkeypatch.setenv("TRACING", "0")
+    with start_trace("test.off") as trace:
+        with span("test.stage"):
+            pass
+    assert trace.timings() == []
+
+
+def test_worker_threads_join_the_submitting_trace():
+    def work(i):
+        with span("test.worker", item=i):
+            time.sleep(0.01)
+
+    with start_trace("test.pool") as trace:
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, work, i) for i in range(4)]
+            for future in futures:
+                future.result()
+        # Without the copied context a worker's spans are not part of any trace
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(work, 4).result()
+    workers = [t for t in trace.timings() if t["name"] == "test.worker"]
+    assert len(workers) == 4 and all(t["depth"] == 1 for t in workers)
+
+
+def test_errors_are_recorded_and_counted():
+    before = stage_stats().get("test.failing", {}).get("errors", 0)
+    with pytest.raises(ValueError):
+        with start_trace("test.request") as trace:
+            with span("test.failing"):
+                raise ValueError("no such table")
+    assert trace.timings()[1]["error"] == "ValueError: no such table"
+    assert stage_stats()["test.failing"]["errors"] == before + 1
+
+
+def test_finished_traces_are_exported_as_otlp_json(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("TRACE_EXPORT_PATH", str(path))
+    for i in range(3):
+        with start_trace("test.export", attempt=i, ratio=0.5, ok=True, note=None):
+            with span("test.stage", sql="SELECT 1"):
+                pass
+    flush_exports()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 3
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    inner, root = spans
+    assert root["name"] == "test.export" and "parentSpanId" not in root
+    assert inner["parentSpanId"] == root["spanId"] and inner["traceId"] == root["traceId"]
+    assert root["attributes"] == [{"key": "attempt", "value": {"intValue": "0"}},
+                                  {"key": "ratio", "value": {"doubleValue": 0.5}},
+                                  {"key": "ok", "value": {"boolValue": True}}]
+    assert int(root["startTimeUnixNano"]) <= int(inner["startTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+    assert abs(int(root["startTimeUnixNano"]) / 1e9 - time.time()) < 60
+
+
+def test_slow_request_is_logged_with_its_profile(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("TRACE_SLOW_MS", "50")
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    with caplog.at_level(logging.WARNING, logger="chatdb.tracing"):
+        with start_trace("test.fast"):
+            pass
+        with start_trace("test slow") as trace:
+            with span("test.sleep"):
+                time.sleep(0.08)
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith(f"Slow request test slow {trace.trace_id:032x} (thread ")
+    assert re.search(r" ms \[test\.sleep \d+ ms\], ", message)
+    profile = tmp_path / f"test_slow-{trace.trace_id:032x}.prof"
+    assert message.endswith(f", profile in {profile}") and profile.exists()
+    # Only the slow trace's profile is kept
+    assert len(list(tmp_path.iterdir())) == 1
+    assert not tracing._profiling._busy